@@ -0,0 +1,350 @@
+import itertools
+import json
+import threading
+import time
+
+from pipeline import new_stats, update_stats, stats_snapshot, talker_rows, CARDINALITY_KEYS
+
+# Statistics split into one shard per writer thread, merged on read.
+#
+# A shard's stats dict is only ever touched by the thread that owns it. Every
+# PUBLISH_INTERVAL (and whenever it goes idle) the owner builds an immutable
+# ShardView between two batches and swaps it in with a single reference
+# assignment. Readers merge the latest view of each shard and never take a
+# lock the writers use, so a reader can be as slow as it likes without
+# holding up capture, and a snapshot never mixes half of one batch with
+# another: each shard's part is exactly its state at a batch boundary.
+
+PUBLISH_INTERVAL = 0.25      # seconds between views while a shard is busy
+TOP_MERGE = 64               # heavy hitters per shard kept for merging
+TOP_TALKERS = 5
+
+TOP_KEYS = ("topSources", "topDestinations", "topPairs")
+SUMMED_KEYS = ("totalPackets", "packetsPerSecond", "bytesPerSecond", "anomalies", "activeFlows", "expiredFlows",
+               "flowTableMemory", "trackedHosts", "alerts", "cardinalityMemory")
+
+
+class ShardView:
+    __slots__ = ("time", "snapshot", "data_volume", "sketches", "recent", "tops", "alerts", "memory")
+
+    # Copies of the sketches and heavy hitters are only taken when another
+    # shard's view will be merged with this one; a lone shard's snapshot is
+    # the answer as it is. Without them sketches, recent and tops are None.
+    def __init__(self, s, now, mergeable=False):
+        self.time = now
+        self.snapshot = stats_snapshot(s, now)
+        self.data_volume = s["dataVolume"]
+        self.sketches = self.recent = self.tops = None
+        if mergeable:
+            self.sketches = {k: s[k].copy() for k in CARDINALITY_KEYS if k != "recentIPs"}
+            self.recent = s["recentIPs"].sketch(now)
+            self.tops = {k: s[k].top(TOP_MERGE) for k in TOP_KEYS}
+        self.alerts = tuple(s["alerts"])
+        self.memory = {
+            "flowTable": s["flows"].memory_bytes(),
+            "cardinality": sum(s[k].memory_bytes() for k in CARDINALITY_KEYS),
+            "detector": s["detector"].memory_bytes(),
+            "scanDetectors": s["scans"].memory_bytes() + s["synFlood"].memory_bytes()
+        }
+
+
+class StatsShard:
+    # Owned by one thread: only that thread may call update() or publish()
+    # or touch `stats`. Everyone else reads `view`.
+    def __init__(self, stats, publish_interval=PUBLISH_INTERVAL):
+        self.stats = stats
+        self.publish_interval = publish_interval
+        self.dirty = False
+        self.mergeable = False      # set by the aggregator once it has a second shard
+        self.published_at = 0.0
+        self.view = None
+        self.publish()
+
+    def update(self, records, scores=None):
+        scores = update_stats(self.stats, records, scores)
+        self.dirty = True
+        if time.monotonic() - self.published_at >= self.publish_interval:
+            self.publish()
+        return scores
+
+    # Call when the owner goes idle, so the last batch does not wait for the
+    # next one to become visible.
+    def publish_if_dirty(self):
+        if self.dirty:
+            self.publish()
+
+    def publish(self):
+        self.view = ShardView(self.stats, time.time(), self.mergeable)
+        self.dirty = False
+        self.published_at = time.monotonic()
+
+
+class StatsAggregator:
+    def __init__(self, publish_interval=PUBLISH_INTERVAL):
+        self.publish_interval = publish_interval
+        self.shards = ()
+        self.lock = threading.Lock()      # shard registration only
+        self.alert_ids = itertools.count(1)
+        self.alert_marks = {}
+        self.merged = (None, None)        # (views merged, result); swapped as one reference
+
+    # A new shard for the calling worker, which becomes its only writer. From
+    # the second shard on, every shard publishes mergeable views; one that
+    # already published a bare view does so again at its next publish.
+    def new_shard(self):
+        shard = StatsShard(new_stats(self.alert_ids), self.publish_interval)
+        with self.lock:
+            self.shards = self.shards + (shard,)
+            if len(self.shards) > 1:
+                for other in self.shards:
+                    if not other.mergeable:
+                        other.mergeable = other.dirty = True
+                shard.publish()
+        return shard
+
+    def views(self):
+        return [shard.view for shard in self.shards]
+
+    # The stats_snapshot() of everything the shards have published. Counters
+    # and rates add up, distinct counts merge their sketches, and heavy
+    # hitters are merged from each shard's top TOP_MERGE. The merge is redone
+    # only when some shard has published since the last one, so any number
+    # of readers costs about one merge per PUBLISH_INTERVAL.
+    def snapshot(self):
+        views = self.views()
+        if not views:
+            return {}
+        if len(views) == 1:
+            return dict(views[0].snapshot)
+        key = tuple(map(id, views))
+        merged_key, merged = self.merged
+        if merged_key != key:
+            merged = merge_views(views)
+            self.merged = (key, merged)
+        return dict(merged)
+
+    # Counters only, cheap enough for polling endpoints.
+    def totals(self):
+        views = self.views()
+        return {
+            "totalPackets": sum(v.snapshot["totalPackets"] for v in views),
+            "dataVolume": sum(v.data_volume for v in views),
+            "packetsPerSecond": sum(v.snapshot["packetsPerSecond"] for v in views),
+            "bytesPerSecond": sum(v.snapshot["bytesPerSecond"] for v in views),
+            "activeFlows": sum(v.snapshot["activeFlows"] for v in views)
+        }
+
+    def memory_usage(self):
+        out = {}
+        for view in self.views():
+            for k, v in view.memory.items():
+                out[k] = out.get(k, 0) + v
+        return out
+
+    # Alerts published since the previous call, oldest first. Meant for a
+    # single consumer (the session's broadcaster).
+    def new_alerts(self):
+        fresh = []
+        for shard in self.shards:
+            alerts = shard.view.alerts
+            mark = self.alert_marks.get(shard, 0)
+            if alerts and alerts[-1]["id"] > mark:
+                fresh.extend(a for a in alerts if a["id"] > mark)
+                self.alert_marks[shard] = alerts[-1]["id"]
+        fresh.sort(key=lambda a: a["id"])
+        return fresh
+
+
+def _sum_nested(a, b):
+    for k, v in b.items():
+        if isinstance(v, dict):
+            _sum_nested(a.setdefault(k, {}), v)
+        else:
+            a[k] = round(a.get(k, 0) + v, 2)
+    return a
+
+
+def _merge_tops(lists):
+    merged = {}
+    for entries in lists:
+        for e in entries:
+            m = merged.get(e["key"])
+            if m is None:
+                merged[e["key"]] = dict(e)
+            else:
+                for k in ("count", "error", "bytes", "bytesError"):
+                    m[k] += e[k]
+    return talker_rows(sorted(merged.values(), key=lambda e: e["count"], reverse=True)[:TOP_TALKERS])
+
+
+def merge_views(views):
+    out = dict(views[0].snapshot)
+    for k in SUMMED_KEYS:
+        out[k] = sum(v.snapshot[k] for v in views)
+    volume = sum(v.data_volume for v in views)
+    out["dataVolume"] = f"{volume//1024} KB"
+    rates, protocols = {}, {}
+    for v in views:
+        _sum_nested(rates, v.snapshot["rates"])
+        for p, n in v.snapshot["protocolDistribution"].items():
+            protocols[p] = protocols.get(p, 0) + n
+    out["rates"] = rates
+    out["protocolDistribution"] = protocols
+    # views published before the aggregator had a second shard carry no
+    # sketches; they are replaced at their shard's next publish
+    views = [v for v in views if v.sketches is not None]
+    if not views:
+        return out
+    for k, sketch in views[0].sketches.items():
+        merged = sketch.copy()
+        for v in views[1:]:
+            merged.merge(v.sketches[k])
+        out[k] = merged.estimate()
+        if k == "uniqueIPs":
+            out["uniqueExact"] = merged.is_exact()
+    recent = views[0].recent.copy()
+    for v in views[1:]:
+        recent.merge(v.recent)
+    out["uniqueIPsLast60s"] = recent.estimate()
+    for k in TOP_KEYS:
+        out[k] = _merge_tops(v.tops[k] for v in views)
+    return out
+
+
+# Synthetic record batches, as the ring hands them to the stats thread.
+def _batches(count, size=1024):
+    batches = []
+    for b in range(count):
+        batch = []
+        for i in range(size):
+            n = b * size + i
+            proto = (6, 17, 1, -1)[n % 4]
+            batch.append((n, 1000.0 + n * 1e-5, f"10.{n % 7}.{n % 31}.1", f"10.9.{n % 13}.1", proto,
+                          64 + n % 1400, 1024 + n % 5000, 80 + n % 3, 0x10, 0.0, None))
+        batches.append(batch)
+    return batches
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+# Writers fold the same batches into the stats while readers snapshot them as
+# fast as they can. "sharded" is this module; "locked" is one dict behind a
+# mutex shared by writers and readers; "unlocked" is one shared dict with no
+# synchronisation, which is what a single global stats dict amounts to.
+# Inconsistent snapshots are ones whose protocol counts do not add up to
+# totalPackets; lost packets are updates that vanished in a race. Readers
+# pause `read_interval` between snapshots (0 spins, which mostly measures
+# the GIL).
+def run_benchmark(mode="sharded", writers=1, readers=4, batches=100, batch_size=1024, read_interval=0.001):
+    data = _batches(batches, batch_size)
+    done = threading.Event()
+    stalls, latencies = [], []
+    errors = [0]
+    writer_errors = [0]
+    inconsistent = [0]
+    snapshots = [0]
+
+    if mode == "sharded":
+        agg = StatsAggregator()
+        shards = [agg.new_shard() for _ in range(writers)]
+        write = lambda w, batch: shards[w].update(batch)
+        read = agg.snapshot
+        finish = lambda: [s.publish_if_dirty() for s in shards]
+    elif mode == "locked":
+        shared, lock = new_stats(), threading.Lock()
+
+        def write(w, batch):
+            with lock:
+                update_stats(shared, batch)
+
+        def read():
+            with lock:
+                return stats_snapshot(shared, time.time())
+        finish = lambda: None
+    elif mode == "unlocked":
+        shared = new_stats()
+        write = lambda w, batch: update_stats(shared, batch)
+        read = lambda: stats_snapshot(shared, time.time())
+        finish = lambda: None
+    else:
+        raise ValueError(f"unknown mode {mode!r}")
+
+    def writer(w):
+        for batch in data[w::writers]:
+            t0 = time.perf_counter()
+            try:
+                write(w, batch)
+            except (RuntimeError, KeyError, IndexError, ValueError):
+                writer_errors[0] += 1       # only the unlocked shared dict gets here
+            stalls.append(time.perf_counter() - t0)
+
+    def reader():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            try:
+                snap = read()
+            except RuntimeError:        # dict changed size during iteration
+                errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - t0)
+            snapshots[0] += 1
+            if sum(snap["protocolDistribution"].values()) != snap["totalPackets"]:
+                inconsistent[0] += 1
+            if read_interval:
+                time.sleep(read_interval)
+
+    reader_threads = [threading.Thread(target=reader, daemon=True) for _ in range(readers)]
+    writer_threads = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+    for t in reader_threads:
+        t.start()
+    start = time.perf_counter()
+    for t in writer_threads:
+        t.start()
+    for t in writer_threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    finish()
+    done.set()
+    for t in reader_threads:
+        t.join()
+    final = read()
+
+    packets = batches * batch_size
+    return {
+        "mode": mode,
+        "writers": writers,
+        "readers": readers,
+        "readInterval": read_interval,
+        "packets": packets,
+        "packetsPerSecond": round(packets / elapsed, 1),
+        "writerBatchP50Ms": round(_percentile(stalls, 0.5) * 1000, 3),
+        "writerBatchP99Ms": round(_percentile(stalls, 0.99) * 1000, 3),
+        "writerBatchMaxMs": round(max(stalls) * 1000, 3),
+        "snapshots": snapshots[0],
+        "snapshotP50Ms": round(_percentile(latencies, 0.5) * 1000, 3),
+        "snapshotP99Ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "inconsistentSnapshots": inconsistent[0],
+        "readerErrors": errors[0],
+        "writerErrors": writer_errors[0],
+        "lostPackets": packets - final["totalPackets"]
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Contention benchmark for the sharded stats aggregator.")
+    parser.add_argument("--mode", choices=("sharded", "locked", "unlocked", "all"), default="all")
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, nargs="+", default=[0, 1, 4, 8])
+    parser.add_argument("--batches", type=int, default=100, help="Batches of 1024 records")
+    parser.add_argument("--read-interval", type=float, default=0.001, help="Seconds each reader waits between snapshots")
+    args = parser.parse_args()
+    modes = ("sharded", "locked", "unlocked") if args.mode == "all" else (args.mode,)
+    results = [run_benchmark(m, args.writers, r, args.batches, read_interval=args.read_interval)
+               for m in modes for r in args.readers]
+    print(json.dumps(results, indent=2))
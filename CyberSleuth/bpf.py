@@ -0,0 +1,70 @@
+import ctypes
+import socket
+import struct
+
+from fastpath import DLT_EN10MB
+
+SO_ATTACH_FILTER = 26
+SOL_PACKET = 263
+PACKET_STATISTICS = 6
+BPF_RET_K = 0x06
+
+SNAP_MIN = 64
+SNAP_MAX = 65535
+
+_tpacket_stats = struct.Struct("II")
+
+
+class _SockFilter(ctypes.Structure):
+    _fields_ = [("code", ctypes.c_ushort), ("jt", ctypes.c_ubyte), ("jf", ctypes.c_ubyte), ("k", ctypes.c_uint32)]
+
+
+class _SockFprog(ctypes.Structure):
+    _fields_ = [("len", ctypes.c_ushort), ("filter", ctypes.POINTER(_SockFilter))]
+
+
+# Compile a tcpdump-style expression into classic BPF as a list of
+# (code, jt, jf, k). Every accepting return is clamped to `snaplen`, which is
+# how the kernel is told to copy only the first snaplen bytes of a frame, so a
+# snap length works even with no expression (a single "ret #snaplen"). An
+# empty list means there is nothing to attach.
+# Raises ValueError for a bad expression or when libpcap is not available.
+def compile_bpf(expr, snaplen=SNAP_MAX, linktype=DLT_EN10MB):
+    if not expr:
+        return [(BPF_RET_K, 0, 0, snaplen)] if snaplen < SNAP_MAX else []
+    try:
+        from scapy.arch.common import compile_filter, free_filter
+        from scapy.error import Scapy_Exception
+    except ImportError as e:
+        raise ValueError(f"cannot compile BPF filter: {e}")
+    try:
+        bp = compile_filter(expr, linktype=linktype)
+    except ImportError as e:
+        raise ValueError(f"cannot compile BPF filter: {e}")
+    except Scapy_Exception as e:
+        raise ValueError(str(e))
+    try:
+        program = []
+        for i in range(bp.bf_len):
+            ins = bp.bf_insns[i]
+            k = ins.k & 0xFFFFFFFF
+            if ins.code == BPF_RET_K and k:
+                k = min(k, snaplen)
+            program.append((ins.code, ins.jt, ins.jf, k))
+    finally:
+        free_filter(bp)
+    return program
+
+
+def attach_bpf(sock, program):
+    insns = (_SockFilter * len(program))(*program)
+    fprog = _SockFprog(len(program), insns)
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, bytes(fprog))
+
+
+# Packets the socket has seen and dropped since the previous call; the kernel
+# resets both counters on every read. Drops here happened before userspace got
+# a chance, i.e. the socket receive buffer overflowed.
+def kernel_stats(sock):
+    packets, drops = _tpacket_stats.unpack(sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _tpacket_stats.size))
+    return packets, drops
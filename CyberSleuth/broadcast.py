@@ -0,0 +1,338 @@
+import ipaddress
+import json
+import threading
+import time
+from collections import deque
+
+from streaming import columnar, collect, StatsDelta, BATCH_MAX, BATCH_LATENCY, BEHIND_LIMIT
+
+DROP_OLDEST = "drop"
+DISCONNECT = "disconnect"
+
+SUBSCRIBER_QUEUE = 64        # frames buffered per client before the slow-client policy kicks in
+
+# Protocol names as pipeline.proto_name reports them; numeric names fall back
+# to "ip proto N".
+BPF_PROTOCOLS = {"TCP": "tcp", "UDP": "udp", "ICMP": "icmp or icmp6", "OTHER": "not (ip or ip6)"}
+
+
+class PacketFilter:
+    # Server-side filter on protocol name, exact IP or CIDR (either direction).
+    # Subscribers with equal filters share one serialised frame per batch.
+    def __init__(self, protocols=(), ips=(), cidrs=()):
+        self.protocols = frozenset(p.upper() for p in protocols if p)
+        self.ips = frozenset(ip for ip in ips if ip)
+        self.networks = tuple(ipaddress.ip_network(c, strict=False) for c in cidrs if c)
+        self.key = (self.protocols, self.ips, tuple(str(n) for n in self.networks))
+        self._in_networks = {}
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(args.getlist("protocol"), args.getlist("ip"), args.getlist("cidr"))
+
+    def is_empty(self):
+        return not (self.protocols or self.ips or self.networks)
+
+    def _address_match(self, addr):
+        if addr in self.ips:
+            return True
+        if not self.networks:
+            return False
+        hit = self._in_networks.get(addr)
+        if hit is None:
+            try:
+                ip = ipaddress.ip_address(addr)
+                hit = any(ip in n for n in self.networks)
+            except ValueError:
+                hit = False
+            if len(self._in_networks) > 65536:
+                self._in_networks.clear()
+            self._in_networks[addr] = hit
+        return hit
+
+    # The same filter as a kernel BPF expression, or "" when it does not narrow
+    # anything. A clause that cannot be expressed (an unknown protocol name, a
+    # partial address) is left out, so the kernel filter is never narrower
+    # than match().
+    def to_bpf(self):
+        clauses = []
+        protocols = []
+        for p in sorted(self.protocols):
+            if p in BPF_PROTOCOLS:
+                protocols.append(BPF_PROTOCOLS[p])
+            elif p.isdigit() and int(p) < 256:
+                protocols.append(f"ip proto {p} or ip6 proto {p}")
+            else:
+                protocols = None
+                break
+        if protocols:
+            clauses.append(" or ".join(f"({p})" for p in protocols))
+        hosts = []
+        for ip in sorted(self.ips):
+            try:
+                hosts.append(f"host {ipaddress.ip_address(ip)}")
+            except ValueError:
+                hosts = None
+                break
+        if hosts is not None and (hosts or self.networks):
+            hosts += [f"net {n}" for n in self.networks]
+            clauses.append(" or ".join(hosts))
+        return " and ".join(f"({c})" for c in clauses)
+
+    def match(self, row):
+        if self.protocols and row["protocol"].upper() not in self.protocols:
+            return False
+        if self.ips or self.networks:
+            return self._address_match(row["sourceIp"]) or self._address_match(row["destinationIp"])
+        return True
+
+
+class Subscriber:
+    def __init__(self, packet_filter=None, max_queue=SUBSCRIBER_QUEUE, policy=DROP_OLDEST):
+        self.filter = packet_filter or PacketFilter()
+        self.max_queue = max_queue
+        self.policy = policy
+        self.frames = deque()
+        self.ready = threading.Condition()
+        self.dropped_frames = 0
+        self.sent_frames = 0
+        self.needs_full_stats = True
+        self.closed = False
+
+    def offer(self, frame, kind):
+        with self.ready:
+            if self.closed:
+                return
+            if len(self.frames) >= self.max_queue:
+                if self.policy == DISCONNECT:
+                    self.closed = True
+                    self.ready.notify()
+                    return
+                _, old_kind = self.frames.popleft()
+                self.dropped_frames += 1
+                if old_kind == "stats":
+                    # the client missed a delta; resync with a full frame
+                    self.needs_full_stats = True
+            self.frames.append((frame, kind))
+            self.ready.notify()
+
+    def next_frame(self, timeout=1.0):
+        with self.ready:
+            if not self.frames and not self.closed:
+                self.ready.wait(timeout)
+            if self.frames:
+                self.sent_frames += 1
+                return self.frames.popleft()[0]
+            return None
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+
+
+class Broadcaster:
+    # One thread reads the ring, builds each batch once, serialises it once
+    # per distinct filter and hands the same string to every subscriber's
+    # queue. Slow subscribers only ever hurt themselves.
+    def __init__(self, ring, to_row, snapshot, new_flows=None, stats_interval=1.0,
+                 max_batch=BATCH_MAX, max_latency=BATCH_LATENCY, new_alerts=None, metrics=None):
+        self.ring = ring
+        self.to_row = to_row
+        self.snapshot = snapshot
+        self.new_flows = new_flows
+        self.new_alerts = new_alerts
+        self.metrics = metrics
+        self.serialise_hist = None
+        self.stats_interval = stats_interval
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.subscribers = ()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.cursor = None
+        self.running = False
+        self.serialisations = 0
+        self.published = 0          # records that went out in batch frames
+        self.sampled_out = 0        # records skipped by sampling while behind
+        self.departed_drops = 0     # frames dropped for subscribers that have since left
+        self.deltas = StatsDelta()
+
+    def subscribe(self, packet_filter=None, max_queue=SUBSCRIBER_QUEUE, policy=DROP_OLDEST):
+        sub = Subscriber(packet_filter, max_queue, policy)
+        with self.lock:
+            self.subscribers = self.subscribers + (sub,)
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return sub
+
+    def unsubscribe(self, sub):
+        sub.close()
+        with self.lock:
+            if any(s is sub for s in self.subscribers):
+                self.departed_drops += sub.dropped_frames
+                self.subscribers = tuple(s for s in self.subscribers if s is not sub)
+
+    # Frames dropped for slow subscribers since the broadcaster was made,
+    # including those of subscribers that have gone; never decreases.
+    def dropped_frames(self):
+        with self.lock:
+            return self.departed_drops + sum(s.dropped_frames for s in self.subscribers)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    def _dumps(self, obj):
+        self.serialisations += 1
+        if self.serialise_hist is None:
+            return json.dumps(obj)
+        t0 = time.perf_counter_ns()
+        frame = json.dumps(obj)
+        self.serialise_hist.record(time.perf_counter_ns() - t0)
+        return frame
+
+    def publish_batch(self, records, step=1):
+        subs = self.subscribers
+        if not records or not subs:
+            return
+        self.published += len(records)
+        self.sampled_out += len(records) * (step - 1)
+        rows = [self.to_row(rec) for rec in records]
+        groups = {}
+        for sub in subs:
+            groups.setdefault(sub.filter.key, [sub.filter, []])[1].append(sub)
+        for flt, members in groups.values():
+            selected = rows if flt.is_empty() else [r for r in rows if flt.match(r)]
+            if not selected:
+                continue
+            frame = self._dumps({"type": "batch", "sampleRate": step, "data": columnar(selected)})
+            for sub in members:
+                sub.offer(frame, "batch")
+
+    def publish_stats(self):
+        subs = self.subscribers
+        snap = self.snapshot()
+        changed, is_delta = self.deltas.diff(snap)
+        full = delta = None
+        for sub in subs:
+            if sub.needs_full_stats or not is_delta:
+                if full is None:
+                    full = self._dumps({"type": "stats", "delta": False, "data": snap})
+                sub.needs_full_stats = False
+                sub.offer(full, "stats")
+            else:
+                if delta is None:
+                    delta = self._dumps({"type": "stats", "delta": True, "data": changed})
+                sub.offer(delta, "stats")
+
+    def publish_flows(self):
+        if self.new_flows is None:
+            return
+        flows = self.new_flows()
+        if flows and self.subscribers:
+            frame = self._dumps({"type": "flows", "data": flows})
+            for sub in self.subscribers:
+                sub.offer(frame, "flows")
+
+    # Alerts skip the server-side packet filter: a client watching only UDP
+    # still wants to hear about a SYN flood.
+    def publish_alerts(self):
+        if self.new_alerts is None:
+            return
+        alerts = self.new_alerts()
+        if alerts and self.subscribers:
+            frame = self._dumps({"type": "alert", "data": alerts})
+            for sub in self.subscribers:
+                sub.offer(frame, "alert")
+
+    def _run(self):
+        cursor = self.cursor = self.ring.subscribe()
+        next_stats = time.monotonic()
+        queue_hist = None
+        if self.metrics is not None:
+            queue_hist = self.metrics.histogram("broadcast")
+            self.serialise_hist = self.metrics.histogram("serialise")
+        try:
+            while self.running:
+                records, step = collect(self.ring, cursor, self.max_batch, self.max_latency, next_stats, BEHIND_LIMIT)
+                if queue_hist is not None and records:
+                    queue_hist.record(int((time.time() - records[0][1]) * 1e9))
+                self.publish_batch(records, step)
+                self.publish_alerts()
+                if time.monotonic() >= next_stats:
+                    self.publish_flows()
+                    self.publish_stats()
+                    next_stats = time.monotonic() + self.stats_interval
+        finally:
+            self.ring.unsubscribe(cursor)
+
+
+def run_benchmark(clients=50, packets=200000, slow_clients=5):
+    from ringbuffer import PacketRing
+
+    ring = PacketRing(1 << 17)
+    protocols = ("TCP", "UDP", "ICMP")
+    to_row = lambda rec: {"id": rec[0], "timestamp": rec[1], "sourceIp": rec[2], "destinationIp": rec[3],
+                          "protocol": protocols[rec[4] % 3], "sourcePort": rec[6], "destinationPort": rec[7],
+                          "size": rec[5], "info": "", "anomalyScore": rec[9]}
+    b = Broadcaster(ring, to_row, lambda: {"totalPackets": ring.head}, stats_interval=0.5)
+    received = [0] * clients
+    done = threading.Event()
+
+    def client(i, sub, delay):
+        while not done.is_set():
+            frame = sub.next_frame(0.1)
+            if frame is not None:
+                received[i] += len(frame)
+                if delay:
+                    time.sleep(delay)
+
+    subs, threads = [], []
+    for i in range(clients):
+        flt = PacketFilter(protocols=("TCP",)) if i % 5 == 0 else None
+        sub = b.subscribe(flt)
+        delay = 0.05 if i < slow_clients else 0
+        t = threading.Thread(target=client, args=(i, sub, delay), daemon=True)
+        t.start()
+        subs.append(sub)
+        threads.append(t)
+
+    start = time.perf_counter()
+    for n in range(packets):
+        ring.push(n, time.time(), f"10.0.{n % 256}.1", "10.1.0.1", n % 3, 100, 1024, 80)
+        if n % 2000 == 0:
+            time.sleep(0.001)
+    while b.cursor is None or ring.pending(b.cursor):
+        time.sleep(0.01)
+    time.sleep(0.3)
+    elapsed = time.perf_counter() - start
+    done.set()
+    b.stop()
+    for t in threads:
+        t.join()
+
+    return {
+        "clients": clients,
+        "packets": packets,
+        "seconds": round(elapsed, 3),
+        "packetsPerSecond": round(packets / elapsed, 1),
+        "serialisations": b.serialisations,
+        "framesSent": sum(s.sent_frames for s in subs),
+        "framesDroppedSlowClients": sum(s.dropped_frames for s in subs[:slow_clients]),
+        "framesDroppedFastClients": sum(s.dropped_frames for s in subs[slow_clients:]),
+        "bytesDelivered": sum(received)
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Fan-out benchmark for the /ws broadcaster with simulated clients.")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--packets", type=int, default=200000)
+    parser.add_argument("--slow", type=int, default=5, help="Clients that sleep 50 ms per frame")
+    args = parser.parse_args()
+    print(json.dumps(run_benchmark(args.clients, args.packets, args.slow), indent=2))
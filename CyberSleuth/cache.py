@@ -0,0 +1,40 @@
+import threading
+from collections import OrderedDict
+
+
+# Bounded LRU of key -> (expires, value), safe to share between threads.
+# Expiry times are in whatever clock the caller passes as `now`. A None
+# value is a cached negative answer and counts as a negative hit.
+class TTLCache:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= now:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value, ttl, now):
+        with self.lock:
+            self.entries[key] = (now + ttl, value)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,481 @@
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from scapy.all import AsyncSniffer, Ether, IP, IPv6, CookedLinux, Raw, hexdump, conf
+
+from ringbuffer import PacketRing, OVERWRITE_OLDEST
+from store import SegmentWriter, SegmentReader, segment_paths, PACKETS, FLOWS
+from rawcapture import RawSniffer
+from broadcast import Broadcaster, PacketFilter
+from bpf import compile_bpf, attach_bpf, kernel_stats, SNAP_MIN, SNAP_MAX
+from fastpath import decode_frame, DLT_EN10MB, DLT_LINUX_SLL, DLT_RAW
+from pipeline import proto_name
+from aggregator import StatsAggregator, TOP_KEYS
+from metrics import SessionMetrics, TimedHandler, ENABLED as METRICS_ENABLED
+from enrich import shared_enricher, ENABLED as ENRICH_ENABLED
+
+RING_CAPACITY = 65536
+RING_POLICY = OVERWRITE_OLDEST   # or DROP_NEWEST to keep consumers lossless
+STORE_DIR = "captures"           # packet and flow segments, see store.py
+# Session ids restart at 1 with every server process, so segment prefixes
+# also carry the process's start time and pid; a new run never appends to,
+# or reads back, an earlier run's session of the same id.
+RUN_ID = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+CAPTURE_MODE = "scapy"           # "raw" reads frames off an AF_PACKET socket without scapy
+CAPTURE_MODES = ("scapy", "raw")
+STATS_INTERVAL = 1.0
+FLOW_EVENTS = 10000              # recently expired flows kept for /ws
+
+LINKTYPES = {Ether: DLT_EN10MB, CookedLinux: DLT_LINUX_SLL, IP: DLT_RAW, IPv6: DLT_RAW}
+
+IDLE = "idle"
+RUNNING = "running"
+STOPPED = "stopped"
+
+
+def _as_list(data, key):
+    value = data.get(key)
+    if value is None:
+        return []
+    values = [value] if isinstance(value, str) else value
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise ValueError(f"{key} must be a string or a list of strings")
+    return values
+
+
+def _as_str(data, key):
+    value = data.get(key)
+    if value is not None and not isinstance(value, str):
+        raise ValueError(f"{key} must be a string")
+    return value or None
+
+
+# Check a session's capture settings before anything is opened and compile
+# them into one kernel filter: the user's BPF expression AND'ed with the UI's
+# protocol/ip/cidr selection (PacketFilter.to_bpf), returned with the BPF
+# program it compiles to. Raises ValueError with a message fit for the API.
+def capture_config(data):
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    mode = _as_str(data, "mode") or CAPTURE_MODE
+    if mode not in CAPTURE_MODES:
+        raise ValueError(f"unknown capture mode: {mode}")
+    iface = _as_str(data, "iface")
+    if iface is not None and iface not in {name for _, name in socket.if_nameindex()}:
+        raise ValueError(f"unknown interface: {iface}")
+    try:
+        snaplen = int(data.get("snaplen") or SNAP_MAX)
+    except (TypeError, ValueError):
+        raise ValueError("snaplen must be an integer")
+    if not SNAP_MIN <= snaplen <= SNAP_MAX:
+        raise ValueError(f"snaplen must be between {SNAP_MIN} and {SNAP_MAX}")
+    bpf_filter = _as_str(data, "filter")
+    protocols, ips, cidrs = _as_list(data, "protocol"), _as_list(data, "ip"), _as_list(data, "cidr")
+    ui_filter = PacketFilter(protocols, ips, cidrs).to_bpf()
+    kernel_filter = " and ".join(f"({e})" for e in (bpf_filter, ui_filter) if e)
+    try:
+        program = compile_bpf(kernel_filter, snaplen)
+    except ValueError:
+        if not ui_filter:
+            raise
+        # Pushing the view filters down is only an optimisation (e.g. no
+        # libpcap to compile them); the view still filters on its own.
+        kernel_filter = bpf_filter or ""
+        program = compile_bpf(kernel_filter, snaplen)
+    return {
+        "mode": mode,
+        "iface": iface,
+        "filter": bpf_filter,
+        "snaplen": snaplen,
+        "protocol": protocols,
+        "ip": ips,
+        "cidr": cidrs,
+        "kernelFilter": kernel_filter,
+        "program": program
+    }
+
+
+def brief_info(proto_num, src, dst, sport, dport):
+    if proto_num < 0:
+        return ""
+    if sport or dport:
+        return f"{proto_name(proto_num)} {src}:{sport} > {dst}:{dport}"
+    return f"{proto_name(proto_num)} {src} > {dst}"
+
+
+# Ring slots hold frame bytes: Ethernet as they are, other link types as
+# (linktype, bytes). Scapy only dissects one when the UI opens it.
+def dissect(packet):
+    if isinstance(packet, tuple):
+        linktype, frame = packet
+        if linktype == DLT_LINUX_SLL:
+            packet = CookedLinux(frame)
+        elif linktype == DLT_RAW:
+            packet = IPv6(frame) if frame and frame[0] >> 4 == 6 else IP(frame)
+        else:
+            packet = Ether(frame)
+    elif isinstance(packet, bytes):
+        packet = Ether(packet)
+    headers = {}
+    layer = packet
+    while layer and not isinstance(layer, Raw):
+        headers[layer.name] = ", ".join(f"{k}={v}" for k, v in layer.fields.items())
+        layer = layer.payload
+    payload = hexdump(layer, dump=True) if layer else ""
+    return packet.summary(), headers, payload
+
+
+def packet_record(rec):
+    pid, timestamp, src, dst, proto_num, size, sport, dport, flags, score, packet = rec
+    return {
+        "id": pid,
+        "timestamp": timestamp,
+        "sourceIp": src,
+        "destinationIp": dst,
+        "protocol": proto_name(proto_num),
+        "sourcePort": sport,
+        "destinationPort": dport,
+        "size": size,
+        "info": brief_info(proto_num, src, dst, sport, dport),
+        "anomalyScore": round(score, 2)
+    }
+
+
+class CaptureSession:
+    # Everything one capture needs: its own sniffer, ring, stats, flow table,
+    # flow log and broadcaster. Sessions share nothing, so any number of them
+    # can capture at once without a global lock; each one's sniffer thread is
+    # the only producer on its ring and its stats thread the only writer of
+    # its stats shard. The lock only serialises start/stop of this session.
+    def __init__(self, sid, name, config=None,
+                 ring_capacity=RING_CAPACITY, ring_policy=RING_POLICY, store_dir=STORE_DIR, metrics=METRICS_ENABLED,
+                 enrich=ENRICH_ENABLED, run_id=RUN_ID):
+        self.id = sid
+        self.name = name
+        self.config = config or capture_config({})
+        self.store_dir = store_dir
+        self.run_id = run_id
+        self.state = IDLE
+        self.start_time = None
+        self.end_time = None
+
+        self.packet_id = 0      # only the sniffer thread increments this
+        self.ring = PacketRing(ring_capacity, ring_policy)
+        self.stats = StatsAggregator()
+        self.stats_shard = self.stats.new_shard()
+        self.sniffer = None
+        self.capture_socket = None
+        self.kernel_packets = 0
+        self.kernel_drops = 0
+        self.stats_thread = None
+        self.stats_cursor = None
+        self.stats_stop = threading.Event()
+        self.flow_events = deque(maxlen=FLOW_EVENTS)    # (seq, record)
+        self.flow_seq = 0
+        self.flow_sent = 0
+        self.lock = threading.Lock()
+        self.metrics = SessionMetrics() if metrics else None
+        self.enricher = shared_enricher() if enrich else None    # one name cache for all sessions
+        self.broadcaster = Broadcaster(self.ring, packet_record, self.live_snapshot, self.unsent_flows,
+                                       STATS_INTERVAL, new_alerts=self.unsent_alerts, metrics=self.metrics)
+
+    # Runs on scapy's sniffer thread: copy the hot fields into the ring and
+    # return. Summaries, stats and JSON all happen on the consumer side. The
+    # ring keeps the frame bytes, not scapy's dissected packet, which is many
+    # times larger; dissect() rebuilds it on demand.
+    def packet_handler(self, packet):
+        self.packet_id += 1
+        raw = bytes(packet)
+        linktype = LINKTYPES.get(type(packet), DLT_EN10MB)
+        src, dst, proto, sport, dport, flags = decode_frame(raw, 0, len(raw), linktype)
+        self.ring.push(self.packet_id, time.time(), src, dst, proto, packet.wirelen or len(raw),
+                       sport, dport, flags, raw if linktype == DLT_EN10MB else (linktype, raw))
+
+    # Raw mode: same ring record, but straight from the socket buffer. Only the
+    # frame bytes are kept; scapy sees them if and when the UI opens the packet.
+    def raw_packet_handler(self, frame, caplen, wirelen):
+        self.packet_id += 1
+        src, dst, proto, sport, dport, flags = decode_frame(frame, 0, caplen, DLT_EN10MB)
+        self.ring.push(self.packet_id, time.time(), src, dst, proto, wirelen, sport, dport, flags,
+                       bytes(frame[:caplen]))
+
+    def flow_expired(self, flow_store):
+        def emit(rec):
+            rec["protocol"] = proto_name(rec["proto"])
+            flow_store.append_dict(rec)
+            self.flow_seq += 1
+            self.flow_events.append((self.flow_seq, rec))
+        return emit
+
+    # Single consumer that folds ring records into this session's stats,
+    # scores them and persists them, so the sniffer thread never touches the
+    # stats or the disk. Scores go back into the ring, where the broadcaster
+    # waits for them. Readers only see the views the shard publishes.
+    def stats_worker(self, shard, cursor, stop, packet_store, flow_store):
+        ring = self.ring
+        flows = shard.stats["flows"]
+        flows.on_expire = self.flow_expired(flow_store)
+        append = packet_store.append
+        metrics = self.metrics
+        if metrics is not None:
+            ring_hist, stats_hist = metrics.histogram("ring"), metrics.histogram("stats")
+        last_sweep = 0
+        try:
+            while True:
+                records = ring.read(cursor, 4096)
+                if records:
+                    if metrics is not None:
+                        t0 = time.perf_counter_ns()
+                        read_at = time.time()
+                        for rec in records:
+                            ring_hist.record(int((read_at - rec[1]) * 1e9))
+                    scores = shard.update(records)
+                    ring.set_scores(cursor.seq, scores)
+                    for rec, score in zip(records, scores):
+                        append(rec[:9] + (score,))
+                    if metrics is not None:
+                        stats_hist.record(time.perf_counter_ns() - t0)
+                        metrics.sample_cpu("stats")
+                elif ring.scored != cursor.seq:
+                    ring.scored = cursor.seq        # skipped past overwritten records
+                now = time.time()
+                if now - last_sweep >= 1:
+                    self.poll_kernel_stats()
+                    flows.sweep(now)
+                    shard.dirty = True      # rates and flow counts move on with the clock
+                    packet_store.flush_if_stale()
+                    flow_store.flush_if_stale()
+                    last_sweep = now
+                if not records:
+                    shard.publish_if_dirty()
+                    if stop.is_set():
+                        break
+                    time.sleep(0.05)
+        finally:
+            ring.unsubscribe(cursor)
+            flows.flush()
+            shard.publish()
+            packet_store.close()
+            flow_store.close()
+            if metrics is not None:
+                metrics.retire()
+
+    # Both modes get the compiled program attached to their own AF_PACKET
+    # socket, so filtering and snaplen truncation happen in the kernel and the
+    # socket's drop counters can be read back. Scapy mode cannot see the wire
+    # length of a truncated frame; use raw mode when snaplen is set and byte
+    # counts matter.
+    def make_sniffer(self):
+        config = self.config
+        if config["mode"] == "raw":
+            handler = self.raw_packet_handler
+            if self.metrics is not None:
+                handler = TimedHandler(self.metrics, handler)
+            return RawSniffer(handler, iface=config["iface"], snaplen=config["snaplen"],
+                              program=config["program"])
+        handler = self.packet_handler
+        if self.metrics is not None:
+            handler = TimedHandler(self.metrics, handler, dissect=True)
+        if not hasattr(socket, "AF_PACKET"):
+            return AsyncSniffer(prn=handler, store=False, iface=config["iface"],
+                                filter=config["kernelFilter"] or None)
+        listen = conf.L2listen(iface=config["iface"], nofilter=1)
+        if config["program"]:
+            try:
+                attach_bpf(listen.ins, config["program"])
+            except OSError:
+                listen.close()
+                raise
+        self.capture_socket = listen
+        return AsyncSniffer(opened_socket=listen, prn=handler, store=False)
+
+    def kernel_socket(self):
+        if isinstance(self.sniffer, RawSniffer):
+            return self.sniffer.sock
+        if self.capture_socket is not None:
+            return self.capture_socket.ins
+        return None
+
+    def poll_kernel_stats(self):
+        sock = self.kernel_socket()
+        if sock is None:
+            return
+        try:
+            packets, drops = kernel_stats(sock)
+        except OSError:
+            return      # socket already closed
+        self.kernel_packets += packets
+        self.kernel_drops += drops
+
+    # Where packets were lost: in the kernel before we read them (socket
+    # buffer overflow), rejected by a full ring (drop-newest policy), or
+    # overwritten before the stats thread or the /ws broadcaster got to them.
+    def drops(self):
+        cursor = self.broadcaster.cursor
+        stats_cursor = self.stats_cursor
+        return {
+            "kernel": self.kernel_drops,
+            "ring": self.ring.dropped,
+            "stats": stats_cursor.missed if stats_cursor is not None else 0,
+            "clients": cursor.missed if cursor is not None else 0
+        }
+
+    # Records or frames waiting for each consumer of the ring.
+    def queue_depths(self):
+        cursor = self.broadcaster.cursor
+        stats_cursor = self.stats_cursor
+        return {
+            "ring": len(self.ring),
+            "stats": self.ring.pending(stats_cursor) if stats_cursor is not None else 0,
+            "broadcast": self.ring.pending(cursor) if cursor is not None else 0,
+            "clients": sum(len(sub.frames) for sub in self.broadcaster.subscribers)
+        }
+
+    # Settings can only change while the session is not capturing.
+    def configure(self, config):
+        with self.lock:
+            if self.state == RUNNING:
+                return False
+            self.config = config
+            return True
+
+    # Restarting a stopped session starts fresh stats and a new flow log but
+    # keeps the ring, so packet ids keep growing and open /ws clients stay
+    # attached. `sniffer` replaces the configured one with any object that
+    # has start()/stop() and feeds a handler (replay.py uses this).
+    def start(self, sniffer=None):
+        with self.lock:
+            if self.state == RUNNING:
+                return False
+            self.capture_socket = None
+            if sniffer is None:
+                sniffer = self.make_sniffer()
+            self.stats = StatsAggregator()
+            self.stats_shard = self.stats.new_shard()
+            self.kernel_packets = self.kernel_drops = 0
+            self.stats_stop = threading.Event()
+            self.stats_cursor = self.ring.subscribe()
+            self.ring.scored = self.stats_cursor.seq
+            stores = (SegmentWriter(self.store_prefix("packets"), PACKETS),
+                      SegmentWriter(self.store_prefix("flows"), FLOWS))
+            self.stats_thread = threading.Thread(target=self.stats_worker,
+                                                 args=(self.stats_shard, self.stats_cursor, self.stats_stop) + stores,
+                                                 daemon=True)
+            self.stats_thread.start()
+            try:
+                sniffer.start()
+            except Exception:
+                self.stats_stop.set()
+                if self.capture_socket is not None:
+                    self.capture_socket.close()
+                raise
+            self.sniffer = sniffer
+            self.state = RUNNING
+            self.start_time = time.time()
+            self.end_time = None
+            return True
+
+    def stop(self):
+        with self.lock:
+            if self.state != RUNNING:
+                return False
+            self.sniffer.stop()
+            self.poll_kernel_stats()
+            if self.capture_socket is not None:
+                self.capture_socket.close()
+            self.sniffer = None
+            self.stats_stop.set()
+            self.state = STOPPED
+            self.end_time = time.time()
+            return True
+
+    # Stop capturing and disconnect every /ws client of this session.
+    def close(self):
+        self.stop()
+        self.broadcaster.stop()
+        for sub in self.broadcaster.subscribers:
+            self.broadcaster.unsubscribe(sub)
+
+    def live_snapshot(self):
+        snap = self.stats.snapshot()
+        drops = self.drops()
+        snap["droppedPackets"] = drops["ring"] + drops["clients"]
+        snap["kernelDrops"] = drops["kernel"]
+        snap["drops"] = drops
+        snap["clients"] = len(self.broadcaster.subscribers)
+        if self.enricher is not None:
+            for k in TOP_KEYS:
+                if k in snap:
+                    snap[k] = self.enricher.annotate(snap[k])
+        return snap
+
+    def unsent_flows(self):
+        fresh = [(seq, flow) for seq, flow in list(self.flow_events) if seq > self.flow_sent]
+        if not fresh:
+            return []
+        self.flow_sent = fresh[-1][0]
+        flows = [flow for seq, flow in fresh]
+        return flows if self.enricher is None else self.enricher.annotate(flows)
+
+    def unsent_alerts(self):
+        return self.stats.new_alerts()
+
+    def store_prefix(self, kind):
+        return os.path.join(self.store_dir, f"session-{self.run_id}-{self.id}-{kind}")
+
+    # Historical packets from disk as UI rows, oldest first. Only chunks whose
+    # time range and address index can match are decompressed, and only one
+    # chunk is in memory at a time. Rows still waiting for their chunk to be
+    # written (at most store.CHUNK_SECONDS old) are not included.
+    def query_packets(self, start=None, end=None, ip=None, limit=None):
+        for rec in SegmentReader(self.store_prefix("packets"), PACKETS).query(start, end, ip, limit):
+            yield packet_record((rec["id"], rec["timestamp"], rec["src"], rec["dst"], rec["proto"], rec["size"],
+                                 rec["sport"], rec["dport"], rec["flags"], rec["score"], None))
+
+    def query_flows(self, start=None, end=None, ip=None, limit=None):
+        for rec in SegmentReader(self.store_prefix("flows"), FLOWS).query(start, end, ip, limit):
+            rec["protocol"] = proto_name(rec["proto"])
+            rec["anomalyScore"] = round(rec["anomalyScore"], 2)
+            yield rec
+
+    def disk_usage(self):
+        return sum(os.path.getsize(p) for kind in ("packets", "flows") for p in segment_paths(self.store_prefix(kind)))
+
+    def memory_usage(self):
+        memory = {"ring": self.ring.memory_bytes()}
+        memory.update(self.stats.memory_usage())
+        memory.update({
+            "clientQueues": sum(sum(len(f) for f, _ in list(sub.frames)) for sub in self.broadcaster.subscribers)
+        })
+        memory["total"] = sum(memory.values())
+        return memory
+
+    def info(self):
+        out = {
+            "id": self.id,
+            "name": self.name,
+            "startTime": self.start_time,
+            "endTime": self.end_time,
+            "state": self.state
+        }
+        out.update((k, v) for k, v in self.config.items() if k != "program")
+        return out
+
+    # Cheap enough to poll: no top-k or cardinality estimates, only counters,
+    # rates and the memory held by this session.
+    def throughput(self):
+        drops = self.drops()
+        out = self.info()
+        out.update(self.stats.totals())
+        out.update({
+            "buffered": len(self.ring),
+            "kernelPackets": self.kernel_packets,
+            "drops": drops,
+            "clients": len(self.broadcaster.subscribers),
+            "memory": self.memory_usage(),
+            "diskBytes": self.disk_usage()
+        })
+        return out
@@ -0,0 +1,185 @@
+import ipaddress
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import TTLCache
+
+try:
+    import maxminddb
+except ImportError:      # country / ASN fields are optional; hostnames need only the stdlib
+    maxminddb = None
+
+# Hostname, country and ASN for the addresses shown to clients. Nothing here
+# runs on a capture thread, and nothing blocks a reader: lookup() answers
+# from the cache, or returns None and queues the address for a small
+# resolver pool, so a new address goes out bare in one snapshot and with its
+# names in a later one. Answers, "nothing found" included, are cached with
+# a TTL in a bounded LRU shared by every session in the process.
+
+ENABLED = os.environ.get("CYBERSLEUTH_ENRICH", "1") != "0"
+REVERSE_DNS = os.environ.get("CYBERSLEUTH_RDNS", "1") != "0"    # 0: hosts file only
+HOSTS_FILE = os.environ.get("CYBERSLEUTH_HOSTS_FILE", "/etc/hosts")
+COUNTRY_DB = os.environ.get("CYBERSLEUTH_GEOIP_DB")     # GeoLite2-Country or -City .mmdb
+ASN_DB = os.environ.get("CYBERSLEUTH_ASN_DB")           # GeoLite2-ASN .mmdb
+
+CACHE_SLOTS = 65536          # addresses cached
+TTL = 3600.0                 # seconds an answer is kept
+NEGATIVE_TTL = 300.0         # seconds before an address with no answer is retried
+WORKERS = 4                  # resolver threads; gethostbyaddr blocks
+MAX_PENDING = 1024           # queued lookups; past this, new addresses wait for a later call
+
+# Row address fields and the key their enrichment is attached under.
+ROW_FIELDS = (("ip", "enrichment"), ("src", "srcEnrichment"), ("dst", "dstEnrichment"))
+
+
+def load_hosts(path):
+    hosts = {}
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                fields = line.split("#", 1)[0].split()
+                if len(fields) >= 2:
+                    hosts.setdefault(fields[0], fields[1])
+    except OSError:
+        pass
+    return hosts
+
+
+def open_db(path):
+    if not path or maxminddb is None:
+        return None
+    try:
+        return maxminddb.open_database(path)
+    except (OSError, ValueError):
+        return None
+
+
+class Enricher:
+    def __init__(self, workers=WORKERS, hosts_file=HOSTS_FILE, reverse_dns=REVERSE_DNS,
+                 country_db=COUNTRY_DB, asn_db=ASN_DB, capacity=CACHE_SLOTS):
+        self.cache = TTLCache(capacity)
+        self.hosts = load_hosts(hosts_file) if hosts_file else {}
+        self.reverse_dns = reverse_dns
+        self.country_db = open_db(country_db)
+        self.asn_db = open_db(asn_db)
+        self.workers = workers
+        self.pool = None
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.found = 0
+        self.empty = 0
+        self.skipped = 0
+
+    # Cached enrichment for `ip`, or None. A miss queues the address.
+    def lookup(self, ip):
+        found, info = self.cache.get(ip, time.monotonic())
+        if not found:
+            self.submit(ip)
+        return info
+
+    def submit(self, ip):
+        with self.lock:
+            if ip in self.pending:
+                return
+            if len(self.pending) >= MAX_PENDING:
+                self.skipped += 1
+                return
+            self.pending.add(ip)
+            if self.pool is None:
+                self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="enrich")
+        self.pool.submit(self.resolve, ip)
+
+    def resolve(self, ip):
+        try:
+            info = self.describe(ip)
+        except Exception:
+            info = None
+        self.cache.put(ip, info, TTL if info else NEGATIVE_TTL, time.monotonic())
+        with self.lock:
+            self.pending.discard(ip)
+            if info:
+                self.found += 1
+            else:
+                self.empty += 1
+
+    def describe(self, ip):
+        try:
+            addr = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        info = {}
+        name = self.hosts.get(ip)
+        if name is None and self.reverse_dns:
+            try:
+                name = socket.gethostbyaddr(ip)[0]
+            except (OSError, UnicodeError):
+                name = None
+        if name:
+            info["hostname"] = name
+        if addr.is_global:
+            if self.country_db is not None:
+                rec = self.country_db.get(ip) or {}
+                country = rec.get("country") or rec.get("registered_country") or {}
+                if country.get("iso_code"):
+                    info["country"] = country["iso_code"]
+            if self.asn_db is not None:
+                rec = self.asn_db.get(ip) or {}
+                if rec.get("autonomous_system_number"):
+                    info["asn"] = rec["autonomous_system_number"]
+                    info["asOrg"] = rec.get("autonomous_system_organization")
+        return info or None
+
+    # Copies of UI rows (top talkers, flows) with whatever is cached for
+    # their addresses attached; the rows themselves may be shared with a
+    # cached snapshot and are not modified.
+    def annotate(self, rows):
+        out = []
+        for row in rows:
+            extra = {}
+            for field, key in ROW_FIELDS:
+                addr = row.get(field)
+                if addr is not None:
+                    info = self.lookup(addr)
+                    if info is not None:
+                        extra[key] = info
+            out.append(dict(row, **extra) if extra else row)
+        return out
+
+    def stats(self):
+        cache = self.cache
+        lookups = cache.hits + cache.negative_hits + cache.misses
+        return {
+            "hits": cache.hits,
+            "negativeHits": cache.negative_hits,
+            "misses": cache.misses,
+            "hitRate": round((cache.hits + cache.negative_hits) / lookups, 4) if lookups else 0.0,
+            "entries": len(cache),
+            "evictions": cache.evictions,
+            "pending": len(self.pending),
+            "found": self.found,
+            "empty": self.empty,
+            "skipped": self.skipped
+        }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+# The process-wide Enricher, created on first use; None when disabled.
+def shared_enricher():
+    global _shared
+    if not ENABLED:
+        return None
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = Enricher()
+    return _shared
+
+
+def current():
+    return _shared
@@ -0,0 +1,114 @@
+import socket
+import struct
+
+DLT_NULL = 0
+DLT_EN10MB = 1
+DLT_RAW = 101
+DLT_LINUX_SLL = 113
+DLT_IPV4 = 228
+DLT_IPV6 = 229
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+VLAN_TYPES = (0x8100, 0x88A8, 0x9100)
+IPV6_EXT_HEADERS = (0, 43, 60)   # hop-by-hop, routing, destination options
+IPV6_FRAGMENT = 44
+
+NON_IP = ("?", "?", -1, 0, 0, 0)
+
+_u16 = struct.Struct("!H").unpack_from
+_ports = struct.Struct("!HH").unpack_from
+_addr_cache = {}
+
+
+def _addr(family, raw):
+    s = _addr_cache.get(raw)
+    if s is None:
+        if len(_addr_cache) > 65536:
+            _addr_cache.clear()
+        s = _addr_cache[raw] = socket.inet_ntop(family, raw)
+    return s
+
+
+def _l4(buf, o, end, proto):
+    if proto == 6 and o + 14 <= end:
+        sport, dport = _ports(buf, o)
+        return sport, dport, buf[o + 13]
+    if proto == 17 and o + 4 <= end:
+        sport, dport = _ports(buf, o)
+        return sport, dport, 0
+    return 0, 0, 0
+
+
+def _ipv4(buf, o, end):
+    if o + 20 > end:
+        return NON_IP
+    ihl = (buf[o] & 0x0F) * 4
+    proto = buf[o + 9]
+    src = _addr(socket.AF_INET, bytes(buf[o + 12:o + 16]))
+    dst = _addr(socket.AF_INET, bytes(buf[o + 16:o + 20]))
+    if _u16(buf, o + 6)[0] & 0x1FFF:
+        return src, dst, proto, 0, 0, 0     # non-first fragment carries no L4 header
+    return (src, dst, proto) + _l4(buf, o + ihl, end, proto)
+
+
+def _ipv6(buf, o, end):
+    if o + 40 > end:
+        return NON_IP
+    proto = buf[o + 6]
+    src = _addr(socket.AF_INET6, bytes(buf[o + 8:o + 24]))
+    dst = _addr(socket.AF_INET6, bytes(buf[o + 24:o + 40]))
+    o += 40
+    while o + 8 <= end:
+        if proto in IPV6_EXT_HEADERS:
+            proto, o = buf[o], o + (buf[o + 1] + 1) * 8
+        elif proto == IPV6_FRAGMENT:
+            if _u16(buf, o + 2)[0] & 0xFFF8:
+                return src, dst, buf[o], 0, 0, 0
+            proto, o = buf[o], o + 8
+        else:
+            break
+    return (src, dst, proto) + _l4(buf, o, end, proto)
+
+
+def _by_ethertype(buf, o, end, ethertype):
+    while ethertype in VLAN_TYPES and o + 4 <= end:
+        ethertype = _u16(buf, o + 2)[0]
+        o += 4
+    if ethertype == ETH_P_IP:
+        return _ipv4(buf, o, end)
+    if ethertype == ETH_P_IPV6:
+        return _ipv6(buf, o, end)
+    return NON_IP
+
+
+def _by_version(buf, o, end):
+    if o >= end:
+        return NON_IP
+    version = buf[o] >> 4
+    if version == 4:
+        return _ipv4(buf, o, end)
+    if version == 6:
+        return _ipv6(buf, o, end)
+    return NON_IP
+
+
+# Reads only the fields the capture pipeline needs straight out of the frame
+# bytes. Returns (src, dst, proto, sport, dport, tcp_flags); non-IP frames give
+# NON_IP. `buf` can be bytes, a memoryview or an mmap.
+def decode_frame(buf, offset=0, end=None, linktype=DLT_EN10MB):
+    if end is None:
+        end = len(buf)
+    if linktype == DLT_EN10MB:
+        if offset + 14 > end:
+            return NON_IP
+        return _by_ethertype(buf, offset + 14, end, _u16(buf, offset + 12)[0])
+    if linktype == DLT_LINUX_SLL:
+        if offset + 16 > end:
+            return NON_IP
+        return _by_ethertype(buf, offset + 16, end, _u16(buf, offset + 14)[0])
+    if linktype in (DLT_RAW, DLT_IPV4, DLT_IPV6, 12, 14):
+        return _by_version(buf, offset, end)
+    if linktype == DLT_NULL:
+        return _by_version(buf, offset + 4, end)
+    return NON_IP
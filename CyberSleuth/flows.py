@@ -0,0 +1,140 @@
+import json
+import os
+from array import array
+from collections import OrderedDict
+
+TCP_FIN = 0x01
+TCP_RST = 0x04
+
+
+class FlowTable:
+    # NetFlow-style 5-tuple aggregation. Per-flow counters live in parallel
+    # arrays indexed by slot; slots come from a free list, so memory is fixed at
+    # construction. The key index is kept in least-recently-seen order, which
+    # makes idle expiry a pop from the front instead of a full scan.
+    def __init__(self, capacity=131072, idle_timeout=15.0, active_timeout=1800.0, on_expire=None):
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self.active_timeout = active_timeout
+        self.on_expire = on_expire
+
+        self.keys = [None] * capacity
+        self.packets = array("q", bytes(8 * capacity))
+        self.bytes = array("q", bytes(8 * capacity))
+        self.first_seen = array("d", bytes(8 * capacity))
+        self.last_seen = array("d", bytes(8 * capacity))
+        self.flags = array("B", bytes(capacity))
+        self.scores = array("f", bytes(4 * capacity))     # highest packet anomaly score in the flow
+        self.free = array("l", range(capacity - 1, -1, -1))
+        self.index = OrderedDict()
+
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def update(self, timestamp, src, dst, sport, dport, proto, size, flags=0, score=0.0):
+        key = (src, dst, sport, dport, proto)
+        i = self.index.get(key)
+        # Expire on the packet's own clock as well as in sweep(), so results do
+        # not depend on how often the caller sweeps.
+        if i is not None:
+            if timestamp - self.last_seen[i] >= self.idle_timeout:
+                self._expire(key, "idle")
+                i = None
+            elif timestamp - self.first_seen[i] >= self.active_timeout:
+                self._expire(key, "active")
+                i = None
+        if i is None:
+            if not self.free:
+                self._expire(next(iter(self.index)), "evicted")
+                self.evicted += 1
+            i = self.free.pop()
+            self.keys[i] = key
+            self.index[key] = i
+            self.packets[i] = 0
+            self.bytes[i] = 0
+            self.first_seen[i] = timestamp
+            self.flags[i] = 0
+            self.scores[i] = 0.0
+            self.created += 1
+        else:
+            self.index.move_to_end(key)
+        self.packets[i] += 1
+        self.bytes[i] += size
+        self.last_seen[i] = timestamp
+        self.flags[i] |= flags
+        if score > self.scores[i]:
+            self.scores[i] = score
+        if flags & (TCP_FIN | TCP_RST):
+            self._expire(key, "end")
+
+    def sweep(self, now):
+        index, last_seen = self.index, self.last_seen
+        while index:
+            key = next(iter(index))
+            if now - last_seen[index[key]] < self.idle_timeout:
+                break
+            self._expire(key, "idle")
+
+    def flush(self):
+        while self.index:
+            self._expire(next(iter(self.index)), "flush")
+
+    def record(self, i, reason=None):
+        src, dst, sport, dport, proto = self.keys[i]
+        rec = {
+            "src": src,
+            "dst": dst,
+            "sport": sport,
+            "dport": dport,
+            "proto": proto,
+            "packets": self.packets[i],
+            "bytes": self.bytes[i],
+            "firstSeen": self.first_seen[i],
+            "lastSeen": self.last_seen[i],
+            "tcpFlags": self.flags[i],
+            "anomalyScore": round(self.scores[i], 2)
+        }
+        if reason is not None:
+            rec["reason"] = reason
+        return rec
+
+    def _expire(self, key, reason):
+        i = self.index.pop(key)
+        self.expired += 1
+        if self.on_expire is not None:
+            self.on_expire(self.record(i, reason))
+        self.keys[i] = None
+        self.free.append(i)
+
+    def active(self, n=None):
+        slots = list(self.index.values())
+        if n is not None:
+            slots = slots[-n:]
+        return [self.record(i) for i in slots]
+
+    def memory_bytes(self):
+        arrays = (self.packets, self.bytes, self.first_seen, self.last_seen, self.flags, self.scores, self.free)
+        return sum(a.itemsize for a in arrays) * self.capacity + 8 * self.capacity
+
+    def __len__(self):
+        return len(self.index)
+
+
+class FlowLog:
+    # Append-only JSON-lines sink for expired flow records.
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, rec):
+        self.file.write(json.dumps(rec) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,267 @@
+import os
+import threading
+import time
+from array import array
+
+import enrich
+import verdicts
+
+# Capture-path instrumentation, exposed in Prometheus text format by
+# /api/metrics. Set CYBERSLEUTH_METRICS=0 to turn it off: sessions then get
+# no SessionMetrics at all, the packet handlers are not wrapped and every
+# other timing point is a single `is not None` check per batch or frame.
+
+ENABLED = os.environ.get("CYBERSLEUTH_METRICS", "1") != "0"
+
+SUB_BITS = 3                 # 8 linear sub-buckets per power of two: <= 12.5% relative error
+SUB = 1 << SUB_BITS
+BUCKETS = (64 - SUB_BITS) * SUB
+EXPORT_BOUNDS = tuple(1 << k for k in range(10, 37))   # ~1 us .. ~69 s, in ns; powers of two are bucket edges
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+CPU_SAMPLE = 1024            # handler calls between sniffer CPU-time samples
+
+# Stages a packet goes through, in order:
+#   dissect    socket read to handler entry: kernel queueing plus scapy
+#              dissection (scapy mode only)
+#   handler    the packet handler on the sniffer thread
+#   ring       ring push until the stats thread reads the record
+#   stats      one stats / scoring / persistence batch on the stats thread
+#   broadcast  ring push until the /ws broadcaster reads it (oldest record
+#              of each batch, so it includes scoring and batching delay)
+#   serialise  JSON encoding of one /ws frame
+#   send       one WebSocket send
+STAGES = ("dissect", "handler", "ring", "stats", "broadcast", "serialise", "send")
+
+
+class LatencyHistogram:
+    # HDR-style log-linear histogram of nanosecond values: every power of two
+    # is split into SUB equal buckets, so any recorded value is known to
+    # within 1/SUB of itself from 1 ns to centuries in a fixed array. Written
+    # by one thread; others only read.
+    def __init__(self):
+        self.counts = array("q", bytes(8 * BUCKETS))
+        self.count = 0
+        self.total = 0
+
+    def record(self, ns):
+        if ns < 0:
+            ns = 0
+        if ns < 2 * SUB:
+            i = ns
+        else:
+            shift = ns.bit_length() - SUB_BITS - 1
+            i = shift * SUB + (ns >> shift)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ns
+
+    def merge(self, other):
+        counts = self.counts
+        for i, n in enumerate(other.counts):
+            if n:
+                counts[i] += n
+        self.count += other.count
+        self.total += other.total
+
+
+def bucket_upper(i):
+    if i < 2 * SUB:
+        return i + 1
+    shift = i // SUB - 1
+    return (i % SUB + SUB + 1) << shift
+
+
+def quantile(hist, q):
+    if not hist.count:
+        return 0
+    rank = q * hist.count
+    seen = 0
+    for i, n in enumerate(hist.counts):
+        seen += n
+        if n and seen >= rank:
+            return bucket_upper(i)
+    return bucket_upper(BUCKETS - 1)
+
+
+class SessionMetrics:
+    # Per-stage histograms for one capture session. Each thread records into
+    # its own histogram per stage (several /ws handler threads all record
+    # "send"), and exposition merges them, so recording never takes a lock.
+    # A thread that is about to exit calls retire(), which folds its
+    # histograms into one per stage, so per-connection threads do not pile up.
+    def __init__(self):
+        self.lock = threading.Lock()        # registration, retirement and merging
+        self.histograms = {stage: () for stage in STAGES}
+        self.retired = {stage: LatencyHistogram() for stage in STAGES}
+        self.local = threading.local()
+        self.cpu = {}                       # thread role -> CPU seconds of every thread that held it
+
+    def histogram(self, stage):
+        mine = getattr(self.local, "histograms", None)
+        if mine is None:
+            mine = self.local.histograms = {}
+        h = mine.get(stage)
+        if h is None:
+            h = mine[stage] = LatencyHistogram()
+            with self.lock:
+                self.histograms[stage] = self.histograms[stage] + (h,)
+        return h
+
+    def retire(self):
+        mine = getattr(self.local, "histograms", None)
+        if not mine:
+            return
+        with self.lock:
+            for stage, h in mine.items():
+                self.retired[stage].merge(h)
+                self.histograms[stage] = tuple(x for x in self.histograms[stage] if x is not h)
+        self.local.histograms = {}
+
+    def merged(self, stage):
+        out = LatencyHistogram()
+        with self.lock:
+            out.merge(self.retired[stage])
+            for h in self.histograms[stage]:
+                out.merge(h)
+        return out
+
+    # Adds the CPU time this thread used since its last sample, so the total
+    # keeps growing when start() replaces a role's thread with a new one.
+    def sample_cpu(self, role):
+        now = time.thread_time()
+        last = getattr(self.local, "cpu", 0.0)
+        self.local.cpu = now
+        self.cpu[role] = self.cpu.get(role, 0.0) + now - last
+
+
+class TimedHandler:
+    # Wraps a sniffer callback. Only used when metrics are on; otherwise the
+    # sniffer gets the bare handler.
+    def __init__(self, metrics, handler, dissect=False):
+        self.metrics = metrics
+        self.handler = handler
+        self.dissect = dissect
+        self.calls = 0
+        self.hist = self.dissect_hist = None
+
+    def __call__(self, *args):
+        if self.hist is None:       # first call, on the sniffer thread
+            self.hist = self.metrics.histogram("handler")
+            self.dissect_hist = self.metrics.histogram("dissect")
+        t0 = time.perf_counter_ns()
+        if self.dissect:
+            self.dissect_hist.record(int((time.time() - float(args[0].time)) * 1e9))
+        self.handler(*args)
+        self.hist.record(time.perf_counter_ns() - t0)
+        self.calls += 1
+        if self.calls % CPU_SAMPLE == 1:
+            self.metrics.sample_cpu("sniffer")
+
+
+def _labels(**labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+def _seconds(ns):
+    return f"{ns / 1e9:.9g}"
+
+
+class Exposition:
+    # Collects samples grouped by metric family, so each family's HELP/TYPE
+    # header is written once however many sessions report it.
+    def __init__(self):
+        self.families = {}
+
+    def add(self, name, kind, help_text, labels, value, suffix=""):
+        family = self.families.setdefault(name, (kind, help_text, []))
+        family[2].append(f"{name}{suffix}{_labels(**labels)} {value}")
+
+    def histogram(self, name, help_text, labels, hist):
+        cumulative, i = 0, 0
+        for bound in EXPORT_BOUNDS:
+            while i < BUCKETS and bucket_upper(i) <= bound:
+                cumulative += hist.counts[i]
+                i += 1
+            self.add(name, "histogram", help_text, dict(labels, le=_seconds(bound)), cumulative, "_bucket")
+        self.add(name, "histogram", help_text, dict(labels, le="+Inf"), hist.count, "_bucket")
+        self.add(name, "histogram", help_text, labels, _seconds(hist.total), "_sum")
+        self.add(name, "histogram", help_text, labels, hist.count, "_count")
+
+    def render(self):
+        lines = []
+        for name, (kind, help_text, samples) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# Prometheus text exposition for a set of CaptureSessions.
+def render(sessions):
+    out = Exposition()
+    out.add("cybersleuth_metrics_enabled", "gauge", "Whether capture-path latency instrumentation is on",
+            {}, int(ENABLED))
+    enricher = enrich.current()
+    if enricher is not None:
+        e = enricher.stats()
+        for result, key in (("hit", "hits"), ("negative", "negativeHits"), ("miss", "misses")):
+            out.add("cybersleuth_enrichment_lookups_total", "counter",
+                    "Address enrichment cache lookups; negative hits are cached 'nothing found' answers",
+                    {"result": result}, e[key])
+        out.add("cybersleuth_enrichment_hit_ratio", "gauge", "Share of enrichment lookups answered by the cache",
+                {}, e["hitRate"])
+        for result, key in (("found", "found"), ("empty", "empty"), ("skipped", "skipped")):
+            out.add("cybersleuth_enrichment_resolutions_total", "counter",
+                    "Background resolutions, and addresses not queued because the queue was full",
+                    {"result": result}, e[key])
+        out.add("cybersleuth_enrichment_cache_entries", "gauge", "Addresses in the enrichment cache", {}, e["entries"])
+        out.add("cybersleuth_enrichment_cache_evictions_total", "counter", "Addresses evicted from the enrichment cache",
+                {}, e["evictions"])
+        out.add("cybersleuth_enrichment_pending", "gauge", "Addresses waiting for a resolver thread", {}, e["pending"])
+    cache = verdicts.current()
+    if cache is not None:
+        v = cache.stats()
+        for result, key in (("hit", "hits"), ("disk", "diskHits"), ("miss", "misses")):
+            out.add("cybersleuth_verdict_lookups_total", "counter",
+                    "Phishing verdict cache lookups, by the layer that answered them",
+                    {"result": result}, v[key])
+        out.add("cybersleuth_verdict_stale_total", "counter",
+                "Cached verdicts ignored because they came from an older model", {}, v["stale"])
+        out.add("cybersleuth_verdict_hit_ratio", "gauge", "Share of verdict lookups answered by the cache",
+                {}, v["hitRate"])
+        out.add("cybersleuth_verdict_cache_entries", "gauge", "Verdicts in the in-memory cache", {}, v["entries"])
+        out.add("cybersleuth_verdict_cache_evictions_total", "counter", "Verdicts evicted from the in-memory cache",
+                {}, v["evictions"])
+    for session in sessions:
+        sid = {"session": session.id}
+        totals = session.stats.totals()
+        out.add("cybersleuth_packets_total", "counter", "Packets folded into the session's stats",
+                sid, totals["totalPackets"])
+        out.add("cybersleuth_bytes_total", "counter", "Bytes folded into the session's stats",
+                sid, totals["dataVolume"])
+        for consumer, depth in session.queue_depths().items():
+            out.add("cybersleuth_queue_depth", "gauge", "Records or frames waiting for a consumer",
+                    dict(sid, queue=consumer), depth)
+        for where, n in session.drops().items():
+            out.add("cybersleuth_drops_total", "counter",
+                    "Packets lost: in the kernel, at a full ring, or overwritten before a consumer read them",
+                    dict(sid, where=where), n)
+        out.add("cybersleuth_client_frames_dropped_total", "counter", "/ws frames dropped for slow clients",
+                sid, session.broadcaster.dropped_frames())
+        metrics = session.metrics
+        if metrics is None:
+            continue
+        for role, seconds in list(metrics.cpu.items()):
+            out.add("cybersleuth_thread_cpu_seconds_total", "counter",
+                    "CPU time of the session's threads, sampled by each thread", dict(sid, thread=role), seconds)
+        for stage in STAGES:
+            hist = metrics.merged(stage)
+            out.histogram("cybersleuth_stage_latency_seconds", "Latency per capture-path stage",
+                          dict(sid, stage=stage), hist)
+            for q in QUANTILES:
+                out.add("cybersleuth_stage_latency_quantile_seconds", "gauge",
+                        "Latency quantiles per stage from the HDR histogram (upper bucket edge)",
+                        dict(sid, stage=stage, quantile=q), _seconds(quantile(hist, q)))
+    return out.render()
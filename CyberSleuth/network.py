@@ -1,144 +1,239 @@
-from flask import Flask, render_template, jsonify,request
+from flask import Flask, render_template, jsonify,request, Response, stream_with_context
 from flask_sock import Sock
-from scapy.all import AsyncSniffer, IP
-import threading
-import queue
-import time
-import random
+import itertools
 import json
+import time
+from broadcast import PacketFilter, DROP_OLDEST, DISCONNECT
+from capture import CaptureSession, capture_config, packet_record, dissect
+import metrics
+
+try:
+    import scoring
+except ImportError:      # the phishing endpoint needs scikit-learn, pandas, tldextract and validators
+    scoring = None
 
 app = Flask(__name__)
 sock = Sock(app)
 
-packet_id = 0
-packet_queue = queue.Queue()
-sniffer = None        # Global sniffer object
-sniffing = False      # Control flag
-
-stats = {
-    "totalPackets": 0,
-    "packetsPerSecond": 0,
-    "anomalies": 0,
-    "dataVolume": 0,
-    "uniqueIPs": set(),
-    "protocolDistribution": {},
-    "topSources": []
-}
-
-IP_PROTO_MAP = {1: "ICMP", 6: "TCP", 17: "UDP"}
-
-def packet_handler(packet):
-    global packet_id, stats
-    packet_id += 1
-    timestamp = time.time()
-
-    proto = "Other"
-    size = len(packet)
-    src = "?"
-    dst = "?"
-    info = ""
-    if IP in packet:
-        src = packet[IP].src
-        dst = packet[IP].dst
-        proto_num = packet[IP].proto
-        proto = IP_PROTO_MAP.get(proto_num, str(proto_num))
-        info = packet.summary()
-
-    pkt = {
-        "id": packet_id,
-        "timestamp": timestamp,
-        "sourceIp": src,
-        "destinationIp": dst,
-        "protocol": proto,
-        "size": size,
-        "info": info,
-        "anomalyScore": round(size % 100 / 100, 2)
-    }
-    packet_queue.put(pkt)
-    stats["totalPackets"] += 1
-    stats["dataVolume"] += size
-    stats["anomalies"] += 1 if pkt["anomalyScore"] > 0.7 else 0
-    stats["uniqueIPs"].update([src, dst])
-    stats["protocolDistribution"][proto] = stats["protocolDistribution"].get(proto, 0) + 1
-    stats["topSources"].append({"ip": src, "count": 1})
-
 @app.route("/")
 def index():
     return render_template("index.html")
 
-sessions = {}
-next_session_id = 1
+sessions = {}         # id -> CaptureSession
+session_ids = itertools.count(1)   # next() is atomic, so concurrent creates never share an id
 
 @app.route("/api/sessions", methods=["POST"])
 def create_session():
-    global next_session_id
-    data = request.get_json()
-    session_id = next_session_id
-    next_session_id += 1
-
-    session = {
-        "id": session_id,
-        "name": data.get("name", f"Session {session_id}"),
-        "startTime": None,
-        "endTime": None
-    }
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "expected a JSON object"}), 400
+    name = data.get("name")
+    if name is not None and not isinstance(name, str):
+        return jsonify({"error": "name must be a string"}), 400
+    try:
+        config = capture_config(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    session_id = next(session_ids)
+
+    session = CaptureSession(session_id, name or f"Session {session_id}", config)
     sessions[session_id] = session
 
-    return jsonify(session), 201
-
+    return jsonify(session.info()), 201
+
+# Live per-session throughput and memory, cheap enough to poll.
+@app.route("/api/sessions", methods=["GET"])
+def list_sessions():
+    return jsonify([s.throughput() for s in list(sessions.values())])
+
+@app.route("/api/sessions/<int:sid>", methods=["GET"])
+def session_detail(sid):
+    session = sessions.get(sid)
+    if session is None:
+        return jsonify({"error": "no such session"}), 404
+    return jsonify(session.throughput())
+
+@app.route("/api/sessions/<int:sid>", methods=["DELETE"])
+def delete_session(sid):
+    session = sessions.pop(sid, None)
+    if session is None:
+        return jsonify({"error": "no such session"}), 404
+    session.close()
+    return jsonify({"result": "deleted"})
+
+# The start body may override any of the session's capture settings (mode,
+# iface, filter, snaplen, protocol/ip/cidr); all of them are validated and
+# the filter compiled before the sniffer is opened.
 @app.route("/api/sessions/<int:sid>/start", methods=["POST"])
 def start_capture(sid):
-    global sniffer, sniffing, stats, packet_id  # Also clear data here if needed
-    if not sniffing:
-        # Optionally reset stats and packet_id
-        stats = {
-            "totalPackets": 0,
-            "packetsPerSecond": 0,
-            "anomalies": 0,
-            "dataVolume": 0,
-            "uniqueIPs": set(),
-            "protocolDistribution": {},
-            "topSources": []
-        }
-        packet_id = 0
-        with packet_queue.mutex:
-            packet_queue.queue.clear()
-        sniffer = AsyncSniffer(prn=packet_handler, store=False)
-        sniffer.start()
-        sniffing = True
+    session = sessions.get(sid)
+    if session is None:
+        return jsonify({"error": "no such session"}), 404
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"error": "expected a JSON object"}), 400
+    if data:
+        try:
+            config = capture_config({**session.config, **data})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        session.configure(config)
+    try:
+        session.start()
+    except (ValueError, OSError) as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify({"result": "started"})
 
 @app.route("/api/sessions/<int:sid>/stop", methods=["POST"])
 def stop_capture(sid):
-    global sniffer, sniffing
-    if sniffing and sniffer is not None:
-        sniffer.stop()
-        sniffer = None
-        sniffing = False
+    session = sessions.get(sid)
+    if session is None:
+        return jsonify({"error": "no such session"}), 404
+    session.stop()
     return jsonify({"result": "stopped"})
 
+EXPORT_BATCH = 1000   # records per streamed write
+
+def query_args(args):
+    return args.get("start", type=float), args.get("end", type=float), args.get("ip") or None
+
+def json_array(records):
+    sep = ""
+    batch = []
+    for rec in records:
+        batch.append(json.dumps(rec))
+        if len(batch) >= EXPORT_BATCH:
+            yield sep + ",".join(batch)
+            sep, batch = ",", []
+    if batch:
+        yield sep + ",".join(batch)
+
+# Whole session (or ?start=&end=&ip= slice of it) from the on-disk store,
+# streamed as one JSON document; nothing is collected in memory first.
+@app.route("/api/sessions/<int:sid>/export")
+def export_session(sid):
+    session = sessions.get(sid)
+    if session is None:
+        return jsonify({"error": "no such session"}), 404
+    start, end, ip = query_args(request.args)
+
+    def generate():
+        yield '{"session":' + json.dumps(session.info()) + ',"packets":['
+        yield from json_array(session.query_packets(start, end, ip))
+        yield '],"flows":['
+        yield from json_array(session.query_flows(start, end, ip))
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype="application/json",
+                    headers={"Content-Disposition": f"attachment; filename=session-{sid}.json"})
+
+# Historical query, e.g. ?ip=10.0.0.5&start=t1&end=t2&kind=flows, streamed
+# as JSON lines.
+@app.route("/api/sessions/<int:sid>/history")
+def session_history(sid):
+    session = sessions.get(sid)
+    if session is None:
+        return jsonify({"error": "no such session"}), 404
+    start, end, ip = query_args(request.args)
+    limit = request.args.get("limit", type=int)
+    query = session.query_flows if request.args.get("kind") == "flows" else session.query_packets
+
+    def generate():
+        for rec in query(start, end, ip, limit):
+            yield json.dumps(rec) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+@app.route("/api/sessions/<int:sid>/packets/<int:pid>")
+def packet_detail(sid, pid):
+    session = sessions.get(sid)
+    rec = session.ring.find(pid) if session is not None else None
+    if rec is None or rec[-1] is None:
+        return jsonify({"error": "packet no longer buffered"}), 404
+    detail = packet_record(rec)
+    detail["info"], detail["headers"], detail["payload"] = dissect(rec[-1])
+    return jsonify(detail)
+
+# Prometheus scrape target: queue depths and drops for every session, plus
+# per-stage latency histograms and thread CPU time unless the server was
+# started with CYBERSLEUTH_METRICS=0.
+@app.route("/api/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(list(sessions.values())), mimetype="text/plain; version=0.0.4")
+
+# {"url": "..."} (or ?url=) scores one URL and returns its result; {"urls":
+# [...]} returns {"results": [...]} in the same order. Results carry the
+# canonical URL that was scored (tracking parameters stripped, host
+# lowercased), the prediction, the probability and every feature value. Single requests
+# arriving together are scored as one batch; Server-Timing says how long
+# this request queued and how long its batch took per stage, X-Batch-Size
+# how many URLs that batch held and X-Cache-Hits how many URLs were answered
+# from the verdict cache without scoring.
+@app.route("/api/phishing/score", methods=["GET", "POST"])
+def phishing_score():
+    if scoring is None:
+        return jsonify({"error": "phishing model dependencies are not installed"}), 503
+    started = time.perf_counter()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    single = "urls" not in data
+    urls = [data.get("url") or request.args.get("url")] if single else data["urls"]
+    if not isinstance(urls, list) or not urls or not all(isinstance(u, str) and u for u in urls):
+        return jsonify({"error": "expected a non-empty \"url\" string or \"urls\" list of strings"}), 400
+    if len(urls) > scoring.MAX_URLS:
+        return jsonify({"error": f"at most {scoring.MAX_URLS} URLs per request"}), 413
+    try:
+        results, timing = scoring.score(urls)
+    except OSError as e:
+        return jsonify({"error": f"phishing model unavailable: {e}"}), 503
+    resp = jsonify(results[0] if single else {"results": results})
+    ms = lambda seconds: f"{seconds * 1000:.3f}"
+    resp.headers["Server-Timing"] = (f"queue;dur={ms(timing['queue'])}, features;dur={ms(timing['features'])}, "
+                                     f"predict;dur={ms(timing['predict'])}, total;dur={ms(time.perf_counter() - started)}")
+    resp.headers["X-Batch-Size"] = str(timing["batch"])
+    resp.headers["X-Cache-Hits"] = str(timing["cacheHits"])
+    return resp
+
+# Each client gets frames from one session's broadcaster (?session=<id>,
+# default the newest session), optionally narrowed by
+# ?protocol=TCP&ip=10.0.0.5&cidr=10.0.0.0/8 (repeatable). ?slow=disconnect
+# drops the connection instead of old frames when the client can't keep up.
 @sock.route("/ws")
 def ws(ws):
-    while True:
-        try:
-            while not packet_queue.empty():
-                pkt = packet_queue.get()
-                ws.send(json.dumps({"type": "packet", "data": pkt}))
-
-            stats_data = {
-                "totalPackets": stats["totalPackets"],
-                "packetsPerSecond": random.randint(5, 50),
-                "anomalies": stats["anomalies"],
-                "dataVolume": f"{stats['dataVolume']//1024} KB",
-                "uniqueIPs": len(stats["uniqueIPs"]),
-                "protocolDistribution": stats["protocolDistribution"],
-                "topSources": stats["topSources"][-5:]
-            }
-            ws.send(json.dumps({"type": "stats", "data": stats_data}))
-            time.sleep(2)
-        except Exception as e:
-            print("WebSocket closed:", e)
-            break
+    sid = request.args.get("session", type=int)
+    if sid is None and sessions:
+        sid = max(sessions)
+    session = sessions.get(sid)
+    if session is None:
+        ws.send(json.dumps({"type": "error", "data": "no such session"}))
+        return
+    broadcaster = session.broadcaster
+    try:
+        packet_filter = PacketFilter.from_args(request.args)
+    except ValueError as e:
+        ws.send(json.dumps({"type": "error", "data": str(e)}))
+        return
+    policy = DISCONNECT if request.args.get("slow") == DISCONNECT else DROP_OLDEST
+    sub = broadcaster.subscribe(packet_filter, policy=policy)
+    send_hist = session.metrics.histogram("send") if session.metrics is not None else None
+    try:
+        while ws.connected and not sub.closed:
+            frame = sub.next_frame(1.0)
+            if frame is None:
+                continue
+            if send_hist is None:
+                ws.send(frame)
+            else:
+                t0 = time.perf_counter_ns()
+                ws.send(frame)
+                send_hist.record(time.perf_counter_ns() - t0)
+    except Exception as e:
+        print("WebSocket closed:", e)
+    finally:
+        broadcaster.unsubscribe(sub)
+        if session.metrics is not None:
+            session.metrics.retire()
 
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,159 @@
+import json
+import os
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from pcapfile import CaptureFile
+from fastpath import decode_frame
+from flows import FlowLog
+from pipeline import new_stats, update_stats, proto_name, stats_snapshot
+from anomaly import np
+
+CHUNK_PACKETS = 50000
+
+
+# Worker side: walk one byte range of the capture and return its packets as
+# columns. Runs in a child process, so it reopens (and re-mmaps) the file.
+def decode_chunk(task):
+    path, start, end, state = task
+    timestamps, sizes = array("d"), array("l")
+    protos, sports, dports, flags = array("h"), array("l"), array("l"), array("B")
+    srcs, dsts = [], []
+    with CaptureFile(path) as cap:
+        mm = cap.mm
+        for ts, off, caplen, origlen, linktype in cap.records(start, end, state):
+            src, dst, proto, sport, dport, tcp_flags = decode_frame(mm, off, off + caplen, linktype)
+            timestamps.append(ts)
+            sizes.append(origlen)
+            srcs.append(src)
+            dsts.append(dst)
+            protos.append(proto)
+            sports.append(sport)
+            dports.append(dport)
+            flags.append(tcp_flags)
+    return timestamps, srcs, dsts, protos, sizes, sports, dports, flags
+
+
+def chunk_records(cols, first_id):
+    timestamps, srcs, dsts, protos, sizes, sports, dports, flags = cols
+    ids = range(first_id, first_id + len(timestamps))
+    zeros = [0.0] * len(timestamps)
+    nones = [None] * len(timestamps)
+    return list(zip(ids, timestamps, srcs, dsts, protos, sizes, sports, dports, flags, zeros, nones))
+
+
+def decoded_chunks(path, workers=None, per_chunk=CHUNK_PACKETS):
+    with CaptureFile(path) as cap:
+        tasks = [(path, start, end, state) for start, end, state in cap.chunks(per_chunk)]
+    if workers == 1:
+        for task in tasks:
+            yield decode_chunk(task)
+        return
+    # Keep only a few chunks in flight so a multi-GB file doesn't pile up
+    # decoded columns faster than the aggregator consumes them.
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        window = 2 * workers
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(decode_chunk, task))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# Decoding is sharded across processes; aggregation stays in capture order in
+# this process, exactly as the live stats worker does it. With NumPy available
+# each chunk is anomaly-scored in one vectorised pass (vectorised=False keeps
+# the per-packet detector).
+def ingest(path, workers=None, per_chunk=CHUNK_PACKETS, flow_log_path=None, vectorised=True):
+    s = new_stats()
+    flow_log = FlowLog(flow_log_path) if flow_log_path else None
+    if flow_log is not None:
+        def emit(rec):
+            rec["protocol"] = proto_name(rec["proto"])
+            flow_log.write(rec)
+        s["flows"].on_expire = emit
+    next_id = 1
+    last_ts = 0.0
+    for cols in decoded_chunks(path, workers, per_chunk):
+        if not cols[0]:
+            continue
+        scores = None
+        if vectorised and np is not None:
+            scores = s["detector"].score_columns(cols[0], cols[1], cols[2], cols[3], cols[4], cols[6], cols[7])
+        update_stats(s, chunk_records(cols, next_id), scores)
+        next_id += len(cols[0])
+        last_ts = cols[0][-1]
+        s["flows"].sweep(last_ts)
+    s["flows"].flush()
+    if flow_log is not None:
+        flow_log.close()
+    return s, last_ts
+
+
+def bench_decoders(path, limit=100000):
+    with CaptureFile(path) as cap:
+        t0 = time.perf_counter()
+        n_fast = 0
+        for ts, off, caplen, origlen, linktype in cap.records():
+            decode_frame(cap.mm, off, off + caplen, linktype)
+            n_fast += 1
+            if n_fast >= limit:
+                break
+        fast = time.perf_counter() - t0
+
+    result = {"fastPath": {"packets": n_fast, "seconds": fast, "pps": n_fast / fast if fast else 0.0}}
+    try:
+        from scapy.all import PcapReader, IP
+    except ImportError:
+        result["scapy"] = None
+        return result
+    t0 = time.perf_counter()
+    n_scapy = 0
+    with PcapReader(path) as reader:
+        for pkt in reader:
+            if IP in pkt:
+                ip = pkt[IP]
+                ip.src, ip.dst, ip.proto
+            n_scapy += 1
+            if n_scapy >= limit:
+                break
+    slow = time.perf_counter() - t0
+    result["scapy"] = {"packets": n_scapy, "seconds": slow, "pps": n_scapy / slow if slow else 0.0}
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Run a pcap/pcapng file through the CyberSleuth capture pipeline.")
+    parser.add_argument("path", help="Capture file (pcap or pcapng)")
+    parser.add_argument("--workers", "-w", type=int, default=None, help="Decoder processes (default: CPU count, 1 = in-process)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_PACKETS, help="Packets per decode task")
+    parser.add_argument("--flows", help="Write expired flow records to this JSONL file")
+    parser.add_argument("--output", "-o", help="Save the stats snapshot to a JSON file")
+    parser.add_argument("--scalar", action="store_true", help="Score anomalies per packet instead of per chunk with NumPy")
+    parser.add_argument("--bench", type=int, metavar="N", help="Only benchmark scapy vs fast-path decoding on the first N packets")
+    args = parser.parse_args()
+
+    if args.bench:
+        print(json.dumps(bench_decoders(args.path, args.bench), indent=2))
+        raise SystemExit(0)
+
+    started = time.perf_counter()
+    stats, last_ts = ingest(args.path, args.workers, args.chunk,
+                            args.flows or os.path.join("captures", os.path.basename(args.path) + "-flows.jsonl"),
+                            vectorised=not args.scalar)
+    elapsed = time.perf_counter() - started
+    report = stats_snapshot(stats, last_ts + 1)
+    report["recentAlerts"] = list(stats["alerts"])
+    report["ingestSeconds"] = round(elapsed, 3)
+    report["ingestPacketsPerSecond"] = round(stats["totalPackets"] / elapsed, 1) if elapsed else 0.0
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.output}")
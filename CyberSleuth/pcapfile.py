@@ -0,0 +1,162 @@
+import mmap
+import struct
+
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+PCAPNG_SHB = 0x0A0D0D0A
+PCAPNG_BOM = 0x1A2B3C4D
+PCAPNG_IDB = 1
+PCAPNG_SPB = 3
+PCAPNG_EPB = 6
+IF_TSRESOL = 9
+
+
+class CaptureFile:
+    # Memory-mapped pcap / pcapng reader that only walks record headers. Packet
+    # bytes are never copied: records() yields offsets into self.mm.
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"{path}: empty capture file")
+        magic = self.mm[:4]
+        if magic in PCAP_MAGIC:
+            self.format = "pcap"
+            self.endian, self.ts_scale = PCAP_MAGIC[magic]
+            self.linktype = struct.unpack_from(self.endian + "I", self.mm, 20)[0] & 0x0FFFFFFF
+            self.data_start = 24
+        elif struct.unpack_from("<I", self.mm, 0)[0] == PCAPNG_SHB:
+            self.format = "pcapng"
+            self.endian = None
+            self.data_start = 0
+        else:
+            self.close()
+            raise ValueError(f"{path}: not a pcap or pcapng file")
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.mm)
+
+    # Reader state at a record boundary, enough for another process to resume
+    # decoding from there (pcapng needs the section byte order and interfaces).
+    def initial_state(self):
+        if self.format == "pcap":
+            return None
+        return (None, ())
+
+    def records(self, start=None, end=None, state=None):
+        start = self.data_start if start is None else start
+        end = len(self.mm) if end is None else end
+        if self.format == "pcap":
+            return self._pcap_records(start, end)
+        return self._pcapng_records(start, end, state or self.initial_state())
+
+    def _pcap_records(self, start, end):
+        mm, scale, linktype = self.mm, self.ts_scale, self.linktype
+        header = struct.Struct(self.endian + "IIII").unpack_from
+        o = start
+        while o + 16 <= end:
+            sec, frac, caplen, origlen = header(mm, o)
+            o += 16
+            if o + caplen > len(mm):
+                break       # truncated last record
+            yield sec + frac * scale, o, caplen, origlen, linktype
+            o += caplen
+
+    def _pcapng_records(self, start, end, state):
+        mm = self.mm
+        endian, interfaces = state
+        interfaces = list(interfaces)
+        o = start
+        ts = 0.0
+        while o + 12 <= end:
+            if struct.unpack_from("<I", mm, o)[0] == PCAPNG_SHB:
+                endian = "<" if struct.unpack_from("<I", mm, o + 8)[0] == PCAPNG_BOM else ">"
+                interfaces = []
+            btype, blen = struct.unpack_from(endian + "II", mm, o)
+            if blen < 12 or o + blen > len(mm):
+                break
+            if btype == PCAPNG_EPB:
+                iface, hi, lo, caplen, origlen = struct.unpack_from(endian + "IIIII", mm, o + 8)
+                linktype, scale = interfaces[iface]
+                ts = ((hi << 32) | lo) * scale
+                yield ts, o + 28, caplen, origlen, linktype
+            elif btype == PCAPNG_SPB:
+                origlen = struct.unpack_from(endian + "I", mm, o + 8)[0]
+                linktype, scale = interfaces[0]
+                yield ts, o + 12, min(origlen, blen - 16), origlen, linktype
+            elif btype == PCAPNG_IDB:
+                interfaces.append(self._interface(o, blen, endian))
+            o += blen
+
+    def _interface(self, o, blen, endian):
+        mm = self.mm
+        linktype = struct.unpack_from(endian + "H", mm, o + 8)[0]
+        scale = 1e-6
+        p, stop = o + 16, o + blen - 4
+        while p + 4 <= stop:
+            code, length = struct.unpack_from(endian + "HH", mm, p)
+            if code == 0:
+                break
+            if code == IF_TSRESOL and length >= 1:
+                v = mm[p + 4]
+                scale = 2.0 ** -(v & 0x7F) if v & 0x80 else 10.0 ** -v
+            p += 4 + (length + 3) // 4 * 4
+        return linktype, scale
+
+    # Split the file into (start, end, state) ranges of roughly `per_chunk`
+    # packets each. Only block/record headers are read.
+    def chunks(self, per_chunk=50000):
+        mm, size = self.mm, len(self.mm)
+        out = []
+        o = chunk_start = self.data_start
+        count = 0
+        if self.format == "pcap":
+            length = struct.Struct(self.endian + "I").unpack_from
+            while o + 16 <= size:
+                o += 16 + length(mm, o + 8)[0]
+                count += 1
+                if count == per_chunk:
+                    out.append((chunk_start, min(o, size), None))
+                    chunk_start, count = o, 0
+            if chunk_start < size:
+                out.append((chunk_start, size, None))
+            return out
+
+        endian, interfaces = None, []
+        chunk_state = (endian, ())
+        while o + 12 <= size:
+            if struct.unpack_from("<I", mm, o)[0] == PCAPNG_SHB:
+                endian = "<" if struct.unpack_from("<I", mm, o + 8)[0] == PCAPNG_BOM else ">"
+                interfaces = []
+            btype, blen = struct.unpack_from(endian + "II", mm, o)
+            if blen < 12:
+                break
+            if btype == PCAPNG_IDB:
+                interfaces.append(self._interface(o, blen, endian))
+            elif btype in (PCAPNG_EPB, PCAPNG_SPB):
+                count += 1
+            o += blen
+            if count == per_chunk:
+                out.append((chunk_start, min(o, size), chunk_state))
+                chunk_start, count = o, 0
+                chunk_state = (endian, tuple(interfaces))
+        if chunk_start < size:
+            out.append((chunk_start, size, chunk_state))
+        return out
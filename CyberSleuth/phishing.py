@@ -1,15 +1,38 @@
 import re
 import os
+import sys
+import csv
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import joblib
 import tldextract
 import validators
 import numpy as np
 import pandas as pd
+import verdicts
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score, roc_auc_score, confusion_matrix
 
 IP_RE = re.compile(r'^(?:http[s]?://)?\d{1,3}(?:\.\d{1,3}){3}')
+SCHEME_RE = re.compile(r'https?://', re.I)
+KEYWORDS = ('login', 'secure', 'account', 'update', 'verify', 'bank', 'confirm', 'signin', 'support')
+KEYWORD_RES = tuple(re.compile(re.escape(k)) for k in KEYWORDS)
+CHAR_FEATURES = (('num_dots', '.'), ('num_hyphens', '-'), ('num_at', '@'), ('num_q', '?'),
+                 ('num_equals', '='), ('num_underscores', '_'))
+
+# Column order of extract_url_features() and of models trained by this module
+FEATURE_NAMES = ['url_length', 'num_dots', 'num_hyphens', 'num_at', 'num_q', 'num_equals', 'num_underscores',
+                 'has_https', 'has_http', 'has_ip', 'is_valid_url', 'domain_len', 'tld_len', 'subdomain_len',
+                 'suspicious_keyword_count', 'path_len_ratio']
+
+MODEL_PATH = 'models/url_rf.joblib'
+RELOAD_CHECK = 1.0           # seconds between mtime checks of a loaded model file
+COMPILED_ROWS = 256          # past this many rows sklearn's own per-tree loop is faster
+SCORE_CHUNK = 10000          # URLs per scoring task in the score CLI
 
 def url_has_ip(url: str) -> int:
     return 1 if IP_RE.search(url) else 0
@@ -39,15 +62,82 @@ def extract_url_features(url: str):
     features['domain_len'] = len(domain)
     features['tld_len'] = len(tld)
     features['subdomain_len'] = len(subdomain)
-    kw = ['login', 'secure', 'account', 'update', 'verify', 'bank', 'confirm', 'signin', 'support']
-    features['suspicious_keyword_count'] = sum(1 for k in kw if k in url.lower())
+    features['suspicious_keyword_count'] = sum(1 for k in KEYWORDS if k in url.lower())
+    features['path_len_ratio'] = path_len_ratio(url)
+    return features
+
+def path_len_ratio(url: str) -> float:
     try:
-        path = re.sub(r'https?://', '', url, flags=re.I)
+        path = SCHEME_RE.sub('', url)
         path = path.split('/', 1)[1] if '/' in path else ''
-        features['path_len_ratio'] = len(path) / (len(url) + 1e-6)
+        return len(path) / (len(url) + 1e-6)
     except Exception:
-        features['path_len_ratio'] = 0.0
-    return features
+        return 0.0
+
+# All strings back to back, each followed by a NUL, as one array of code
+# points, with the offset and length of each string in it.
+def _codepoints(strings):
+    lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+    starts = np.zeros(len(strings), dtype=np.int64)
+    np.cumsum(lengths[:-1] + 1, out=starts[1:])
+    joined = '\0'.join(strings) + '\0'
+    buf = np.frombuffer(joined.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+    return joined, buf, starts, lengths
+
+def _startswith(buf, starts, lengths, prefix):
+    ok = lengths >= len(prefix)
+    for k, ch in enumerate(prefix):
+        ok &= buf[np.minimum(starts + k, len(buf) - 1)] == ord(ch)
+    return ok
+
+# Which strings contain each keyword, from one regex scan per keyword over
+# the whole batch. A keyword cannot match the NUL separators, so no match
+# spans two strings.
+def _keyword_counts(joined, starts):
+    counts = np.zeros(len(starts), dtype=np.int64)
+    for pattern in KEYWORD_RES:
+        pos = np.fromiter((m.start() for m in pattern.finditer(joined)), dtype=np.int64)
+        if len(pos):
+            present = np.zeros(len(starts), dtype=bool)
+            present[np.searchsorted(starts, pos, side='right') - 1] = True
+            counts += present
+    return counts
+
+# extract_url_features() for many URLs at once, as a float32 matrix with one
+# row per URL and columns in feature_names order. Each value equals
+# np.float32 of the scalar path's. Repeated URLs are featurised once; counts,
+# prefixes and keywords run as array operations over all distinct URLs, and
+# only validators.url, tldextract and the two regexes still run per URL.
+def extract_url_features_batch(urls, feature_names=FEATURE_NAMES):
+    urls = [str(u).strip() for u in urls]
+    index = {}
+    inverse = np.fromiter((index.setdefault(u, len(index)) for u in urls), dtype=np.int64, count=len(urls))
+    out = np.zeros((len(urls), len(feature_names)), dtype=np.float32)
+    if not urls:
+        return out
+    unique = list(index)
+    n = len(unique)
+
+    joined, buf, starts, lengths = _codepoints(unique)
+    cols = {'url_length': lengths}
+    for name, ch in CHAR_FEATURES:
+        cols[name] = np.add.reduceat(buf == ord(ch), starts, dtype=np.int64)
+    lowered = [u.lower() for u in unique]
+    low_joined, low_buf, low_starts, low_lengths = _codepoints(lowered)
+    cols['has_https'] = _startswith(low_buf, low_starts, low_lengths, 'https://')
+    cols['has_http'] = _startswith(low_buf, low_starts, low_lengths, 'http://')
+    cols['suspicious_keyword_count'] = _keyword_counts(low_joined, low_starts)
+
+    cols['has_ip'] = np.fromiter(map(url_has_ip, unique), dtype=np.int64, count=n)
+    cols['is_valid_url'] = np.fromiter((1 if validators.url(u) else 0 for u in unique), dtype=np.int64, count=n)
+    parts = [domain_and_tld(u) for u in unique]
+    for j, name in enumerate(('domain_len', 'tld_len', 'subdomain_len')):
+        cols[name] = np.fromiter((len(p[j]) for p in parts), dtype=np.int64, count=n)
+    cols['path_len_ratio'] = np.fromiter(map(path_len_ratio, unique), dtype=np.float64, count=n)
+
+    for j, name in enumerate(feature_names):
+        out[:, j] = cols[name][inverse]
+    return out
 
 def build_demo_url_dataset(n_legit=400, n_phish=400, random_state=42):
     np.random.seed(random_state)
@@ -83,10 +173,12 @@ def build_demo_url_dataset(n_legit=400, n_phish=400, random_state=42):
     df = pd.DataFrame(rows, columns=['url', 'label'])
     return df.sample(frac=1, random_state=random_state).reset_index(drop=True)
 
+# Models see URLs in the canonical form they are served in (tracking
+# parameters stripped, host lowercased; see verdicts.canonical_url), in
+# training as in predict_url, /api/phishing/score and the score CLI.
 def prepare_features(df_urls: pd.DataFrame):
-    feat_list = [extract_url_features(u) for u in df_urls['url']]
-    feat_df = pd.DataFrame(feat_list).fillna(0)
-    return feat_df.values.astype(float), df_urls['label'].values.astype(int), feat_df.columns.tolist()
+    X = extract_url_features_batch([verdicts.canonical_url(str(u)) for u in df_urls['url'].values])
+    return X.astype(float), df_urls['label'].values.astype(int), list(FEATURE_NAMES)
 
 def train_and_save_model(save_path='models'):
     os.makedirs(save_path, exist_ok=True)
@@ -103,23 +195,305 @@ def train_and_save_model(save_path='models'):
     print(classification_report(y_test, y_pred, digits=4))
     print("Confusion matrix:")
     print(confusion_matrix(y_test, y_pred))
-    joblib.dump({'model': clf, 'feature_names': feature_names}, os.path.join(save_path, 'url_rf.joblib'))
+    # write then rename, so a process hot-reloading the file never reads half of it
+    target = os.path.join(save_path, 'url_rf.joblib')
+    joblib.dump({'model': clf, 'feature_names': feature_names}, target + '.tmp')
+    os.replace(target + '.tmp', target)
     return clf, feature_names
 
-def load_model(model_path='models/url_rf.joblib'):
+def load_model(model_path=MODEL_PATH):
     obj = joblib.load(model_path)
     return obj['model'], obj['feature_names']
 
+# A fitted random forest flattened into one set of node arrays, so a batch
+# walks every tree at once with numpy instead of calling each tree in turn.
+# Leaves point at themselves, which lets all rows take max-depth steps with
+# no per-row bookkeeping. Rows are compared as float32 against the float64
+# thresholds and leaf distributions are summed in tree order, as sklearn
+# does, so the probabilities are the same as the model's predict_proba().
+# That pays off for small batches, the per-URL case above all; larger ones
+# are handed to the forest itself.
+class CompiledForest:
+    def __init__(self, forest):
+        trees = [est.tree_ for est in forest.estimators_]
+        offsets = np.cumsum([0] + [t.node_count for t in trees[:-1]])
+        left, right, feature, threshold, value = [], [], [], [], []
+        for off, t in zip(offsets, trees):
+            ids = np.arange(t.node_count) + off
+            leaf = t.children_left < 0
+            left.append(np.where(leaf, ids, t.children_left + off))
+            right.append(np.where(leaf, ids, t.children_right + off))
+            feature.append(np.where(leaf, 0, t.feature))
+            threshold.append(t.threshold)
+            v = t.value[:, 0, :].astype(np.float64)
+            norm = v.sum(axis=1, keepdims=True)
+            norm[norm == 0] = 1.0
+            value.append(v / norm)
+        self.roots = offsets.astype(np.intp)
+        self.left = np.concatenate(left).astype(np.intp)
+        self.right = np.concatenate(right).astype(np.intp)
+        self.feature = np.concatenate(feature).astype(np.intp)
+        self.threshold = np.concatenate(threshold)
+        self.value = np.concatenate(value)
+        self.depth = max(t.max_depth for t in trees)
+        self.classes_ = forest.classes_
+        self.forest = forest
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if len(X) > COMPILED_ROWS:
+            return self.forest.predict_proba(X)
+        rows = np.arange(len(X))[:, None]
+        node = np.repeat(self.roots[None, :], len(X), axis=0)
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+        return np.cumsum(self.value[node], axis=1)[:, -1] / len(self.roots)
+
+    def predict(self, X):
+        return self.classes_.take(self.predict_proba(X).argmax(axis=1))
+
+
+# Compiled form of `model` when it is a single-output tree forest and the
+# compiled probabilities match the model's own on `sample`; otherwise the
+# model itself.
+def compile_model(model, sample=None):
+    try:
+        if getattr(model, 'n_outputs_', 1) != 1 or not all(hasattr(e, 'tree_') for e in model.estimators_):
+            return model
+        compiled = CompiledForest(model)
+    except AttributeError:
+        return model
+    if sample is not None and not np.array_equal(compiled.predict_proba(sample), model.predict_proba(sample)):
+        return model
+    return compiled
+
+
+class LoadedModel:
+    __slots__ = ('path', 'stamp', 'version', 'model', 'scorer', 'feature_names', 'checked')
+
+    def __init__(self, path, stamp, model, feature_names):
+        self.path = path
+        self.stamp = stamp
+        self.version = '%d:%d' % stamp       # tags cached verdicts; changes when the file does
+        self.model = model
+        self.feature_names = feature_names
+        sample = extract_url_features_batch(['https://www.example.com/', 'http://10.0.0.1/login?x=1'], feature_names)
+        self.scorer = compile_model(model, sample)
+        self.checked = time.monotonic()
+
+
+# Process-wide cache of deserialised models, one per file. The first get()
+# of a path loads it; later calls return the cached model, and at most every
+# `check_interval` seconds one of them stats the file and reloads it if its
+# mtime or size changed. A reload that fails (say, the trainer is still
+# writing the file) keeps the old model and is retried at the next check.
+# Readers never take the lock unless a check is due.
+class ModelRegistry:
+    def __init__(self, check_interval=RELOAD_CHECK):
+        self.check_interval = check_interval
+        self.models = {}
+        self.lock = threading.Lock()
+        self.loads = 0
+
+    def get(self, path=MODEL_PATH):
+        path = os.path.abspath(path)
+        entry = self.models.get(path)
+        if entry is not None and time.monotonic() - entry.checked < self.check_interval:
+            return entry
+        with self.lock:
+            entry = self.models.get(path)
+            if entry is not None and time.monotonic() - entry.checked < self.check_interval:
+                return entry
+            try:
+                st = os.stat(path)
+                stamp = (st.st_mtime_ns, st.st_size)
+                if entry is not None and entry.stamp == stamp:
+                    entry.checked = time.monotonic()
+                    return entry
+                model, feature_names = load_model(path)
+            except Exception:
+                if entry is None:
+                    raise
+                entry.checked = time.monotonic()
+                return entry
+            entry = self.models[path] = LoadedModel(path, stamp, model, feature_names)
+            self.loads += 1
+            return entry
+
+    def clear(self):
+        with self.lock:
+            self.models = {}
+
+
+registry = ModelRegistry()
+
+# Scores the canonical form of `url`, as models are trained on it (see
+# prepare_features), with a given model too; the result's `url` is that
+# canonical string, not the one passed in. With no model given, uses the
+# registry's model and the shared verdict cache. The result is the caller's
+# to modify.
 def predict_url(url: str, model=None, feature_names=None):
+    url = verdicts.canonical_url(url)
+    cache = None
     if model is None or feature_names is None:
-        model, feature_names = load_model()
+        loaded = registry.get()
+        model, feature_names = loaded.scorer, loaded.feature_names
+        cache = verdicts.shared_cache()
+        if cache is not None:
+            hit = cache.get(url, loaded.version)
+            if hit is not None:
+                return dict(hit, features=dict(hit['features']))
     feats = extract_url_features(url)
     arr = np.array([feats[name] for name in feature_names]).reshape(1, -1).astype(float)
-    pred = model.predict(arr)[0]
-    score = float(model.predict_proba(arr)[0, 1])
-    return {'url': url, 'prediction': int(pred), 'phish_probability': score, 'features': feats}
+    proba = model.predict_proba(arr)[0]
+    result = {'url': url, 'prediction': int(model.classes_[proba.argmax()]), 'phish_probability': float(proba[1]),
+              'features': feats}
+    if cache is not None:
+        cache.put(url, loaded.version, dict(result, features=dict(feats)))
+    return result
 
-if __name__ == '__main__':
+# URLs from a text file (one per line), a CSV file (`column`, default "url")
+# or JSON lines (`column` field, default "url"), read lazily. fmt "auto"
+# goes by the file extension. A CSV header without the column raises
+# ValueError at once; JSON lines that do not parse to an object are skipped
+# and counted in stats['skipped'] when a stats dict is given.
+def read_urls(f, fmt='auto', column=None, stats=None):
+    if fmt == 'auto':
+        name = getattr(f, 'name', '')
+        ext = os.path.splitext(name)[1].lower() if isinstance(name, str) else ''
+        fmt = 'csv' if ext == '.csv' else 'jsonl' if ext in ('.jsonl', '.ndjson') else 'text'
+    column = column or 'url'
+    if stats is None:
+        stats = {}
+    stats.setdefault('skipped', 0)
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        if reader.fieldnames is not None and column not in reader.fieldnames:
+            raise ValueError(f"CSV column {column!r} not in header: {', '.join(reader.fieldnames)}")
+        return (row[column] for row in reader if row.get(column))
+    if fmt == 'jsonl':
+        return _jsonl_urls(f, column, stats)
+    return (line for line in map(str.strip, f) if line)
+
+def _jsonl_urls(f, column, stats):
+    for line in f:
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            obj = None
+        if not isinstance(obj, dict):
+            stats['skipped'] += 1
+            continue
+        url = obj.get(column)
+        if url:
+            yield url
+
+def url_chunks(urls, size=SCORE_CHUNK):
+    chunk = []
+    for url in urls:
+        chunk.append(url)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Worker side of the score CLI: one chunk of URLs to (urls, labels,
+# probabilities, feature seconds, predict seconds). Each process loads the
+# model once through its own registry.
+def score_chunk(task):
+    model_path, urls = task
+    loaded = registry.get(model_path)
+    t0 = time.perf_counter()
+    X = extract_url_features_batch([verdicts.canonical_url(u) for u in urls], loaded.feature_names)
+    t1 = time.perf_counter()
+    proba = loaded.scorer.predict_proba(X)
+    labels = loaded.scorer.classes_.take(proba.argmax(axis=1))
+    return urls, labels, proba[:, 1], t1 - t0, time.perf_counter() - t1
+
+def scored_chunks(chunks, model_path=MODEL_PATH, workers=None):
+    if workers == 1:
+        for urls in chunks:
+            yield score_chunk((model_path, urls))
+        return
+    # Only a few chunks in flight, so memory stays bounded whatever the
+    # input size, and results come back in input order.
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        window = 2 * workers
+        pending = deque()
+        for urls in chunks:
+            pending.append(pool.submit(score_chunk, (model_path, urls)))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+class JsonlSink:
+    def __init__(self, f):
+        self.f = f
+
+    def write(self, urls, labels, probs):
+        self.f.write(''.join(json.dumps({'url': u, 'prediction': int(l), 'phish_probability': float(p)}) + '\n'
+                             for u, l, p in zip(urls, labels, probs)))
+
+    def close(self):
+        self.f.flush()
+
+# One Parquet row group per chunk, so only one chunk is ever held in memory.
+class ParquetSink:
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([('url', pa.string()), ('prediction', pa.int8()), ('phish_probability', pa.float64())])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, urls, labels, probs):
+        pa = self.pa
+        self.writer.write_table(pa.table([pa.array(urls, pa.string()), pa.array(labels.astype(np.int8)),
+                                          pa.array(probs)], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def score_stream(urls, sink, model_path=MODEL_PATH, workers=None, chunk=SCORE_CHUNK):
+    timing = {'read': 0.0, 'features': 0.0, 'predict': 0.0, 'write': 0.0}
+    counts = {'urls': 0, 'phish': 0}
+
+    def timed_chunks():
+        it = url_chunks(urls, chunk)
+        while True:
+            t0 = time.perf_counter()
+            batch = next(it, None)
+            timing['read'] += time.perf_counter() - t0
+            if batch is None:
+                return
+            yield batch
+
+    started = time.perf_counter()
+    for batch, labels, probs, feature_s, predict_s in scored_chunks(timed_chunks(), model_path, workers):
+        timing['features'] += feature_s
+        timing['predict'] += predict_s
+        t0 = time.perf_counter()
+        sink.write(batch, labels, probs)
+        timing['write'] += time.perf_counter() - t0
+        counts['urls'] += len(batch)
+        counts['phish'] += int((labels == 1).sum())
+    sink.close()
+    elapsed = time.perf_counter() - started
+    report = dict(counts)
+    report['seconds'] = round(elapsed, 3)
+    report['urlsPerSecond'] = round(counts['urls'] / elapsed, 1) if elapsed else 0.0
+    report['stageSeconds'] = {k: round(v, 3) for k, v in timing.items()}
+    return report
+
+def demo():
     clf, feat_names = train_and_save_model()
     tests = [
         'https://www.google.com/',
@@ -132,3 +506,53 @@ if __name__ == '__main__':
         r = predict_url(t, model=clf, feature_names=feat_names)
         label = 'PHISH' if r['prediction'] == 1 else 'LEGIT'
         print(f"{t}  --> {label} (prob={r['phish_probability']})")
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the URL phishing model or score URLs with it.")
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('train', help="Train on the demo dataset, save the model and score a few examples (default)")
+    score = commands.add_parser('score', help="Score a stream of URLs")
+    score.add_argument('input', nargs='?', default='-', help="URL file, or - for stdin")
+    score.add_argument('--format', choices=('auto', 'text', 'csv', 'jsonl'), default='auto',
+                       help="Input format (auto: by extension, text for stdin)")
+    score.add_argument('--column', help="CSV column or JSON field holding the URL (default: url)")
+    score.add_argument('--output', '-o', default='-', help="Output file, or - for stdout")
+    score.add_argument('--output-format', choices=('jsonl', 'parquet'), help="Default: parquet for .parquet files, else jsonl")
+    score.add_argument('--model', default=MODEL_PATH)
+    score.add_argument('--workers', '-w', type=int, default=None, help="Scoring processes (default: CPU count, 1 = in-process)")
+    score.add_argument('--chunk', type=int, default=SCORE_CHUNK, help="URLs per scoring task")
+    args = parser.parse_args()
+
+    if args.command != 'score':
+        demo()
+        raise SystemExit(0)
+
+    registry.get(args.model)    # fail fast on a missing model; forked workers inherit it
+    src = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8', errors='replace', newline='')
+    read_stats = {}
+    try:
+        urls = read_urls(src, args.format, args.column, read_stats)
+    except ValueError as e:
+        parser.error(str(e))
+    out_format = args.output_format or ('parquet' if args.output.endswith('.parquet') else 'jsonl')
+    if out_format == 'parquet':
+        if args.output == '-':
+            parser.error("parquet output needs a file (--output)")
+        try:
+            sink = ParquetSink(args.output)
+        except ImportError:
+            parser.error("parquet output needs pyarrow")
+        out = None
+    else:
+        out = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+        sink = JsonlSink(out)
+    try:
+        report = score_stream(urls, sink, args.model, args.workers, args.chunk)
+        report['skipped'] = read_stats['skipped']
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if out is not None and out is not sys.stdout:
+            out.close()
+    print(json.dumps(report, indent=2), file=sys.stderr)
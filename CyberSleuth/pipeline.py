@@ -0,0 +1,153 @@
+import itertools
+from collections import deque
+
+from rates import RateTracker
+from sketches import SpaceSaving, DistinctCounter, WindowedDistinct, hash64
+from flows import FlowTable
+from anomaly import AnomalyDetector, ANOMALY_THRESHOLD
+from scans import ScanDetector, SynFloodDetector
+
+# Aggregation shared by the live sniffer (network.py) and offline pcap ingest
+# (pcap_ingest.py). Both feed the same record tuples through update_stats, so
+# a capture replayed from disk produces the same numbers as it did live:
+#   (id, timestamp, src, dst, proto, size, sport, dport, tcp_flags, score, packet)
+# The score slot is filled in here; whatever the producer put there is ignored.
+
+TOP_K_SLOTS = 256                # heavy-hitter slots per dimension
+HLL_PRECISION = 14               # 2^14 registers, ~0.8% standard error
+EXACT_DISTINCT_LIMIT = 4096      # keep exact sets below this many keys
+FLOW_SLOTS = 131072              # concurrent flows before the oldest is evicted
+FLOW_IDLE_TIMEOUT = 15.0
+FLOW_ACTIVE_TIMEOUT = 1800.0
+ALERT_EVENTS = 1000             # recent scan / flood alerts kept for /ws and reports
+
+IP_PROTO_MAP = {1: "ICMP", 6: "TCP", 17: "UDP"}
+
+CARDINALITY_KEYS = ("uniqueIPs", "uniqueSources", "uniqueDestinations", "uniqueFlows", "recentIPs")
+
+
+def proto_name(proto_num):
+    if proto_num < 0:
+        return "Other"
+    return IP_PROTO_MAP.get(proto_num, str(proto_num))
+
+
+# `alert_ids` lets several shards of one aggregator share alert numbering.
+def new_stats(alert_ids=None):
+    return {
+        "totalPackets": 0,
+        "anomalies": 0,
+        "dataVolume": 0,
+        "uniqueIPs": DistinctCounter(HLL_PRECISION, EXACT_DISTINCT_LIMIT),
+        "uniqueSources": DistinctCounter(HLL_PRECISION, EXACT_DISTINCT_LIMIT),
+        "uniqueDestinations": DistinctCounter(HLL_PRECISION, EXACT_DISTINCT_LIMIT),
+        "uniqueFlows": DistinctCounter(HLL_PRECISION, EXACT_DISTINCT_LIMIT),
+        "recentIPs": WindowedDistinct(span=60, buckets=6, precision=12),
+        "protocolDistribution": {},
+        "topSources": SpaceSaving(TOP_K_SLOTS),
+        "topDestinations": SpaceSaving(TOP_K_SLOTS),
+        "topPairs": SpaceSaving(TOP_K_SLOTS),
+        "rates": RateTracker(window=60),
+        "flows": FlowTable(FLOW_SLOTS, FLOW_IDLE_TIMEOUT, FLOW_ACTIVE_TIMEOUT),
+        "detector": AnomalyDetector(),
+        "scans": ScanDetector(),
+        "synFlood": SynFloodDetector(),
+        "alerts": deque(maxlen=ALERT_EVENTS),
+        "alertCount": 0,
+        "alertIds": alert_ids if alert_ids is not None else itertools.count(1)
+    }
+
+
+# Returns the anomaly score of each record. Scan and flood alerts are numbered
+# and appended to s["alerts"]. `scores` skips the per-packet
+# detector for callers that already scored the batch (AnomalyDetector.score_columns).
+def update_stats(s, records, scores=None):
+    observe = s["detector"].observe
+    scan, flood = s["scans"].observe, s["synFlood"].observe
+    out = [] if scores is None else scores
+    for n, (pid, timestamp, src, dst, proto_num, size, sport, dport, flags, _, packet) in enumerate(records):
+        proto = proto_name(proto_num)
+        if scores is None:
+            score = observe(timestamp, src, dst, proto_num, size, dport, flags) if proto_num >= 0 else 0.0
+            out.append(score)
+        else:
+            score = float(scores[n])
+        s["totalPackets"] += 1
+        s["dataVolume"] += size
+        if score > ANOMALY_THRESHOLD:
+            s["anomalies"] += 1
+        hsrc, hdst = hash64(src), hash64(dst)
+        s["uniqueIPs"].add_hash(hsrc)
+        s["uniqueIPs"].add_hash(hdst)
+        s["uniqueSources"].add_hash(hsrc)
+        s["uniqueDestinations"].add_hash(hdst)
+        s["uniqueFlows"].add((src, dst, sport, dport, proto_num))
+        s["recentIPs"].add_hash(hsrc, timestamp)
+        s["recentIPs"].add_hash(hdst, timestamp)
+        s["protocolDistribution"][proto] = s["protocolDistribution"].get(proto, 0) + 1
+        s["rates"].add(timestamp, proto, size)
+        s["topSources"].add(src, size)
+        s["topDestinations"].add(dst, size)
+        s["topPairs"].add((src, dst), size)
+        if proto_num >= 0:
+            s["flows"].update(timestamp, src, dst, sport, dport, proto_num, size, flags, score)
+        if proto_num == 6 or proto_num == 17:
+            alert = scan(timestamp, src, dst, proto_num, dport, flags)
+            if alert is not None:
+                add_alert(s, alert)
+            alert = flood(timestamp, src, dst, proto_num, flags)
+            if alert is not None:
+                add_alert(s, alert)
+    return out
+
+
+def add_alert(s, alert):
+    s["alertCount"] += 1
+    alert["id"] = next(s["alertIds"])
+    s["alerts"].append(alert)
+
+
+def top_talkers(sketch, n=5):
+    return talker_rows(sketch.top(n))
+
+
+# SpaceSaving.top() entries as UI rows; consumes the entries.
+def talker_rows(entries):
+    out = []
+    for e in entries:
+        key = e.pop("key")
+        if isinstance(key, tuple):
+            e["src"], e["dst"] = key
+        else:
+            e["ip"] = key
+        out.append(e)
+    return out
+
+
+def stats_snapshot(s, now):
+    rates = s["rates"]
+    pps, bps = rates.rate(now)
+    return {
+        "totalPackets": s["totalPackets"],
+        "packetsPerSecond": pps,
+        "bytesPerSecond": bps,
+        "rates": rates.snapshot(now),
+        "anomalies": s["anomalies"],
+        "dataVolume": f"{s['dataVolume']//1024} KB",
+        "uniqueIPs": s["uniqueIPs"].estimate(),
+        "uniqueSources": s["uniqueSources"].estimate(),
+        "uniqueDestinations": s["uniqueDestinations"].estimate(),
+        "uniqueFlows": s["uniqueFlows"].estimate(),
+        "uniqueIPsLast60s": s["recentIPs"].estimate(now),
+        "uniqueExact": s["uniqueIPs"].is_exact(),
+        "cardinalityMemory": sum(s[k].memory_bytes() for k in CARDINALITY_KEYS),
+        "protocolDistribution": dict(s["protocolDistribution"]),
+        "topSources": top_talkers(s["topSources"]),
+        "topDestinations": top_talkers(s["topDestinations"]),
+        "topPairs": top_talkers(s["topPairs"]),
+        "activeFlows": len(s["flows"]),
+        "expiredFlows": s["flows"].expired,
+        "flowTableMemory": s["flows"].memory_bytes(),
+        "trackedHosts": len(s["detector"].hosts),
+        "alerts": s["alertCount"]
+    }
@@ -0,0 +1,67 @@
+from array import array
+
+RATE_SPANS = (1, 10, 60)
+
+
+class RateTracker:
+    # Per-second circular histogram of packet and byte counts over the last
+    # `window` seconds, one row per protocol plus an "all" row. Every counter is
+    # allocated up front; add() only indexes into the arrays.
+    def __init__(self, window=60, protocols=("TCP", "UDP", "ICMP", "Other")):
+        if window < max(RATE_SPANS):
+            raise ValueError(f"window must cover at least {max(RATE_SPANS)} seconds")
+        self.window = window
+        self.names = ("all",) + tuple(protocols)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.other = self.index.get("Other", 0)
+        self.packets = [array("q", bytes(8 * window)) for _ in self.names]
+        self.bytes = [array("q", bytes(8 * window)) for _ in self.names]
+        self.slot_second = array("q", [-1] * window)
+        self.latest = -1
+
+    def add(self, timestamp, proto, size):
+        sec = int(timestamp)
+        if sec <= self.latest - self.window:
+            return      # older than anything we still keep
+        i = sec % self.window
+        if self.slot_second[i] != sec:
+            self.slot_second[i] = sec
+            for row in self.packets:
+                row[i] = 0
+            for row in self.bytes:
+                row[i] = 0
+        if sec > self.latest:
+            self.latest = sec
+        p = self.index.get(proto, self.other)
+        self.packets[0][i] += 1
+        self.bytes[0][i] += size
+        if p:
+            self.packets[p][i] += 1
+            self.bytes[p][i] += size
+
+    def _sum(self, rows, p, now_sec, span):
+        total = 0
+        row = rows[p]
+        # only complete seconds, so a half-filled current bucket doesn't drag the rate down
+        for sec in range(now_sec - span, now_sec):
+            i = sec % self.window
+            if self.slot_second[i] == sec:
+                total += row[i]
+        return total
+
+    def rate(self, now, proto="all", span=1):
+        p = self.index[proto]
+        now_sec = int(now)
+        return (self._sum(self.packets, p, now_sec, span) / span,
+                self._sum(self.bytes, p, now_sec, span) / span)
+
+    def snapshot(self, now):
+        out = {}
+        for name in self.names:
+            pps, bps = {}, {}
+            for span in RATE_SPANS:
+                packets, nbytes = self.rate(now, name, span)
+                pps[f"{span}s"] = round(packets, 2)
+                bps[f"{span}s"] = round(nbytes, 2)
+            out[name] = {"packetsPerSecond": pps, "bytesPerSecond": bps}
+        return out
@@ -0,0 +1,82 @@
+import socket
+import struct
+import threading
+
+from bpf import attach_bpf, SOL_PACKET
+
+ETH_P_ALL = 0x0003
+SNAP_MAX = 65535
+PACKET_AUXDATA = 8
+
+# struct tpacket_auxdata: tp_len is the frame length before any BPF truncation
+_auxdata = struct.Struct("IIIHHHH")
+
+
+class RawSniffer:
+    # Minimal AF_PACKET capture loop (Linux) with the same start()/stop() shape
+    # as scapy's AsyncSniffer. Frames land in one preallocated buffer and the
+    # handler gets (memoryview, captured_len, wire_len); nothing is dissected
+    # here, the handler decides which bytes are worth keeping. `program` is
+    # classic BPF from bpf.compile_bpf, attached before the socket is bound so
+    # no unfiltered frame slips through.
+    def __init__(self, handler, iface=None, snaplen=SNAP_MAX, poll_timeout=0.5, program=None):
+        if not hasattr(socket, "AF_PACKET"):
+            raise OSError("raw capture mode needs AF_PACKET (Linux)")
+        self.handler = handler
+        self.iface = iface
+        self.snaplen = snaplen
+        self.poll_timeout = poll_timeout
+        self.program = program
+        self.running = False
+        self.thread = None
+        self.sock = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        if self.program:
+            attach_bpf(self.sock, self.program)
+            self.sock.setsockopt(SOL_PACKET, PACKET_AUXDATA, 1)
+        if self.iface:
+            self.sock.bind((self.iface, 0))
+        self.sock.settimeout(self.poll_timeout)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        buf = bytearray(self.snaplen)
+        view = memoryview(buf)
+        recv_into, handler, snaplen = self.sock.recv_into, self.handler, self.snaplen
+        # A BPF program trims the frame in the kernel, after which MSG_TRUNC
+        # only reports the trimmed length; the original length then has to
+        # come from the auxdata the kernel attaches to each frame.
+        recvmsg_into = self.sock.recvmsg_into if self.program else None
+        ancbufsize = socket.CMSG_SPACE(_auxdata.size)
+        try:
+            while self.running:
+                try:
+                    if recvmsg_into is None:
+                        # MSG_TRUNC makes the kernel report the full frame
+                        # length even when only snaplen bytes were copied.
+                        wirelen = recv_into(buf, snaplen, socket.MSG_TRUNC)
+                        caplen = min(wirelen, snaplen)
+                    else:
+                        caplen, ancdata, _, _ = recvmsg_into([buf], ancbufsize)
+                        wirelen = caplen
+                        for level, kind, data in ancdata:
+                            if level == SOL_PACKET and kind == PACKET_AUXDATA and len(data) >= _auxdata.size:
+                                wirelen = _auxdata.unpack_from(data)[1]
+                except socket.timeout:
+                    continue
+                except OSError:
+                    if not self.running:
+                        break
+                    raise
+                handler(view, caplen, wirelen)
+        finally:
+            self.sock.close()
+
+    def stop(self, join=True):
+        self.running = False
+        if join and self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
@@ -0,0 +1,331 @@
+import json
+import os
+import platform
+import random
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from capture import CaptureSession, capture_config
+from metrics import LatencyHistogram, TimedHandler, quantile
+from pcapfile import CaptureFile
+from fastpath import DLT_EN10MB
+
+# Replays synthetic (or pcap) Ethernet frames through a real CaptureSession
+# at controlled rates, with no NIC: a ReplaySniffer stands in for the raw
+# sniffer and calls the session's raw_packet_handler on its own thread, so
+# the ring, stats thread, store, broadcaster and one draining /ws client all
+# run exactly as in a live capture. Each rate in the sweep gets a fresh
+# session and reports handler latency, what the consumers kept up with and
+# how memory moved; the whole run is written to JSON so results from two
+# versions can be compared with --compare.
+
+DEFAULT_RATES = (2000, 5000, 10000, 20000, 50000, 100000)
+STEP_SECONDS = 5.0
+SAMPLE_INTERVAL = 0.5        # seconds between memory / queue samples
+DRAIN_TIMEOUT = 10.0         # seconds to wait for the stats thread after the last frame
+MAX_BURST = 1024             # frames sent back to back when the sender is behind schedule
+KEEP_UP = 0.95               # achieved / offered rate a step needs to count as sustained
+DRAIN_LIMIT = 1.0            # ... and the stats backlog must clear within this long
+
+_eth = struct.Struct("!6s6sH")
+_ipv4 = struct.Struct("!BBHHHBBH4s4s")
+_tcp = struct.Struct("!HHIIBBHHH")
+_udp = struct.Struct("!HHHH")
+
+
+def _frame(src, dst, proto, sport, dport, flags, payload):
+    if proto == 6:
+        l4 = _tcp.pack(sport, dport, 1, 1 if flags & 0x10 else 0, 5 << 4, flags, 65535, 0, 0)
+    else:
+        l4 = _udp.pack(sport, dport, _udp.size + payload, 0)
+    total = 20 + len(l4) + payload
+    ip = _ipv4.pack(0x45, 0, total, 0, 0, 64, proto, 0, src, dst)
+    return _eth.pack(b"\x02\x00\x00\x00\x00\x02", b"\x02\x00\x00\x00\x00\x01", 0x0800) + ip + l4 + bytes(payload)
+
+
+# A pool of IPv4 TCP/UDP frames between `hosts` clients and a handful of
+# servers, mostly established TCP with a few SYNs, sizes spread like real
+# traffic (many small, some near MTU).
+def synthetic_frames(count=4096, hosts=256, seed=1):
+    rng = random.Random(seed)
+    servers = [bytes((192, 0, 2, i)) for i in range(1, 17)]
+    frames = []
+    for _ in range(count):
+        host = rng.randrange(hosts)
+        client = bytes((10, 0, host >> 8, host & 255))
+        server = rng.choice(servers)
+        payload = rng.choice((0, 0, 40, 120, 512, 1400))
+        if rng.random() < 0.7:
+            flags = 0x02 if rng.random() < 0.05 else 0x18
+            sport, dport = rng.randrange(32768, 61000), rng.choice((80, 443, 22))
+            frame = _frame(client, server, 6, sport, dport, flags, payload)
+        else:
+            frame = _frame(client, server, 17, rng.randrange(32768, 61000), rng.choice((53, 123, 443)), 0,
+                           payload)
+        if rng.random() < 0.5:      # replies: swap addresses and ports
+            frame = frame[:26] + frame[30:34] + frame[26:30] + frame[36:38] + frame[34:36] + frame[38:]
+        frames.append(frame)
+    return frames
+
+
+def pcap_frames(path, limit=100000):
+    frames = []
+    with CaptureFile(path) as cap:
+        for ts, off, caplen, origlen, linktype in cap.records():
+            if linktype != DLT_EN10MB:
+                continue
+            frames.append(bytes(cap.mm[off:off + caplen]))
+            if len(frames) >= limit:
+                break
+    if not frames:
+        raise ValueError(f"{path}: no Ethernet frames")
+    return frames
+
+
+class ReplaySniffer:
+    # Same start()/stop() shape as RawSniffer. Sends frames to the handler at
+    # `rate` per second for `duration` seconds, in bursts when the clock says
+    # it is behind, and times every handler call.
+    def __init__(self, handler, frames, rate, duration):
+        self.handler = handler
+        self.frames = frames
+        self.rate = rate
+        self.duration = duration
+        self.latency = LatencyHistogram()
+        self.sent = 0
+        self.elapsed = 0.0
+        self.cpu = 0.0
+        self.running = False
+        self.done = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        handler, frames, record = self.handler, self.frames, self.latency.record
+        perf = time.perf_counter_ns
+        n_frames = len(frames)
+        cpu0 = time.thread_time()
+        start = time.perf_counter()
+        sent = 0
+        try:
+            while self.running:
+                now = time.perf_counter() - start
+                if now >= self.duration:
+                    break
+                due = min(int(now * self.rate) - sent, MAX_BURST)
+                if due <= 0:
+                    time.sleep(min(0.0005, (sent + 1) / self.rate - now))
+                    continue
+                for _ in range(due):
+                    frame = frames[sent % n_frames]
+                    size = len(frame)
+                    t0 = perf()
+                    handler(frame, size, size)
+                    record(perf() - t0)
+                    sent += 1
+                self.sent = sent
+        finally:
+            self.sent = sent
+            self.elapsed = time.perf_counter() - start
+            self.cpu = time.thread_time() - cpu0
+            self.done.set()
+
+    def stop(self, join=True):
+        self.running = False
+        if join and self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def _slope(samples, x, y):
+    if len(samples) < 2:
+        return 0.0
+    xs = [s[x] for s in samples]
+    ys = [s[y] for s in samples]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    var = sum((a - mx) ** 2 for a in xs)
+    return sum((a - mx) * (b - my) for a, b in zip(xs, ys)) / var if var else 0.0
+
+
+def _us(ns):
+    return round(ns / 1000, 2)
+
+
+# One rate: fresh session, one /ws client draining frames as fast as it can,
+# memory and queues sampled while the sender runs, then the stats backlog is
+# given time to drain.
+def run_step(frames, rate, duration=STEP_SECONDS, metrics=False, store_dir=None):
+    with tempfile.TemporaryDirectory() as tmp:
+        session = CaptureSession(0, f"replay {rate}", capture_config({"mode": "raw"}),
+                                 store_dir=store_dir or tmp, metrics=metrics)
+        sub = session.broadcaster.subscribe()
+        client = {"frames": 0, "bytes": 0}
+
+        def drain():
+            while not sub.closed:
+                frame = sub.next_frame(0.2)
+                if frame is not None:
+                    client["frames"] += 1
+                    client["bytes"] += len(frame)
+        drainer = threading.Thread(target=drain, daemon=True)
+        drainer.start()
+
+        handler = session.raw_packet_handler
+        if session.metrics is not None:
+            handler = TimedHandler(session.metrics, handler)     # as make_sniffer would wrap it
+        sniffer = ReplaySniffer(handler, frames, rate, duration)
+        rss_start = rss_bytes()
+        t0 = time.perf_counter()
+        session.start(sniffer=sniffer)
+        samples = []
+        while True:
+            done = sniffer.done.wait(SAMPLE_INTERVAL)
+            depths = session.queue_depths()
+            samples.append({
+                "t": round(time.perf_counter() - t0, 3),
+                "rss": rss_bytes(),
+                "sessionBytes": session.memory_usage()["total"],
+                "statsBacklog": depths["stats"],
+                "wsBacklog": depths["broadcast"]
+            })
+            if done:
+                break
+
+        drain_start = time.perf_counter()
+        while session.queue_depths()["stats"] and time.perf_counter() - drain_start < DRAIN_TIMEOUT:
+            time.sleep(0.01)
+        drain_seconds = time.perf_counter() - drain_start
+        time.sleep(0.3)     # let the shard publish and the broadcaster send its last batch
+        totals = session.stats.totals()
+        drops = session.drops()
+        broadcaster = session.broadcaster
+        published, sampled_out = broadcaster.published, broadcaster.sampled_out
+        rss_end = rss_bytes()
+        session.close()
+        drainer.join()
+        session.stats_thread.join()
+
+    lat = sniffer.latency
+    achieved = sniffer.sent / sniffer.elapsed if sniffer.elapsed else 0.0
+    lossless = drops["ring"] == 0 and drops["stats"] == 0 and totals["totalPackets"] == sniffer.sent
+    sustained = achieved >= KEEP_UP * rate and lossless and drain_seconds <= DRAIN_LIMIT
+    return {
+        "offeredRate": rate,
+        "achievedRate": round(achieved, 1),
+        "sent": sniffer.sent,
+        "counted": totals["totalPackets"],
+        "sustained": sustained,
+        "handlerP50Us": _us(quantile(lat, 0.5)),
+        "handlerP99Us": _us(quantile(lat, 0.99)),
+        "handlerP999Us": _us(quantile(lat, 0.999)),
+        "handlerMeanUs": _us(lat.total / lat.count) if lat.count else 0.0,
+        "senderCpuSeconds": round(sniffer.cpu, 3),
+        "statsDrainSeconds": round(drain_seconds, 3),
+        "maxStatsBacklog": max(s["statsBacklog"] for s in samples),
+        "maxWsBacklog": max(s["wsBacklog"] for s in samples),
+        "drops": drops,
+        "wsFrames": client["frames"],
+        "wsBytes": client["bytes"],
+        "wsPublished": published,
+        "wsSampledOut": sampled_out,
+        "clientDroppedFrames": sub.dropped_frames,
+        "rssStart": rss_start,
+        "rssEnd": rss_end,
+        "rssPeak": max([s["rss"] for s in samples] + [rss_end]),
+        "rssGrowthBytesPerSecond": round(_slope(samples, "t", "rss"), 1),
+        "sessionBytesGrowthPerSecond": round(_slope(samples, "t", "sessionBytes"), 1),
+        "samples": samples
+    }
+
+
+def _version():
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# Steps through `rates` in order and stops after `patience` consecutive
+# steps that could not be sustained. The saturation point is the highest
+# sustained rate.
+def sweep(frames, rates=DEFAULT_RATES, duration=STEP_SECONDS, metrics=False, patience=1, log=None):
+    steps, failed = [], 0
+    for rate in rates:
+        step = run_step(frames, rate, duration, metrics)
+        steps.append(step)
+        if log is not None:
+            log(f"{rate:>9} pps offered  {step['achievedRate']:>11.1f} achieved  "
+                f"p50 {step['handlerP50Us']:>7} us  p99 {step['handlerP99Us']:>7} us  "
+                f"{'ok' if step['sustained'] else 'SATURATED'}")
+        failed = 0 if step["sustained"] else failed + 1
+        if failed >= patience:
+            break
+    sustained = [s["offeredRate"] for s in steps if s["sustained"]]
+    return {
+        "version": _version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stepSeconds": duration,
+        "frames": len(frames),
+        "metrics": metrics,
+        "saturationRate": max(sustained) if sustained else None,
+        "steps": steps
+    }
+
+
+def compare(old, new):
+    lines = [f"saturation: {old.get('saturationRate')} -> {new.get('saturationRate')} pps"]
+    before = {s["offeredRate"]: s for s in old["steps"]}
+    for step in new["steps"]:
+        prev = before.get(step["offeredRate"])
+        if prev is None:
+            continue
+        lines.append(f"{step['offeredRate']:>9} pps  achieved {prev['achievedRate']} -> {step['achievedRate']}  "
+                     f"p99 {prev['handlerP99Us']} -> {step['handlerP99Us']} us  "
+                     f"rss growth {prev['rssGrowthBytesPerSecond']} -> {step['rssGrowthBytesPerSecond']} B/s")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Replay synthetic traffic through the capture stack and find "
+                                                 "the rate it saturates at.")
+    parser.add_argument("--rates", type=int, nargs="+", default=list(DEFAULT_RATES), help="Offered packets/s, in order")
+    parser.add_argument("--duration", type=float, default=STEP_SECONDS, help="Seconds per rate")
+    parser.add_argument("--frames", type=int, default=4096, help="Synthetic frames in the replay pool")
+    parser.add_argument("--pcap", help="Replay Ethernet frames from this capture instead")
+    parser.add_argument("--metrics", action="store_true", help="Run sessions with /api/metrics instrumentation on")
+    parser.add_argument("--patience", type=int, default=1, help="Unsustained steps before the sweep stops")
+    parser.add_argument("--output", "-o", default="replay-results.json")
+    parser.add_argument("--compare", metavar="JSON", help="Earlier results to compare against")
+    args = parser.parse_args()
+
+    frames = pcap_frames(args.pcap) if args.pcap else synthetic_frames(args.frames)
+    results = sweep(frames, args.rates, args.duration, args.metrics, args.patience,
+                    log=lambda line: print(line, file=sys.stderr))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"saturation point: {results['saturationRate']} pps; results saved to {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print(compare(json.load(f), results))
@@ -0,0 +1,154 @@
+import threading
+from array import array
+
+OVERWRITE_OLDEST = "overwrite"
+DROP_NEWEST = "drop"
+
+
+class Cursor:
+    def __init__(self, seq=0):
+        self.seq = seq          # next sequence number this consumer will read
+        self.missed = 0         # records overwritten before this consumer got to them
+
+
+class PacketRing:
+    # Fixed-capacity ring of packet records stored as parallel columns.
+    # One producer (the sniffer thread) calls push(); any number of consumers
+    # hold their own Cursor and call read(). The producer never takes a lock:
+    # it fills the slot first and only then publishes the new head, so a
+    # consumer that sees head == n can safely read every slot below n.
+    # The anomaly score column is the one exception: it is filled in later by
+    # a single scoring consumer, which publishes `scored` the same way.
+    def __init__(self, capacity=65536, policy=OVERWRITE_OLDEST):
+        if capacity <= 0 or capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        if policy not in (OVERWRITE_OLDEST, DROP_NEWEST):
+            raise ValueError(f"unknown ring policy: {policy}")
+        self.capacity = capacity
+        self.mask = capacity - 1
+        self.policy = policy
+
+        self.ids = array("q", bytes(8 * capacity))
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.protos = array("h", bytes(2 * capacity))
+        self.sizes = array("l", bytes(array("l").itemsize * capacity))
+        self.sports = array("l", bytes(array("l").itemsize * capacity))
+        self.dports = array("l", bytes(array("l").itemsize * capacity))
+        self.flags = array("B", bytes(capacity))
+        self.scores = array("f", bytes(4 * capacity))
+        self.src = [None] * capacity
+        self.dst = [None] * capacity
+        self.packets = [None] * capacity    # original frame, only dissected further on demand
+
+        self.head = 0           # total records published
+        self.dropped = 0        # records rejected in drop-newest mode
+        self.scored = None      # records scored so far, or None when nothing scores this ring
+        self._cursors = ()      # replaced wholesale so push() can iterate without a lock
+        self._cursor_lock = threading.Lock()
+
+    def subscribe(self, from_start=False):
+        cursor = Cursor(max(0, self.head - self.capacity) if from_start else self.head)
+        with self._cursor_lock:
+            self._cursors = self._cursors + (cursor,)
+        return cursor
+
+    def unsubscribe(self, cursor):
+        with self._cursor_lock:
+            self._cursors = tuple(c for c in self._cursors if c is not cursor)
+
+    def push(self, pid, timestamp, src, dst, proto, size, sport=0, dport=0, flags=0, packet=None):
+        head = self.head
+        if self.policy == DROP_NEWEST:
+            cursors = self._cursors
+            if cursors and head - min(c.seq for c in cursors) >= self.capacity:
+                self.dropped += 1
+                return False
+        i = head & self.mask
+        self.ids[i] = pid
+        self.timestamps[i] = timestamp
+        self.protos[i] = proto
+        self.sizes[i] = size
+        self.sports[i] = sport
+        self.dports[i] = dport
+        self.flags[i] = flags
+        self.scores[i] = 0.0
+        self.src[i] = src
+        self.dst[i] = dst
+        self.packets[i] = packet
+        self.head = head + 1
+        return True
+
+    # Records come back as (id, timestamp, src, dst, proto, size, sport,
+    # dport, tcp_flags, score, packet). `upto` caps the read below head, e.g.
+    # at `scored` for consumers that want final scores.
+    def read(self, cursor, limit=None, upto=None):
+        head = self.head
+        start = cursor.seq
+        if head - start > self.capacity:
+            cursor.missed += head - self.capacity - start
+            start = head - self.capacity
+        end = head if upto is None else max(start, min(head, upto))
+        if limit is not None:
+            end = min(end, start + limit)
+
+        ids, timestamps, protos, sizes = self.ids, self.timestamps, self.protos, self.sizes
+        sports, dports, flags, scores = self.sports, self.dports, self.flags, self.scores
+        src, dst, packets, mask = self.src, self.dst, self.packets, self.mask
+        records = []
+        for seq in range(start, end):
+            i = seq & mask
+            records.append((ids[i], timestamps[i], src[i], dst[i], protos[i], sizes[i],
+                            sports[i], dports[i], flags[i], scores[i], packets[i]))
+
+        # The producer may have lapped us while we were copying; anything at or
+        # below (new head - capacity) could be a mix of old and new values.
+        new_head = self.head
+        safe = new_head - self.capacity + 1 if new_head != head else 0
+        if start < safe:
+            torn = min(safe, end) - start
+            cursor.missed += torn
+            records = records[torn:]
+        cursor.seq = end
+        return records
+
+    # Look up a still-buffered packet by id, walking back from the newest.
+    # Ids only grow within a capture, so we can stop as soon as we pass it.
+    def find(self, pid):
+        head = self.head
+        for seq in range(head - 1, max(0, head - self.capacity) - 1, -1):
+            i = seq & self.mask
+            slot_id = self.ids[i]
+            if slot_id == pid:
+                rec = (slot_id, self.timestamps[i], self.src[i], self.dst[i], self.protos[i], self.sizes[i],
+                       self.sports[i], self.dports[i], self.flags[i], self.scores[i], self.packets[i])
+                new_head = self.head
+                oldest = new_head - self.capacity + (new_head != head)
+                return rec if seq >= oldest else None
+            if slot_id < pid:
+                break
+        return None
+
+    # Fixed column storage plus the frames currently held. Frame size is taken
+    # from the size column rather than walking every retained object.
+    def memory_bytes(self):
+        columns = sum(a.itemsize * len(a) for a in (self.ids, self.timestamps, self.protos, self.sizes,
+                                                    self.sports, self.dports, self.flags, self.scores))
+        slots = 3 * 8 * self.capacity
+        frames = sum(self.sizes) if self.head >= self.capacity else sum(self.sizes[:self.head])
+        return columns + slots + frames
+
+    # Called by the scoring consumer for the records it just read; `end` is
+    # its cursor position, i.e. one past the last record scored.
+    def set_scores(self, end, scores):
+        mask, column = self.mask, self.scores
+        seq = end - len(scores)
+        for score in scores:
+            column[seq & mask] = score
+            seq += 1
+        self.scored = end
+
+    def pending(self, cursor, upto=None):
+        return max(0, (self.head if upto is None else min(self.head, upto)) - cursor.seq)
+
+    def __len__(self):
+        return min(self.head, self.capacity)
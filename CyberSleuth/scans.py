@@ -0,0 +1,228 @@
+import math
+from collections import OrderedDict
+
+from sketches import hash64
+
+# Stateful port-scan and SYN-flood detection. Both detectors keep one
+# fixed-size record per key (scanning source, flood target) in a bounded LRU
+# table, so memory is capped by the table size whatever the traffic does: a
+# host spraying millions of probes still owns a single record, and a flood of
+# spoofed sources only churns the table.
+
+SCAN_SLOTS = 16384           # scanning sources tracked
+SCAN_WINDOW = 10.0           # seconds; distinct sets cover the last half to full window
+SCAN_BITS = 1024             # linear-counting bitmap per distinct set and generation
+VERTICAL_PORTS = 100         # distinct ports probed by one source
+HORIZONTAL_HOSTS = 50        # distinct hosts probed by one source
+SCAN_MAX_ANSWERED = 0.5      # busy clients get most of their SYNs answered; scanners do not
+UDP_PROBE_PORTS = 1024       # UDP to a port below this counts as a probe (replies go to ephemeral ports)
+
+FLOOD_SLOTS = 16384          # flood targets tracked
+FLOOD_TAU = 5.0              # decay time constant of the SYN / ACK rates, seconds
+FLOOD_RATE = 200.0           # bare SYNs per second to one host
+FLOOD_RATIO = 3.0            # ... outnumbering ACK-bearing segments to it by this much
+FLOOD_BITS = 1024            # distinct-source bitmap per generation
+
+ALERT_COOLDOWN = 60.0        # seconds before the same source or target alerts again
+
+TCP_SYN = 0x02
+TCP_ACK = 0x10
+TCP_RST = 0x04
+
+
+def _distinct(ones, bits):
+    if ones >= bits:
+        return int(bits * math.log(bits))
+    return int(round(-bits * math.log(1 - ones / bits)))
+
+
+# Integer finaliser for port numbers. Linear counting assumes random bit
+# positions; ports taken as-is (or through hash(), which is the identity for
+# ints) are sequential in a scan and skew the estimate. Addresses go through
+# sketches.hash64, which unlike hash() is the same in every run.
+def _mix(x):
+    x = ((x ^ (x >> 16)) * 0x45D9F3B) & 0xFFFFFFFF
+    x = ((x ^ (x >> 16)) * 0x45D9F3B) & 0xFFFFFFFF
+    return x ^ (x >> 16)
+
+
+def _lru_get(table, key, capacity, make):
+    state = table.get(key)
+    if state is None:
+        if len(table) >= capacity:
+            table.popitem(last=False)
+        state = table[key] = make()
+    else:
+        table.move_to_end(key)
+    return state
+
+
+class ScanState:
+    __slots__ = ("gen", "ports", "ports_old", "hosts", "hosts_old", "probes", "probes_old",
+                 "answered", "answered_old", "last_dst", "alerted")
+
+    def __init__(self, gen):
+        self.gen = gen
+        self.ports = self.ports_old = 0         # SCAN_BITS-wide bitmaps as ints
+        self.hosts = self.hosts_old = 0
+        self.probes = self.probes_old = 0
+        self.answered = self.answered_old = 0
+        self.last_dst = None
+        self.alerted = -ALERT_COOLDOWN
+
+    # Generations are half a window long; the estimates use the current and
+    # the previous one, so they only ever see the last SCAN_WINDOW seconds.
+    def rotate(self, gen):
+        if gen == self.gen + 1:
+            self.ports_old, self.hosts_old = self.ports, self.hosts
+            self.probes_old, self.answered_old = self.probes, self.answered
+        else:
+            self.ports_old = self.hosts_old = self.probes_old = self.answered_old = 0
+        self.ports = self.hosts = self.probes = self.answered = 0
+        self.gen = gen
+
+
+class ScanDetector:
+    # Counts, per source, the distinct destination ports and hosts it has
+    # probed recently. A probe is a bare TCP SYN or a UDP datagram to a
+    # well-known port; a SYN-ACK coming back answers one. Many ports means a
+    # vertical scan, many hosts a horizontal one, both a block scan, but only
+    # while most probes go unanswered: a browser opening fifty connections
+    # gets fifty SYN-ACKs. UDP replies cannot be told from other traffic, so
+    # UDP probes only count towards the ports: DNS, NTP and QUIC to many
+    # servers neither look like a host sweep nor drag the answered ratio down.
+    def __init__(self, capacity=SCAN_SLOTS):
+        self.capacity = capacity
+        self.sources = OrderedDict()
+
+    def observe(self, timestamp, src, dst, proto, dport, flags):
+        gen = int(timestamp // (SCAN_WINDOW / 2))
+        if proto == 6:
+            if flags & TCP_SYN and flags & TCP_ACK:
+                # reply to a probe from dst; never creates state
+                state = self.sources.get(dst)
+                if state is not None:
+                    if gen != state.gen:
+                        state.rotate(gen)
+                    state.answered += 1
+                return None
+            if not flags & TCP_SYN or flags & (TCP_ACK | TCP_RST):
+                return None
+        elif proto != 17 or not 0 < dport < UDP_PROBE_PORTS:
+            return None
+
+        state = _lru_get(self.sources, src, self.capacity, lambda: ScanState(gen))
+        if gen != state.gen:
+            state.rotate(gen)
+        state.last_dst = dst
+        port_bit = 1 << (_mix(dport) & (SCAN_BITS - 1))
+        host_bit = 0
+        if proto == 6:
+            state.probes += 1
+            host_bit = 1 << (hash64(dst) & (SCAN_BITS - 1))
+        if state.ports & port_bit and (state.hosts & host_bit) == host_bit:
+            return None     # nothing new; the estimates cannot have grown
+        state.ports |= port_bit
+        state.hosts |= host_bit
+        if timestamp - state.alerted < ALERT_COOLDOWN:
+            return None
+
+        ports = _distinct((state.ports | state.ports_old).bit_count(), SCAN_BITS)
+        hosts = _distinct((state.hosts | state.hosts_old).bit_count(), SCAN_BITS)
+        vertical, horizontal = ports >= VERTICAL_PORTS, hosts >= HORIZONTAL_HOSTS
+        if not (vertical or horizontal):
+            return None
+        probes = state.probes + state.probes_old
+        answered = min(state.answered + state.answered_old, probes) / probes if probes else 0.0
+        if answered > SCAN_MAX_ANSWERED:
+            return None
+        state.alerted = timestamp
+        return {
+            "kind": "portScan",
+            "scanType": "block" if vertical and horizontal else "vertical" if vertical else "horizontal",
+            "timestamp": timestamp,
+            "source": src,
+            "target": state.last_dst if not horizontal else None,
+            "ports": ports,
+            "hosts": hosts,
+            "probes": probes,
+            "answeredRatio": round(answered, 3)
+        }
+
+    def memory_bytes(self):
+        return len(self.sources) * (200 + 4 * SCAN_BITS // 8)
+
+
+class FloodState:
+    __slots__ = ("last", "syns", "acks", "gen", "sources", "sources_old", "last_src", "alerted")
+
+    def __init__(self, timestamp, gen):
+        self.last = timestamp
+        self.syns = 0.0             # exponentially decayed counts, ~rate * FLOOD_TAU
+        self.acks = 0.0
+        self.gen = gen
+        self.sources = self.sources_old = 0
+        self.last_src = None
+        self.alerted = -ALERT_COOLDOWN
+
+    def decay(self, timestamp):
+        dt = timestamp - self.last
+        if dt > 0:
+            d = math.exp(-dt / FLOOD_TAU)
+            self.syns *= d
+            self.acks *= d
+            self.last = timestamp
+
+
+class SynFloodDetector:
+    # Per target host: decayed rates of bare SYNs and of ACK-bearing segments
+    # sent to it. Every completed handshake sends at least one ACK after its
+    # SYN, so a sustained SYN rate well above the ACK rate means half-open
+    # connections piling up. Keyed by target, so spoofed sources land in one
+    # record; a bitmap of their addresses tells a single flooder from a
+    # distributed flood.
+    def __init__(self, capacity=FLOOD_SLOTS):
+        self.capacity = capacity
+        self.targets = OrderedDict()
+
+    def observe(self, timestamp, src, dst, proto, flags):
+        if proto != 6 or not flags & (TCP_SYN | TCP_ACK):
+            return None
+        syn = flags & TCP_SYN and not flags & TCP_ACK
+        if not syn:
+            state = self.targets.get(dst)
+            if state is not None:
+                state.decay(timestamp)
+                state.acks += 1
+            return None
+
+        gen = int(timestamp // FLOOD_TAU)
+        state = _lru_get(self.targets, dst, self.capacity, lambda: FloodState(timestamp, gen))
+        state.decay(timestamp)
+        state.syns += 1
+        if gen != state.gen:
+            state.sources_old = state.sources if gen == state.gen + 1 else 0
+            state.sources = 0
+            state.gen = gen
+        state.sources |= 1 << (hash64(src) & (FLOOD_BITS - 1))
+        state.last_src = src
+
+        syn_rate = state.syns / FLOOD_TAU
+        if syn_rate < FLOOD_RATE or state.syns < FLOOD_RATIO * (state.acks + 1):
+            return None
+        if timestamp - state.alerted < ALERT_COOLDOWN:
+            return None
+        state.alerted = timestamp
+        sources = _distinct((state.sources | state.sources_old).bit_count(), FLOOD_BITS)
+        return {
+            "kind": "synFlood",
+            "timestamp": timestamp,
+            "source": state.last_src if sources <= 1 else None,
+            "target": dst,
+            "synRate": round(syn_rate, 1),
+            "ackRate": round(state.acks / FLOOD_TAU, 1),
+            "sources": sources
+        }
+
+    def memory_bytes(self):
+        return len(self.targets) * (200 + 2 * FLOOD_BITS // 8)
@@ -0,0 +1,250 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import phishing
+import verdicts
+
+# Serving side of the phishing model for /api/phishing/score. Request
+# threads hand their URLs to a MicroBatcher and block; one batching thread
+# coalesces whatever arrives within MAX_WAIT (or until MAX_BATCH URLs are
+# queued) and featurises and scores it as one matrix, so concurrent single
+# URL requests share one predict_proba() call instead of paying for one
+# each. The wait only applies while requests are arriving together; a
+# lone client is scored at once. Requests already carrying MAX_BATCH or
+# more URLs skip the queue. URLs are put in canonical form first; in front
+# of the batcher sits the verdict cache, and only its misses are scored.
+
+MODEL_PATH = os.environ.get("CYBERSLEUTH_PHISHING_MODEL", phishing.MODEL_PATH)
+MAX_BATCH = 64               # URLs per coalesced batch
+MAX_WAIT = 0.003             # seconds the first queued request waits for company
+MAX_URLS = 10000             # URLs accepted in one request
+
+
+def _feature_value(v):
+    return int(v) if v.is_integer() else round(v, 6)
+
+
+# Featurise and score `urls` in one pass. Returns the per-URL results and
+# how long each stage took, in seconds.
+def score_urls(urls, model_path=MODEL_PATH):
+    loaded = phishing.registry.get(model_path)
+    names = loaded.feature_names
+    t0 = time.perf_counter()
+    X = phishing.extract_url_features_batch(urls, names)
+    t1 = time.perf_counter()
+    proba = loaded.scorer.predict_proba(X)
+    labels = loaded.scorer.classes_.take(proba.argmax(axis=1))
+    t2 = time.perf_counter()
+    results = [{
+        "url": url,
+        "prediction": int(label),
+        "phish_probability": float(p),
+        "features": {name: _feature_value(v) for name, v in zip(names, row)}
+    } for url, label, p, row in zip(urls, labels, proba[:, 1], X.astype(np.float64).tolist())]
+    return results, {"features": t1 - t0, "predict": t2 - t1}
+
+
+class _Request:
+    __slots__ = ("urls", "queued", "done", "results", "timing", "error")
+
+    def __init__(self, urls):
+        self.urls = urls
+        self.queued = time.perf_counter()
+        self.done = threading.Event()
+        self.results = None
+        self.timing = None
+        self.error = None
+
+
+class MicroBatcher:
+    def __init__(self, fn=score_urls, max_batch=MAX_BATCH, max_wait=MAX_WAIT):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = deque()
+        self.pending_urls = 0
+        self.cond = threading.Condition()
+        self.thread = None
+        self.batches = 0
+        self.batched_urls = 0
+        self.coalesced = False      # last batch held more than one request
+
+    # Results for `urls` (in order) and a timing dict: seconds spent queued,
+    # per stage of the batch it rode in, and that batch's size.
+    def submit(self, urls):
+        if len(urls) >= self.max_batch:
+            results, timing = self.fn(urls)
+            return results, dict(timing, queue=0.0, batch=len(urls))
+        req = _Request(urls)
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+            self.pending.append(req)
+            self.pending_urls += len(urls)
+            self.cond.notify()
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.results, req.timing
+
+    def _take(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            # A lone client gains nothing from waiting: only hold the batch
+            # open while requests have recently been arriving together.
+            deadline = self.pending[0].queued + (self.max_wait if self.coalesced else 0.0)
+            while self.pending_urls < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            batch, n = [], 0
+            while self.pending and (not batch or n + len(self.pending[0].urls) <= self.max_batch):
+                req = self.pending.popleft()
+                batch.append(req)
+                n += len(req.urls)
+            self.pending_urls -= n
+            self.coalesced = len(batch) > 1
+            return batch, n
+
+    def _run(self):
+        while True:
+            batch, n = self._take()
+            started = time.perf_counter()
+            urls = [u for req in batch for u in req.urls]
+            try:
+                results, timing = self.fn(urls)
+            except Exception as e:
+                for req in batch:
+                    req.error = e
+                    req.done.set()
+                continue
+            self.batches += 1
+            self.batched_urls += n
+            i = 0
+            for req in batch:
+                req.results = results[i:i + len(req.urls)]
+                req.timing = dict(timing, queue=started - req.queued, batch=n)
+                i += len(req.urls)
+                req.done.set()
+
+
+batcher = MicroBatcher()
+
+
+# Results for `urls` in order and the batcher's timing plus how many URLs
+# the verdict cache answered. URLs are scored in canonical form whether or
+# not the cache is on, and each result's `url` is the string scored. A
+# request answered entirely from the cache reports a batch of 0.
+def score(urls):
+    keys = [verdicts.canonical_url(u) for u in urls]
+    cache = verdicts.shared_cache()
+    if cache is None:
+        results, timing = batcher.submit(keys)
+        return results, dict(timing, cacheHits=0)
+    version = phishing.registry.get(MODEL_PATH).version
+    cached = cache.get_many(keys, version)
+    misses = list(dict.fromkeys(k for k, v in zip(keys, cached) if v is None))
+    fresh = {}
+    timing = {"features": 0.0, "predict": 0.0, "queue": 0.0, "batch": 0}
+    if misses:
+        results, timing = batcher.submit(misses)
+        cache.put_many(list(zip(misses, results)), version)
+        fresh = dict(zip(misses, results))
+    # copies, so a caller editing its results cannot change the cache
+    out = [dict(r, features=dict(r["features"])) for r in
+           (v if v is not None else fresh[k] for k, v in zip(keys, cached))]
+    return out, dict(timing, cacheHits=len(urls) - cached.count(None))
+
+# Concurrent single-URL clients against a running server (or one started
+# here on an ephemeral port), one keep-alive connection each. Reports
+# throughput, latency percentiles and the mean batch size the server saw.
+def run_load_test(base_url=None, levels=(1, 2, 4, 8, 16, 32), requests_per_client=200, urls=None):
+    import http.client
+    from urllib.parse import urlsplit
+
+    server = None
+    if base_url is None:
+        from werkzeug.serving import make_server
+        from network import app
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{server.server_port}"
+    target = urlsplit(base_url)
+    if urls is None:
+        urls = list(phishing.build_demo_url_dataset(500, 500)["url"])
+
+    def client(c, latencies, batch_sizes, errors):
+        conn = http.client.HTTPConnection(target.hostname, target.port)
+        for i in range(requests_per_client):
+            body = json.dumps({"url": urls[(c * requests_per_client + i) % len(urls)]})
+            t0 = time.perf_counter()
+            try:
+                conn.request("POST", "/api/phishing/score", body, {"Content-Type": "application/json"})
+                resp = conn.getresponse()
+                resp.read()
+            except (OSError, http.client.HTTPException):
+                errors.append(1)
+                conn.close()
+                conn = http.client.HTTPConnection(target.hostname, target.port)
+                continue
+            latencies.append(time.perf_counter() - t0)
+            if resp.status != 200:
+                errors.append(resp.status)
+            batch_sizes.append(int(resp.getheader("X-Batch-Size", "1")))
+        conn.close()
+
+    results = []
+    try:
+        for level in levels:
+            latencies, batch_sizes, errors = [], [], []
+            threads = [threading.Thread(target=client, args=(c, latencies, batch_sizes, errors))
+                       for c in range(level)]
+            start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - start
+            latencies.sort()
+
+            def pick(q):
+                if not latencies:
+                    return 0.0
+                return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2)
+            results.append({
+                "concurrency": level,
+                "requests": len(latencies),
+                "errors": len(errors),
+                "requestsPerSecond": round(len(latencies) / elapsed, 1),
+                "latencyP50Ms": pick(0.5),
+                "latencyP99Ms": pick(0.99),
+                "meanBatchSize": round(sum(batch_sizes) / len(batch_sizes), 2) if batch_sizes else 0.0
+            })
+    finally:
+        if server is not None:
+            server.shutdown()
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Load test for /api/phishing/score at several concurrency levels.")
+    parser.add_argument("--url", help="Base URL of a running server (default: start one in-process)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per client")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH, help="In-process server only; 1 turns batching off")
+    parser.add_argument("--max-wait", type=float, default=MAX_WAIT, help="In-process server only, seconds")
+    args = parser.parse_args()
+    if args.url is None:
+        import network
+        network.scoring.batcher.max_batch = args.max_batch
+        network.scoring.batcher.max_wait = args.max_wait
+    print(json.dumps(run_load_test(args.url, args.concurrency, args.requests), indent=2))
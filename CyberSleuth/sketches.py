@@ -0,0 +1,210 @@
+import math
+import sys
+from array import array
+from hashlib import blake2b
+
+
+class SpaceSaving:
+    # Space-Saving heavy-hitter counter (Metwally et al.) with a fixed number of
+    # slots. A key that is not tracked takes over the slot with the smallest
+    # count and inherits that count as its error, so for every reported key
+    #   count - error <= true count <= count
+    # and any key with true count > total / capacity is guaranteed to be kept.
+    # Byte totals ride along in the same slots with the same kind of bound.
+    def __init__(self, capacity=100):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.keys = [None] * capacity
+        self.counts = array("q", bytes(8 * capacity))
+        self.errors = array("q", bytes(8 * capacity))
+        self.bytes = array("q", bytes(8 * capacity))
+        self.byte_errors = array("q", bytes(8 * capacity))
+        self.slots = {}
+        self.used = 0
+        self.total = 0
+        self.total_bytes = 0
+
+    def add(self, key, size=0, weight=1):
+        self.total += weight
+        self.total_bytes += size
+        i = self.slots.get(key)
+        if i is None:
+            if self.used < self.capacity:
+                i = self.used
+                self.used += 1
+                err = berr = 0
+            else:
+                err = min(self.counts)
+                i = self.counts.index(err)
+                berr = self.bytes[i]
+                del self.slots[self.keys[i]]
+            self.keys[i] = key
+            self.slots[key] = i
+            self.counts[i] = self.errors[i] = err
+            self.bytes[i] = self.byte_errors[i] = berr
+        self.counts[i] += weight
+        self.bytes[i] += size
+
+    def top(self, n=10):
+        order = sorted(range(self.used), key=self.counts.__getitem__, reverse=True)[:n]
+        return [{
+            "key": self.keys[i],
+            "count": self.counts[i],
+            "error": self.errors[i],
+            "bytes": self.bytes[i],
+            "bytesError": self.byte_errors[i]
+        } for i in order]
+
+    def __len__(self):
+        return self.used
+
+
+def hash64(key):
+    # Stable across processes (unlike hash()), so sketches built by different
+    # workers can be merged.
+    if not isinstance(key, bytes):
+        key = str(key).encode()
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), "little")
+
+
+class HyperLogLog:
+    def __init__(self, precision=14):
+        if not 4 <= precision <= 18:
+            raise ValueError("precision must be between 4 and 18")
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        self._shift = 64 - precision
+        self._low = (1 << self._shift) - 1
+        if self.m >= 128:
+            self._alpha = 0.7213 / (1 + 1.079 / self.m)
+        else:
+            self._alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+
+    def add_hash(self, h):
+        i = h >> self._shift
+        rho = self._shift - (h & self._low).bit_length() + 1
+        if rho > self.registers[i]:
+            self.registers[i] = rho
+
+    def add(self, key):
+        self.add_hash(hash64(key))
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("cannot merge HyperLogLogs with different precision")
+        regs = self.registers
+        for i, r in enumerate(other.registers):
+            if r > regs[i]:
+                regs[i] = r
+
+    def estimate(self):
+        regs, m = self.registers, self.m
+        # histogram via bytes.count keeps this to ~65 C-level scans
+        harmonic = sum(regs.count(r) * 2.0 ** -r for r in range(max(regs) + 1))
+        e = self._alpha * m * m / harmonic
+        zeros = regs.count(0)
+        if e <= 2.5 * m and zeros:
+            e = m * math.log(m / zeros)
+        return int(round(e))
+
+    def memory_bytes(self):
+        return len(self.registers)
+
+    def copy(self):
+        c = HyperLogLog(self.p)
+        c.registers[:] = self.registers
+        return c
+
+
+class DistinctCounter:
+    # Exact set of 64-bit key hashes while the population is small; promoted to
+    # a HyperLogLog once it passes `exact_limit`, so memory stops growing.
+    def __init__(self, precision=14, exact_limit=4096):
+        self.precision = precision
+        self.exact_limit = exact_limit
+        self.exact = set()
+        self.hll = None
+
+    def add_hash(self, h):
+        if self.hll is not None:
+            self.hll.add_hash(h)
+            return
+        self.exact.add(h)
+        if len(self.exact) > self.exact_limit:
+            self._promote()
+
+    def add(self, key):
+        self.add_hash(hash64(key))
+
+    def _promote(self):
+        hll = HyperLogLog(self.precision)
+        for h in self.exact:
+            hll.add_hash(h)
+        self.hll = hll
+        self.exact = None
+
+    def merge(self, other):
+        if other.hll is None:
+            for h in other.exact:
+                self.add_hash(h)
+            return
+        if self.hll is None:
+            self._promote()
+        self.hll.merge(other.hll)
+
+    # Readers may run on another thread while _promote swaps modes, so take
+    # one reference to the exact set and stick with it.
+    def estimate(self):
+        exact = self.exact
+        return len(exact) if exact is not None else self.hll.estimate()
+
+    def is_exact(self):
+        return self.exact is not None
+
+    def copy(self):
+        c = DistinctCounter(self.precision, self.exact_limit)
+        exact = self.exact
+        if exact is None:
+            c.hll, c.exact = self.hll.copy(), None
+        else:
+            c.exact = set(exact)
+        return c
+
+    def memory_bytes(self):
+        exact = self.exact
+        if exact is None:
+            return self.hll.memory_bytes()
+        return sys.getsizeof(exact) + 32 * len(exact)
+
+
+class WindowedDistinct:
+    # Distinct count over a sliding time window: one HyperLogLog per bucket,
+    # merged on read. Buckets are reused in place as time moves on.
+    def __init__(self, span=60, buckets=6, precision=12):
+        self.bucket_len = span / buckets
+        self.buckets = [HyperLogLog(precision) for _ in range(buckets)]
+        self.bucket_ids = [-1] * buckets
+
+    def add_hash(self, h, timestamp):
+        b = int(timestamp // self.bucket_len)
+        i = b % len(self.buckets)
+        if self.bucket_ids[i] != b:
+            self.bucket_ids[i] = b
+            self.buckets[i].registers[:] = bytes(self.buckets[i].m)
+        self.buckets[i].add_hash(h)
+
+    def sketch(self, now):
+        current = int(now // self.bucket_len)
+        merged = HyperLogLog(self.buckets[0].p)
+        for b, hll in zip(self.bucket_ids, self.buckets):
+            if current - len(self.buckets) < b <= current:
+                merged.merge(hll)
+        return merged
+
+    def estimate(self, now):
+        return self.sketch(now).estimate()
+
+    def memory_bytes(self):
+        return sum(h.memory_bytes() for h in self.buckets)
@@ -0,0 +1,259 @@
+import glob
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from sketches import hash64
+
+# Append-only columnar capture store. A store is a directory prefix with one
+# or more segment files; a segment is a small schema header followed by
+# self-describing chunks:
+#
+#   chunk header: magic, row count, payload length, crc32, min time, max time
+#   address bloom filter (BLOOM_BYTES)
+#   zlib payload: one fixed-width array per column, string columns as indexes
+#                 into a per-chunk string table that follows the arrays
+#
+# The header alone says whether a chunk can hold rows for a time range or an
+# address, so queries skip everything else without decompressing it. Segments
+# are never rewritten: a writer starts a new one each time it is opened and
+# when the current one passes SEGMENT_BYTES. A torn chunk at the end of a
+# segment (crash, or a reader racing the writer) fails the length or crc
+# check and is treated as the end of the segment.
+
+SEGMENT_MAGIC = b"CSSG"
+CHUNK_MAGIC = b"CSCK"
+CHUNK_ROWS = 8192
+CHUNK_SECONDS = 5.0          # flush a partial chunk after this long, so queries see recent data
+SEGMENT_BYTES = 64 << 20
+BLOOM_BYTES = 1024           # 8192 bits, 3 probes: ~3% false positives at 1000 addresses per chunk
+BLOOM_MASK = BLOOM_BYTES * 8 - 1
+
+STRING = "s"                 # dictionary-encoded column; stored as "I" indexes
+
+_chunk_header = struct.Struct("<4sIIIdd")
+_u32 = struct.Struct("<I")
+
+PACKET_SCHEMA = (("id", "q"), ("timestamp", "d"), ("src", STRING), ("dst", STRING), ("proto", "h"),
+                 ("size", "q"), ("sport", "H"), ("dport", "H"), ("flags", "B"), ("score", "f"))
+FLOW_SCHEMA = (("src", STRING), ("dst", STRING), ("sport", "H"), ("dport", "H"), ("proto", "h"),
+               ("packets", "q"), ("bytes", "q"), ("firstSeen", "d"), ("lastSeen", "d"), ("tcpFlags", "B"),
+               ("anomalyScore", "f"), ("reason", STRING))
+
+# schema, (start time column, end time column), address columns
+PACKETS = (PACKET_SCHEMA, ("timestamp", "timestamp"), ("src", "dst"))
+FLOWS = (FLOW_SCHEMA, ("firstSeen", "lastSeen"), ("src", "dst"))
+
+
+def _bloom_bits(h):
+    return h & BLOOM_MASK, (h >> 13) & BLOOM_MASK, (h >> 26) & BLOOM_MASK
+
+
+def _bloom(addresses):
+    bloom = bytearray(BLOOM_BYTES)
+    for addr in addresses:
+        for b in _bloom_bits(hash64(addr)):
+            bloom[b >> 3] |= 1 << (b & 7)
+    return bloom
+
+
+def _bloom_has(bloom, addr):
+    return all(bloom[b >> 3] & (1 << (b & 7)) for b in _bloom_bits(hash64(addr)))
+
+
+def _little_endian(arr):
+    if sys.byteorder == "big":
+        arr.byteswap()
+    return arr
+
+
+def segment_paths(prefix):
+    return sorted(glob.glob(glob.escape(prefix) + "-*.seg"))
+
+
+class SegmentWriter:
+    # Buffers rows column-wise and writes a chunk every CHUNK_ROWS rows, or
+    # earlier when the owner calls flush_if_stale after CHUNK_SECONDS.
+    # Not thread-safe: one writer per consumer thread.
+    def __init__(self, prefix, kind=PACKETS, chunk_rows=CHUNK_ROWS):
+        self.schema, (self.start_col, self.end_col), self.addr_cols = kind
+        self.names = [name for name, _ in self.schema]
+        self.prefix = prefix
+        self.chunk_rows = chunk_rows
+        directory = os.path.dirname(prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.segment = len(segment_paths(prefix))
+        self.file = None
+        self.rows = 0
+        self.chunks = 0
+        self.bytes_written = 0
+        self._reset()
+        self._open_segment()
+
+    def _reset(self):
+        self.columns = [[] for _ in self.schema]
+        self.pending = 0
+        self.first_append = None
+
+    def _open_segment(self):
+        if self.file is not None:
+            self.file.close()
+        path = f"{self.prefix}-{self.segment:05d}.seg"
+        self.segment += 1
+        self.file = open(path, "ab")
+        schema = json.dumps(self.schema).encode()
+        self.file.write(SEGMENT_MAGIC + _u32.pack(len(schema)) + schema)
+        self.segment_bytes = self.file.tell()
+        self.segment_chunks = 0
+
+    # Rows are tuples in schema order; append_dict takes the same as a dict.
+    def append(self, row):
+        for col, value in zip(self.columns, row):
+            col.append(value)
+        self.pending += 1
+        if self.first_append is None:
+            self.first_append = time.monotonic()
+        if self.pending >= self.chunk_rows:
+            self.flush()
+
+    def append_dict(self, rec):
+        self.append(tuple(rec.get(name) for name in self.names))
+
+    def flush_if_stale(self):
+        if self.pending and time.monotonic() - self.first_append >= CHUNK_SECONDS:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        count = self.pending
+        strings = {}
+        parts = []
+        for (name, code), values in zip(self.schema, self.columns):
+            if code == STRING:
+                values = [strings.setdefault("" if v is None else str(v), len(strings)) for v in values]
+                code = "I"
+            parts.append(_little_endian(array(code, values)).tobytes())
+        parts.append("\0".join(strings).encode())
+        payload = zlib.compress(b"".join(parts), 1)
+
+        names = self.names
+        starts = self.columns[names.index(self.start_col)]
+        ends = self.columns[names.index(self.end_col)]
+        addresses = set()
+        for c in self.addr_cols:
+            addresses.update(self.columns[names.index(c)])
+        header = _chunk_header.pack(CHUNK_MAGIC, count, len(payload), zlib.crc32(payload), min(starts), max(ends))
+        chunk = header + _bloom(addresses) + payload
+
+        if self.segment_chunks and self.segment_bytes + len(chunk) > SEGMENT_BYTES:
+            self._open_segment()
+        self.file.write(chunk)
+        self.file.flush()
+        self.segment_bytes += len(chunk)
+        self.segment_chunks += 1
+        self.bytes_written += len(chunk)
+        self.rows += count
+        self.chunks += 1
+        self._reset()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class SegmentReader:
+    # Streams rows back out of every segment under `prefix`. Only chunk
+    # headers are read for chunks the query can rule out.
+    def __init__(self, prefix, kind=PACKETS):
+        self.prefix = prefix
+        self.schema, (self.start_col, self.end_col), self.addr_cols = kind
+        self.names = [name for name, _ in self.schema]
+        self.chunks_read = 0
+        self.chunks_skipped = 0
+
+    def _chunks(self, path):
+        with open(path, "rb") as f:
+            head = f.read(8)
+            if len(head) < 8 or head[:4] != SEGMENT_MAGIC:
+                return
+            schema = json.loads(f.read(_u32.unpack_from(head, 4)[0]))
+            if [tuple(c) for c in schema] != list(self.schema):
+                raise ValueError(f"{path}: schema does not match")
+            while True:
+                header = f.read(_chunk_header.size + BLOOM_BYTES)
+                if len(header) < _chunk_header.size + BLOOM_BYTES:
+                    return
+                magic, count, length, crc, t_min, t_max = _chunk_header.unpack_from(header)
+                if magic != CHUNK_MAGIC:
+                    return
+                yield count, t_min, t_max, header[_chunk_header.size:], f, length, crc
+
+    def _decode(self, count, payload):
+        data = memoryview(zlib.decompress(payload))
+        columns, o = [], 0
+        for name, code in self.schema:
+            code = "I" if code == STRING else code
+            arr = array(code)
+            size = arr.itemsize * count
+            arr.frombytes(data[o:o + size])
+            columns.append(_little_endian(arr))
+            o += size
+        strings = bytes(data[o:]).decode().split("\0")
+        for i, (name, code) in enumerate(self.schema):
+            if code == STRING:
+                columns[i] = [strings[j] for j in columns[i]]
+        return columns
+
+    # Rows (as dicts) that overlap [start, end] and involve `ip` in any
+    # address column; None leaves that side open. Rows come out in the order
+    # they were written, one decoded chunk in memory at a time.
+    def query(self, start=None, end=None, ip=None, limit=None):
+        names = self.names
+        si, ei = names.index(self.start_col), names.index(self.end_col)
+        addr_idx = [names.index(c) for c in self.addr_cols]
+        emitted = 0
+        for path in segment_paths(self.prefix):
+            for count, t_min, t_max, bloom, f, length, crc in self._chunks(path):
+                if (start is not None and t_max < start) or (end is not None and t_min > end) or \
+                        (ip is not None and not _bloom_has(bloom, ip)):
+                    f.seek(length, os.SEEK_CUR)
+                    self.chunks_skipped += 1
+                    continue
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break       # chunk still being written
+                self.chunks_read += 1
+                columns = self._decode(count, payload)
+                for row in zip(*columns):
+                    if start is not None and row[ei] < start:
+                        continue
+                    if end is not None and row[si] > end:
+                        continue
+                    if ip is not None and not any(row[i] == ip for i in addr_idx):
+                        continue
+                    yield dict(zip(names, row))
+                    emitted += 1
+                    if limit is not None and emitted >= limit:
+                        return
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Query a columnar capture store.")
+    parser.add_argument("prefix", help="Store prefix, e.g. captures/session-20250101-120000-4242-1-packets")
+    parser.add_argument("--flows", action="store_true", help="The store holds flow records")
+    parser.add_argument("--start", type=float)
+    parser.add_argument("--end", type=float)
+    parser.add_argument("--ip")
+    parser.add_argument("--limit", type=int)
+    args = parser.parse_args()
+    reader = SegmentReader(args.prefix, FLOWS if args.flows else PACKETS)
+    for rec in reader.query(args.start, args.end, args.ip, args.limit):
+        print(json.dumps(rec))
+    print(json.dumps({"chunksRead": reader.chunks_read, "chunksSkipped": reader.chunks_skipped}), file=sys.stderr)
@@ -0,0 +1,59 @@
+import math
+import time
+
+PACKET_COLUMNS = ("id", "timestamp", "sourceIp", "destinationIp", "protocol",
+                  "sourcePort", "destinationPort", "size", "info", "anomalyScore")
+
+BATCH_MAX = 500          # packets per frame
+BATCH_LATENCY = 0.1      # seconds a packet may wait for its frame to fill
+BEHIND_LIMIT = 5000      # pending packets before a client gets sampled
+POLL_INTERVAL = 0.01
+
+_MISSING = object()
+
+
+# One array per field instead of one object per packet; the browser only has
+# to walk a handful of arrays to rebuild rows.
+def columnar(rows):
+    return {c: [r[c] for r in rows] for c in PACKET_COLUMNS}
+
+
+class StatsDelta:
+    # Remembers the last stats frame sent to one client and returns only the
+    # top-level keys whose value changed since then.
+    def __init__(self):
+        self.last = None
+
+    def diff(self, snapshot):
+        if self.last is None:
+            self.last = snapshot
+            return snapshot, False
+        delta = {k: v for k, v in snapshot.items() if self.last.get(k, _MISSING) != v}
+        self.last = snapshot
+        return delta, True
+
+
+# Block until a frame's worth of packets is pending, the oldest pending packet
+# has waited `max_latency`, or `deadline` (monotonic) passes. A client that has
+# fallen more than `behind` packets back is sent every n-th packet so it can
+# catch up; n is returned alongside the records. If something scores the ring,
+# only scored packets count as pending.
+def collect(ring, cursor, max_batch=BATCH_MAX, max_latency=BATCH_LATENCY, deadline=None, behind=BEHIND_LIMIT):
+    flush_at = None
+    while True:
+        pending = ring.pending(cursor, ring.scored)
+        if pending >= max_batch:
+            break
+        now = time.monotonic()
+        if pending and flush_at is None:
+            flush_at = now + max_latency
+        if flush_at is not None and now >= flush_at:
+            break
+        if deadline is not None and now >= deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+    upto = ring.scored
+    lag = ring.pending(cursor, upto)
+    step = 1 if lag <= behind else math.ceil(lag / behind)
+    records = ring.read(cursor, max_batch * step, upto)
+    return records[::step], step
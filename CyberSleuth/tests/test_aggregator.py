@@ -0,0 +1,35 @@
+from aggregator import StatsAggregator, _batches
+
+
+def test_single_shard_publishes_without_sketch_copies():
+    agg = StatsAggregator()
+    shard = agg.new_shard()
+    for batch in _batches(3, 256):
+        shard.update(batch)
+    shard.publish()
+    assert shard.view.sketches is None and shard.view.tops is None
+    snap = agg.snapshot()
+    assert snap["totalPackets"] == 3 * 256
+    assert snap["uniqueIPs"] > 0
+
+
+def test_shards_merge_once_there_are_two():
+    data = _batches(4, 256)
+    single = StatsAggregator()
+    only = single.new_shard()
+    for batch in data:
+        only.update(batch)
+    only.publish()
+
+    agg = StatsAggregator()
+    first = agg.new_shard()
+    first.update(data[0])
+    second = agg.new_shard()
+    assert first.mergeable and second.mergeable
+    for shard, batch in zip((first, second, first), data[1:]):
+        shard.update(batch)
+    first.publish_if_dirty()
+    second.publish_if_dirty()
+    merged, expected = agg.snapshot(), single.snapshot()
+    assert merged["totalPackets"] == expected["totalPackets"]
+    assert merged["uniqueIPs"] == expected["uniqueIPs"]
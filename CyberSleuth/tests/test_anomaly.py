@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+
+import anomaly
+from anomaly import AnomalyDetector
+from sketches import hash64
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def columns(n=400, seed=0):
+    rng = np.random.default_rng(seed)
+    ts = np.sort(rng.uniform(0, 20, n))
+    srcs = [f"10.0.0.{i % 5}" if i % 7 else "?" for i in range(n)]
+    dsts = [f"10.0.1.{rng.integers(50)}" if s != "?" else "?" for s in srcs]
+    protos = np.array([6 if s != "?" else -1 for s in srcs])
+    sizes = rng.integers(60, 1500, n)
+    dports = np.where(protos >= 0, rng.integers(1, 1024, n), 0)
+    flags = np.where(protos == 6, 0x10, 0)
+    return ts, srcs, dsts, protos, sizes, dports, flags
+
+
+def test_score_columns_skips_non_ip_like_update_stats():
+    ts, srcs, dsts, protos, sizes, dports, flags = columns()
+    batch = AnomalyDetector()
+    scores = batch.score_columns(ts, srcs, dsts, protos, sizes, dports, flags)
+    assert "?" not in batch.hosts
+    assert (scores[protos < 0] == 0).all()
+
+    ip = protos >= 0
+    only_ip = AnomalyDetector()
+    pick = np.flatnonzero(ip).tolist()
+    expected = only_ip.score_columns(ts[ip], [srcs[i] for i in pick], [dsts[i] for i in pick],
+                                     protos[ip], sizes[ip], dports[ip], flags[ip])
+    assert np.array_equal(scores[ip], expected)
+    assert list(batch.hosts) == list(only_ip.hosts)
+    for key, h in batch.hosts.items():
+        other = only_ip.hosts[key]
+        assert all(getattr(h, name) == getattr(other, name) for name in h.__slots__)
+
+
+def test_score_columns_matches_observe_host_set():
+    ts, srcs, dsts, protos, sizes, dports, flags = columns(seed=1)
+    batch, scalar = AnomalyDetector(), AnomalyDetector()
+    batch.score_columns(ts, srcs, dsts, protos, sizes, dports, flags)
+    for row in zip(ts.tolist(), srcs, dsts, protos.tolist(), sizes.tolist(), dports.tolist(), flags.tolist()):
+        if row[3] >= 0:
+            scalar.observe(*row)
+    assert set(batch.hosts) == set(scalar.hosts)
+    for key in batch.hosts:
+        assert batch.hosts[key].n == scalar.hosts[key].n
+
+
+def test_vendored_copy_matches():
+    with open(os.path.join(HERE, "..", "anomaly.py"), encoding="utf-8") as f:
+        ours = f.read()
+    with open(os.path.join(HERE, "..", "..", "Network packet analysis", "anomaly.py"), encoding="utf-8") as f:
+        theirs = f.read()
+    assert theirs[theirs.index("import math"):] == ours
+
+
+def test_destination_hash_is_the_sketches_hash():
+    # hash() of a str changes with PYTHONHASHSEED; scores must not
+    assert all(anomaly._hash64(k) == hash64(k) for k in ("10.0.0.1", "fe80::1", b"x", 42))
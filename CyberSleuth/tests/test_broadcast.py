@@ -0,0 +1,16 @@
+from broadcast import Broadcaster
+from capture import packet_record
+from ringbuffer import PacketRing
+
+
+def test_dropped_frames_total_survives_unsubscribe():
+    broadcaster = Broadcaster(PacketRing(64), packet_record, lambda: {}, stats_interval=0.05)
+    slow = broadcaster.subscribe(max_queue=2)
+    for i in range(5):
+        slow.offer(str(i), "packets")
+    broadcaster.unsubscribe(slow)
+    broadcaster.unsubscribe(slow)
+    broadcaster.stop()
+    assert broadcaster.subscribers == ()
+    assert slow.dropped_frames >= 3
+    assert broadcaster.dropped_frames() == slow.dropped_frames
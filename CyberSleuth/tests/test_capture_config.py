@@ -0,0 +1,50 @@
+import threading
+
+import pytest
+
+import network
+from capture import capture_config
+from network import app
+
+
+@pytest.mark.parametrize("body", [
+    {"protocol": 5},
+    {"protocol": [1]},
+    {"ip": {"a": 1}},
+    {"cidr": ["10.0.0.0/8", None]},
+    {"iface": ["eth0"]},
+    {"filter": 80},
+    {"mode": ["raw"]},
+])
+def test_capture_config_rejects_non_string_fields(body):
+    with pytest.raises(ValueError):
+        capture_config(body)
+
+
+def test_capture_config_accepts_strings_and_lists():
+    config = capture_config({"protocol": "tcp", "ip": ["10.0.0.1"], "cidr": []})
+    assert config["protocol"] == ["tcp"]
+    assert config["ip"] == ["10.0.0.1"]
+
+
+@pytest.mark.parametrize("body", [{"protocol": 5}, {"protocol": [1]}, [1], {"name": 3}])
+def test_create_session_rejects_bad_bodies_with_400(body):
+    resp = app.test_client().post("/api/sessions", json=body)
+    assert resp.status_code == 400
+    assert "error" in resp.get_json()
+
+
+def test_concurrent_creates_get_distinct_ids():
+    ids = []
+
+    def create():
+        resp = app.test_client().post("/api/sessions", json={"name": "x"})
+        ids.append(resp.get_json()["id"])
+
+    threads = [threading.Thread(target=create) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(ids)) == 20
+    assert all(network.sessions[i].id == i for i in ids)
@@ -0,0 +1,44 @@
+from scapy.all import Ether, IP, IPv6, TCP, UDP
+
+from capture import CaptureSession, dissect
+from store import SegmentWriter, PACKETS
+
+
+def write_packets(session, n):
+    writer = SegmentWriter(session.store_prefix("packets"), PACKETS)
+    for i in range(1, n + 1):
+        writer.append((i, 1000.0 + i, "10.0.0.1", "10.0.0.2", 6, 60, 1234, 80, 2, 0.0))
+    writer.close()
+
+
+def test_new_run_does_not_read_an_earlier_runs_segments(tmp_path):
+    # session ids restart at 1 in every server process
+    first = CaptureSession(1, "first", store_dir=str(tmp_path), metrics=False, enrich=False, run_id="run-a")
+    write_packets(first, 5)
+    second = CaptureSession(1, "second", store_dir=str(tmp_path), metrics=False, enrich=False, run_id="run-b")
+    assert list(second.query_packets()) == []
+    assert second.disk_usage() == 0
+    write_packets(second, 3)
+    assert [p["id"] for p in second.query_packets()] == [1, 2, 3]
+    assert len(list(first.query_packets())) == 5
+
+
+def test_default_run_id_is_shared_by_sessions_of_one_process(tmp_path):
+    a = CaptureSession(1, "a", store_dir=str(tmp_path), metrics=False, enrich=False)
+    b = CaptureSession(2, "b", store_dir=str(tmp_path), metrics=False, enrich=False)
+    assert a.run_id == b.run_id
+    assert a.store_prefix("packets") != b.store_prefix("packets")
+
+
+def test_scapy_mode_ring_keeps_frame_bytes(tmp_path):
+    session = CaptureSession(1, "s", store_dir=str(tmp_path), metrics=False, enrich=False, run_id="run")
+    frames = [Ether() / IP(src="10.0.0.1", dst="10.0.0.2") / TCP(dport=80, flags="S"),
+              IP(src="10.0.0.3", dst="10.0.0.4") / UDP(dport=53),
+              IPv6(src="fe80::1", dst="fe80::2") / TCP(dport=443)]
+    for frame in frames:
+        session.packet_handler(frame.__class__(bytes(frame)))
+    for pid, frame in enumerate(frames, 1):
+        rec = session.ring.find(pid)
+        stored = rec[-1]
+        assert isinstance(stored, (bytes, tuple))
+        assert dissect(stored)[0] == frame.__class__(bytes(frame)).summary()
@@ -0,0 +1,39 @@
+import threading
+import time
+
+from metrics import SessionMetrics
+
+
+def run(fn):
+    t = threading.Thread(target=fn)
+    t.start()
+    t.join()
+
+
+def test_retired_threads_keep_their_counts_but_not_their_histograms():
+    metrics = SessionMetrics()
+
+    def connection():
+        metrics.histogram("send").record(1000)
+        metrics.retire()
+
+    for _ in range(50):
+        run(connection)
+    assert metrics.histograms["send"] == ()
+    assert metrics.merged("send").count == 50
+
+
+def test_cpu_total_survives_a_new_thread():
+    metrics = SessionMetrics()
+    totals = []
+
+    def worker():
+        end = time.thread_time() + 0.02
+        while time.thread_time() < end:
+            pass
+        metrics.sample_cpu("stats")
+        totals.append(metrics.cpu["stats"])
+
+    run(worker)
+    run(worker)
+    assert totals[1] > totals[0] >= 0.02
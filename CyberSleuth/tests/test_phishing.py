@@ -0,0 +1,68 @@
+import io
+
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import phishing
+
+
+def test_read_urls_jsonl_skips_bad_lines():
+    lines = io.StringIO('{"url": "http://a.com"}\nnot json\n[1, 2]\n"http://b.com"\n\n{"url": "http://c.com"}\n')
+    stats = {}
+    assert list(phishing.read_urls(lines, 'jsonl', stats=stats)) == ["http://a.com", "http://c.com"]
+    assert stats['skipped'] == 3
+
+
+def test_read_urls_csv_unknown_column_fails():
+    with pytest.raises(ValueError, match="link"):
+        phishing.read_urls(io.StringIO("url,label\nhttp://a.com,1\n"), 'csv', 'link')
+    assert list(phishing.read_urls(io.StringIO("link\nhttp://a.com\n\n"), 'csv', 'link')) == ["http://a.com"]
+
+
+FEATURE_URLS = ["", " ", "http://example.com", "HTTPS://Secure-Login.Example.co.uk/account/verify?id=1&x=_",
+                "http://192.168.0.1/login", "bücher.de/straße?q=ä", "http://例え.jp/パス", "http://a.com/\x00x",
+                "\x00", "user@host:8080/p_a-t.h", "https://" + "a" * 300 + ".com/" + "b/" * 50, "ftp://x.y/z=1=2"]
+
+
+def test_batch_features_match_scalar_path():
+    urls = FEATURE_URLS + FEATURE_URLS[::-1]
+    X = phishing.extract_url_features_batch(urls)
+    assert X.dtype == phishing.np.float32 and X.shape == (len(urls), len(phishing.FEATURE_NAMES))
+    for url, row in zip(urls, X):
+        feats = phishing.extract_url_features(url)
+        expected = phishing.np.array([feats[name] for name in phishing.FEATURE_NAMES], dtype=phishing.np.float32)
+        assert (row == expected).all(), url
+
+
+def test_batch_features_of_nothing():
+    assert phishing.extract_url_features_batch([]).shape == (0, len(phishing.FEATURE_NAMES))
+
+
+@pytest.fixture(scope="module")
+def forest():
+    df = phishing.build_demo_url_dataset(200, 200)
+    X, y, _ = phishing.prepare_features(df)
+    clf = RandomForestClassifier(n_estimators=25, random_state=0, class_weight='balanced').fit(X, y)
+    return clf, X
+
+
+@pytest.mark.parametrize("rows", [1, 7, phishing.COMPILED_ROWS])
+def test_compiled_forest_is_bit_identical(forest, rows):
+    clf, X = forest
+    compiled = phishing.CompiledForest(clf)
+    rng = phishing.np.random.default_rng(rows)
+    # training rows, rows sitting exactly on split thresholds, and random ones
+    thresholds = compiled.threshold[compiled.left != compiled.right]
+    on_split = rng.choice(thresholds, size=(rows, X.shape[1])).astype(phishing.np.float32)
+    noise = rng.uniform(-5, 200, size=(rows, X.shape[1])).astype(phishing.np.float32)
+    for sample in (X[rng.integers(0, len(X), rows)], on_split, noise):
+        assert phishing.np.array_equal(compiled.predict_proba(sample), clf.predict_proba(sample))
+    assert phishing.np.array_equal(compiled.predict(sample), clf.predict(sample))
+
+
+def test_compiled_forest_single_row_and_url_features(forest):
+    clf, _ = forest
+    compiled = phishing.CompiledForest(clf)
+    X = phishing.extract_url_features_batch(FEATURE_URLS)
+    assert phishing.np.array_equal(compiled.predict_proba(X), clf.predict_proba(X))
+    assert phishing.np.array_equal(compiled.predict_proba(X[0]), clf.predict_proba(X[:1]))
@@ -0,0 +1,32 @@
+from scans import ScanDetector, TCP_SYN, TCP_ACK
+
+
+def test_browser_like_client_is_not_a_scan():
+    scans = ScanDetector()
+    client = "10.0.0.5"
+    alerts = []
+    t = 0.0
+    for i in range(80):
+        server = f"93.184.{i // 200}.{i % 200 + 1}"
+        t += 0.05
+        alerts.append(scans.observe(t, client, "10.0.0.1", 17, 53, 0))         # DNS lookup
+        alerts.append(scans.observe(t, client, server, 17, 443, 0))            # QUIC
+        alerts.append(scans.observe(t, client, server, 6, 443, TCP_SYN))
+        scans.observe(t + 0.01, server, client, 6, 50000 + i, TCP_SYN | TCP_ACK)
+        if i % 10 == 0:
+            alerts.append(scans.observe(t, client, "10.0.0.2", 17, 123, 0))    # NTP
+    assert [a for a in alerts if a] == []
+
+
+def test_unanswered_syn_sweep_is_a_horizontal_scan():
+    scans = ScanDetector()
+    alerts = [scans.observe(i * 0.01, "10.0.0.9", f"10.1.0.{i}", 6, 22, TCP_SYN) for i in range(1, 120)]
+    alerts = [a for a in alerts if a]
+    assert alerts and alerts[0]["scanType"] == "horizontal"
+
+
+def test_udp_port_sweep_is_a_vertical_scan():
+    scans = ScanDetector()
+    alerts = [scans.observe(i * 0.01, "10.0.0.9", "10.1.0.1", 17, i, 0) for i in range(1, 400)]
+    alerts = [a for a in alerts if a]
+    assert alerts and alerts[0]["scanType"] == "vertical"
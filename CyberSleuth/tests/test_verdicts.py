@@ -0,0 +1,99 @@
+import os
+
+import joblib
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+import phishing
+import scoring
+import verdicts
+
+URLS = ["http://paypal.com/login?fbclid=1&_ga=2&utm_campaign=zz",
+        "HTTP://PayPal.com:80/login",
+        "https://example.com/account/verify?id=7&utm_source=mail"]
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    # scoring and predict_url load phishing.MODEL_PATH, relative to the cwd
+    df = phishing.build_demo_url_dataset(100, 100)
+    X, y, names = phishing.prepare_features(df)
+    clf = RandomForestClassifier(n_estimators=10, random_state=0).fit(X, y)
+    os.makedirs(tmp_path / "models")
+    joblib.dump({"model": clf, "feature_names": names}, tmp_path / phishing.MODEL_PATH)
+    monkeypatch.chdir(tmp_path)
+    phishing.registry.clear()
+    yield tmp_path
+    phishing.registry.clear()
+
+
+def set_cache(monkeypatch, enabled):
+    monkeypatch.setattr(verdicts, "ENABLED", enabled)
+    monkeypatch.setattr(verdicts, "_shared", None)
+    monkeypatch.setattr(verdicts, "DB_PATH", None)
+
+
+def test_canonical_url():
+    assert verdicts.canonical_url(" HTTPS://Example.COM:443/Path?utm_source=x&a=1&FBCLID=2#f ") == \
+        "https://example.com/Path?a=1#f"
+    assert verdicts.canonical_url("http://[2001:DB8::1]:80/a") == "http://[2001:db8::1]/a"
+    assert verdicts.canonical_url("http://host:8080/") == "http://host:8080/"
+    assert verdicts.canonical_url("example.com/login") == "example.com/login"
+
+
+def test_score_same_with_cache_on_and_off(model_dir, monkeypatch):
+    set_cache(monkeypatch, False)
+    off, timing = scoring.score(URLS)
+    assert timing["cacheHits"] == 0
+    set_cache(monkeypatch, True)
+    on, _ = scoring.score(URLS)
+    again, timing = scoring.score(URLS)
+    assert timing["cacheHits"] == len(URLS)
+    assert off == on == again
+    for url, result in zip(URLS, off):
+        assert result["url"] == verdicts.canonical_url(url)
+        assert result["features"]["url_length"] == len(result["url"])
+
+
+def test_predict_url_same_with_cache_on_and_off(model_dir, monkeypatch):
+    set_cache(monkeypatch, False)
+    off = [phishing.predict_url(u) for u in URLS]
+    set_cache(monkeypatch, True)
+    on = [phishing.predict_url(u) for u in URLS]
+    assert verdicts.current().stats()["hits"] == 1    # URLS[1] canonicalises to URLS[0]'s key
+    assert [r["phish_probability"] for r in off] == [r["phish_probability"] for r in on]
+    assert [r["url"] for r in off] == [r["url"] for r in on]
+
+
+def test_persisted_verdicts_survive_a_restart(tmp_path):
+    db = str(tmp_path / "verdicts.db")
+    cache = verdicts.VerdictCache(path=db)
+    cache.put("http://a.com/", "1:1", {"prediction": 1})
+    cache.close()
+    cache = verdicts.VerdictCache(path=db)
+    assert cache.get("http://a.com/", "1:1") == {"prediction": 1}
+    assert cache.get("http://a.com/", "2:1") is None    # a newer model file
+    assert cache.stats()["diskHits"] == 1
+    cache.close()
+
+
+def test_training_features_use_the_served_form():
+    df = phishing.pd.DataFrame({"url": URLS, "label": [1, 0, 1]})
+    X, _, names = phishing.prepare_features(df)
+    served = phishing.extract_url_features_batch([verdicts.canonical_url(u) for u in URLS], names)
+    assert (X == served).all()
+
+
+def test_cached_results_are_copies(model_dir, monkeypatch):
+    set_cache(monkeypatch, True)
+    first = phishing.predict_url(URLS[0])
+    first["prediction"] = "edited"
+    first["features"]["url_length"] = -1
+    again = phishing.predict_url(URLS[0])
+    assert again["prediction"] != "edited" and again["features"]["url_length"] > 0
+    again["features"]["url_length"] = -1
+    results, _ = scoring.score(URLS[:1])
+    assert results[0]["features"]["url_length"] > 0
+    results[0]["features"]["url_length"] = -1
+    results, timing = scoring.score(URLS[:1])
+    assert timing["cacheHits"] == 1 and results[0]["features"]["url_length"] > 0
@@ -0,0 +1,212 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
+
+from cache import TTLCache
+
+# Cache of phishing verdicts in front of the model. Keys are canonical URLs,
+# so the same link seen with a different host case, an explicit default
+# port or fresh utm_* parameters is scored once. Entries are tagged with the
+# model file version they came from and ignored once the registry reloads a
+# newer model. With a path, verdicts are also written to sqlite and read
+# back after a restart.
+
+ENABLED = os.environ.get("CYBERSLEUTH_VERDICT_CACHE", "1") != "0"
+DB_PATH = os.environ.get("CYBERSLEUTH_VERDICT_DB")      # unset: memory only
+
+CACHE_SLOTS = 100000         # verdicts kept in memory
+DISK_SLOTS = 1000000         # verdicts kept in sqlite
+TTL = 86400.0                # seconds a verdict is reused
+COMMIT_EVERY = 500           # sqlite writes per transaction
+COMMIT_INTERVAL = 2.0        # ... or seconds, whichever comes first
+PRUNE_EVERY = 100            # commits between expiry / size sweeps of the sqlite table
+
+DEFAULT_PORTS = {"http": "80", "https": "443", "ftp": "21"}
+TRACKING_PARAMS = frozenset(("fbclid", "gclid", "dclid", "gbraid", "wbraid", "msclkid", "yclid", "mc_cid", "mc_eid",
+                             "igshid", "mkt_tok", "_ga", "_gl", "_hsenc", "_hsmi", "ref_src", "spm"))
+
+
+def _is_tracking(pair):
+    name = unquote_plus(pair.split("=", 1)[0]).lower()
+    return name.startswith("utm_") or name in TRACKING_PARAMS
+
+
+# Lowercased scheme and host, no default port, no tracking parameters. The
+# rest of the URL (userinfo, path, the other parameters and their order and
+# escaping, fragment) is kept as it was, since it feeds the model. Strings
+# without a scheme and host are only stripped.
+def canonical_url(url):
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    userinfo, at, hostport = parts.netloc.rpartition("@")
+    host, colon, port = hostport.rpartition(":")
+    if not colon or "]" in port:
+        host, port = hostport, ""
+    if port == DEFAULT_PORTS.get(scheme):
+        port = ""
+    netloc = userinfo + at + host.lower() + (":" + port if port else "")
+    query = "&".join(p for p in parts.query.split("&") if p and not _is_tracking(p))
+    return urlunsplit((scheme, netloc, parts.path, query, parts.fragment))
+
+
+class VerdictCache:
+    def __init__(self, capacity=CACHE_SLOTS, ttl=TTL, path=None, disk_capacity=DISK_SLOTS):
+        self.memory = TTLCache(capacity)
+        self.ttl = ttl
+        self.disk_capacity = disk_capacity
+        self.lock = threading.Lock()        # the sqlite connection
+        self.db = None
+        self.unsaved = 0
+        self.saved_at = time.time()
+        self.commits = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.stores = 0
+        if path:
+            self.open(path)
+
+    def open(self, path):
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute("CREATE TABLE IF NOT EXISTS verdicts "
+                   "(key TEXT PRIMARY KEY, model TEXT, expires REAL, verdict TEXT)")
+        db.execute("CREATE INDEX IF NOT EXISTS verdicts_expires ON verdicts (expires)")
+        with self.lock:
+            self.db = db
+            self._prune(time.time())
+
+    # Verdicts for `keys` (canonical URLs) from model `version`, None where
+    # there is none: memory first, then one sqlite query for the rest.
+    def get_many(self, keys, version):
+        now = time.time()
+        out = []
+        missing = []
+        for i, key in enumerate(keys):
+            found, entry = self.memory.get(key, now)
+            if found and entry[0] == version:
+                self.hits += 1
+                out.append(entry[1])
+                continue
+            if found:
+                self.stale += 1
+            out.append(None)
+            missing.append(i)
+        if missing and self.db is not None:
+            wanted = list({keys[i] for i in missing})
+            rows = {}
+            with self.lock:
+                for lo in range(0, len(wanted), 500):
+                    chunk = wanted[lo:lo + 500]
+                    rows.update((r[0], r[1:]) for r in self.db.execute(
+                        "SELECT key, model, expires, verdict FROM verdicts WHERE key IN (%s)" % ",".join("?" * len(chunk)),
+                        chunk))
+            for i in missing:
+                row = rows.get(keys[i])
+                if row is None or row[0] != version or row[1] <= now:
+                    continue
+                verdict = json.loads(row[2])
+                self.memory.put(keys[i], (version, verdict), row[1] - now, now)
+                self.disk_hits += 1
+                out[i] = verdict
+        self.misses += out.count(None)
+        return out
+
+    def get(self, key, version):
+        return self.get_many([key], version)[0]
+
+    def put_many(self, items, version):
+        now = time.time()
+        expires = now + self.ttl
+        for key, verdict in items:
+            self.memory.put(key, (version, verdict), self.ttl, now)
+        self.stores += len(items)
+        if self.db is None:
+            return
+        with self.lock:
+            self.db.executemany("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+                                [(key, version, expires, json.dumps(verdict)) for key, verdict in items])
+            self.unsaved += len(items)
+            if self.unsaved >= COMMIT_EVERY or now - self.saved_at >= COMMIT_INTERVAL:
+                self._commit(now)
+
+    def put(self, key, version, verdict):
+        self.put_many([(key, verdict)], version)
+
+    # Caller holds self.lock.
+    def _commit(self, now):
+        self.db.commit()
+        self.unsaved = 0
+        self.saved_at = now
+        self.commits += 1
+        if self.commits % PRUNE_EVERY == 0:
+            self._prune(now)
+
+    def _prune(self, now):
+        self.db.execute("DELETE FROM verdicts WHERE expires <= ?", (now,))
+        excess = self.db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0] - self.disk_capacity
+        if excess > 0:
+            self.db.execute("DELETE FROM verdicts WHERE key IN "
+                            "(SELECT key FROM verdicts ORDER BY expires LIMIT ?)", (excess,))
+        self.db.commit()
+
+    def flush(self):
+        if self.db is not None:
+            with self.lock:
+                self._commit(time.time())
+
+    def close(self):
+        if self.db is not None:
+            self.flush()
+            with self.lock:
+                self.db.close()
+                self.db = None
+
+    def stats(self):
+        memory = self.memory
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hitRate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            "entries": len(memory),
+            "evictions": memory.evictions,
+            "stores": self.stores,
+            "persistent": self.db is not None
+        }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+# The process-wide VerdictCache, created on first use (persisted to
+# CYBERSLEUTH_VERDICT_DB if set); None when disabled.
+def shared_cache():
+    global _shared
+    if not ENABLED:
+        return None
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = VerdictCache(path=DB_PATH)
+                atexit.register(_shared.close)
+    return _shared
+
+
+def current():
+    return _shared
@@ -1,43 +1,166 @@
-from scapy.all import sniff, IP
+from scapy.all import AsyncSniffer, IP, TCP, UDP
 import threading, time
-import queue
-
-packet_queue = queue.Queue()
-packet_id = 0
-
-def packet_handler(packet):
-    global packet_id
-    packet_id += 1
-    timestamp = time.strftime("%H:%M:%S", time.localtime())
-
-    proto = "OTHER"
-    size = len(packet)
-    src, dst = "?", "?"
-    info = ""
-
-    if IP in packet:
-        src = packet[IP].src
-        dst = packet[IP].dst
-        proto = packet[IP].proto
-        info = packet.summary()
-
-    pkt = {
-        "id": packet_id,
-        "timestamp": timestamp,
-        "source": src,
-        "destination": dst,
-        "protocol": proto,
-        "size": size,
-        "info": info,
-        "score": round(size % 100 / 10, 2)  
-    }
-
-    packet_queue.put(pkt)
-
-def start_sniffer(iface=None):
-    sniff(prn=packet_handler, store=False, iface=iface)
-
-def run_sniffer_background():
-    thread = threading.Thread(target=start_sniffer, daemon=True)
-    thread.start()
+from collections import deque
 
+from anomaly import AnomalyDetector
+
+RECENT_PACKETS = 10000      # packets kept for /get_packets
+INTAKE_PACKETS = 50000      # captured packets waiting for the drain thread before the oldest is dropped
+DRAIN_BATCH = 512
+
+
+class RecentPackets:
+    # Fixed ring of the last `capacity` packet dicts, addressed by id. The
+    # drain thread is the only writer: it fills slots, then publishes the new
+    # last_id. Readers never lock; they walk only the ids they were asked for
+    # and skip a slot whose id does not match (overwritten while they read).
+    def __init__(self, capacity=RECENT_PACKETS):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.last_id = 0
+        self.changed = threading.Condition()
+
+    def write(self, pkt):
+        self.slots[pkt["id"] % self.capacity] = pkt
+
+    def publish(self, last_id):
+        with self.changed:
+            self.last_id = last_id
+            self.changed.notify_all()
+
+    # Blocks until a packet after since_id is published or `timeout` seconds
+    # pass; True if there is something new to read. A cursor ahead of
+    # last_id (from before a restart) returns at once, as since() resets it.
+    def wait(self, since_id, timeout):
+        with self.changed:
+            return self.changed.wait_for(lambda: self.last_id != since_id, timeout)
+
+    # Packets with id > since_id, at most the newest `limit` of them, plus the
+    # last published id (the client's next cursor) and how many packets after
+    # since_id it will never see. since_id 0, or one from before a restart,
+    # means "the newest `limit`". Copies only the packets returned.
+    def since(self, since_id=0, limit=None):
+        last = self.last_id
+        if since_id > last:
+            since_id = 0
+        first = max(since_id + 1, last - self.capacity + 1, 1)
+        if limit is not None:
+            first = max(first, last - limit + 1)
+        out = []
+        slots, capacity = self.slots, self.capacity
+        for pid in range(first, last + 1):
+            pkt = slots[pid % capacity]
+            if pkt is not None and pkt["id"] == pid:
+                out.append(pkt)
+        missed = last - since_id - len(out) if since_id else 0
+        return out, last, missed
+
+
+class CaptureService:
+    # Scapy's sniffer thread only appends packets to a bounded intake deque;
+    # a drain thread turns them into dicts, scores them and publishes them to
+    # the RecentPackets ring in batches. Both buffers are bounded, so a
+    # traffic burst costs dropped packets (counted), never unbounded memory.
+    def __init__(self, iface=None, capacity=RECENT_PACKETS, intake=INTAKE_PACKETS):
+        self.iface = iface
+        self.recent = RecentPackets(capacity)
+        self.intake = deque(maxlen=intake)
+        self.intake_ready = threading.Event()
+        self.detector = AnomalyDetector()
+        self.captured = 0
+        self.dropped = 0
+        self.sniffer = None
+        self.drainer = None
+        self.running = False
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.drainer = threading.Thread(target=self.drain, daemon=True)
+        self.drainer.start()
+        self.sniffer = AsyncSniffer(prn=self.packet_handler, store=False, iface=self.iface)
+        self.sniffer.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.sniffer.stop()
+        self.running = False
+        self.intake_ready.set()
+        self.drainer.join()
+
+    # Runs on the sniffer thread: queue and return.
+    def packet_handler(self, packet):
+        self.captured += 1
+        if len(self.intake) == self.intake.maxlen:
+            self.dropped += 1       # deque drops the oldest
+        self.intake.append(packet)
+        self.intake_ready.set()
+
+    def drain(self):
+        intake, recent = self.intake, self.recent
+        next_id = recent.last_id + 1
+        while self.running or intake:
+            if not intake:
+                self.intake_ready.wait(0.5)
+                self.intake_ready.clear()
+                continue
+            for _ in range(DRAIN_BATCH):
+                try:
+                    packet = intake.popleft()
+                except IndexError:
+                    break
+                recent.write(self.describe(next_id, packet))
+                next_id += 1
+            recent.publish(next_id - 1)
+
+    def describe(self, pid, packet):
+        captured_at = float(packet.time)
+        proto = "OTHER"
+        size = len(packet)
+        src, dst = "?", "?"
+        info = ""
+        score = 0.0
+
+        if IP in packet:
+            src = packet[IP].src
+            dst = packet[IP].dst
+            proto = packet[IP].proto
+            info = packet.summary()
+            dport, flags = 0, 0
+            if TCP in packet:
+                dport, flags = packet[TCP].dport, int(packet[TCP].flags)
+            elif UDP in packet:
+                dport = packet[UDP].dport
+            score = self.detector.observe(captured_at, src, dst, proto, size, dport, flags)
+
+        return {
+            "id": pid,
+            "timestamp": time.strftime("%H:%M:%S", time.localtime(captured_at)),
+            "time": captured_at,
+            "source": src,
+            "destination": dst,
+            "protocol": proto,
+            "size": size,
+            "info": info,
+            "score": round(score * 10, 2)
+        }
+
+    def packets(self, since_id=0, limit=None):
+        return self.recent.since(since_id, limit)
+
+    # since() once something newer than since_id exists, or an empty result
+    # after `timeout` seconds.
+    def wait_packets(self, since_id=0, limit=None, timeout=None):
+        self.recent.wait(since_id, timeout)
+        return self.recent.since(since_id, limit)
+
+    def status(self):
+        return {
+            "running": self.running,
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "queued": len(self.intake),
+            "lastId": self.recent.last_id
+        }
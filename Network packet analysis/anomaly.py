@@ -0,0 +1,295 @@
+# Vendored from CyberSleuth/anomaly.py so this server runs on its own;
+# keep the two copies identical below this comment
+# (CyberSleuth/tests/test_anomaly.py checks).
+
+import math
+from collections import OrderedDict
+from hashlib import blake2b
+
+try:
+    import numpy as np
+except ImportError:      # batch scoring is optional; observe() needs only the stdlib
+    np = None
+
+HOST_SLOTS = 65536           # source hosts tracked before the least recently seen is forgotten
+WINDOW = 1.0                 # seconds per rate / fan-out / new-destination window
+RATE_ALPHA = 0.1             # EWMA weight of one closed window in a host's baselines
+WARMUP_PACKETS = 32          # packets before a host's size baseline is trusted
+WARMUP_WINDOWS = 10          # closed windows before its window baselines are trusted
+IDLE_WINDOWS = 30            # a longer silence only feeds this many empty windows into the baselines
+PORT_BITS = 1024             # per-window linear-counting bitmap for distinct destination ports
+DST_BITS = 2048              # per-host bitmap of destinations seen, in two generations
+KNOWN_ROTATE = 300           # windows before the older destination generation is forgotten
+SYN_MIN = 20                 # bare SYNs in a window before the SYN/ACK ratio counts
+Z_SCALE = 3 / math.log(2)    # a 3-sigma deviation scores 0.5, 6 sigma 0.75
+ANOMALY_THRESHOLD = 0.7
+
+TCP_SYN = 0x02
+TCP_ACK = 0x10
+
+
+# sketches.hash64, repeated here so this module needs nothing else from the
+# package: stable across processes, unlike hash(), so the same traffic
+# scores the same in every run.
+def _hash64(key):
+    if not isinstance(key, bytes):
+        key = str(key).encode()
+    return int.from_bytes(blake2b(key, digest_size=8).digest(), "little")
+
+
+def _ewma(mean, var, x):
+    d = x - mean
+    return mean + RATE_ALPHA * d, (1 - RATE_ALPHA) * (var + RATE_ALPHA * d * d)
+
+
+# Spread of a window baseline for z-scores. Counts are at least Poisson-noisy,
+# so it never drops below sqrt(mean) + 1; a host that sends exactly one packet
+# a second does not alarm on its third.
+def _spread(mean, var):
+    return math.sqrt(max(var, mean)) + 1
+
+
+def _distinct(ones, bits):
+    if ones >= bits:
+        return bits * math.log(bits)
+    return -bits * math.log(1 - ones / bits)
+
+
+def _syn_z(syns, acks):
+    if syns < SYN_MIN:
+        return 0.0
+    ratio = syns / (acks + 1)
+    return 3 * math.log2(ratio) if ratio > 1 else 0.0
+
+
+def to_score(z):
+    return 1 - math.exp(-z / Z_SCALE) if z > 0 else 0.0
+
+
+class HostState:
+    __slots__ = ("n", "mean", "m2", "window", "count", "syns", "acks", "ports", "port_ones", "new_dsts",
+                 "windows", "rate_mean", "rate_var", "fan_mean", "fan_var", "new_mean", "new_var",
+                 "rate_sd", "fan_sd", "new_sd", "known", "known_old", "known_age")
+
+    def __init__(self, window):
+        self.n = 0                  # Welford over packet sizes
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.window = window        # counters below belong to this window
+        self.count = 0
+        self.syns = 0
+        self.acks = 0
+        self.ports = 0              # PORT_BITS-wide bitmap as an int
+        self.port_ones = 0
+        self.new_dsts = 0
+        self.windows = 0            # closed windows folded into the EWMA baselines
+        self.rate_mean = self.rate_var = 0.0
+        self.fan_mean = self.fan_var = 0.0
+        self.new_mean = self.new_var = 0.0
+        self.rate_sd = self.fan_sd = self.new_sd = 1.0    # cached _spread of each baseline
+        self.known = 0              # DST_BITS-wide bitmaps
+        self.known_old = 0
+        self.known_age = 0
+
+    def size_z(self, size):
+        if self.n < WARMUP_PACKETS:
+            return 0.0
+        return abs(size - self.mean) / (math.sqrt(self.m2 / (self.n - 1)) + 1)
+
+    def window_z(self):
+        z = _syn_z(self.syns, self.acks)
+        if self.windows < WARMUP_WINDOWS:
+            return z
+        fan = _distinct(self.port_ones, PORT_BITS) if self.port_ones > self.fan_mean else 0.0
+        return max(z,
+                   (self.count - self.rate_mean) / self.rate_sd,
+                   (fan - self.fan_mean) / self.fan_sd,
+                   (self.new_dsts - self.new_mean) / self.new_sd)
+
+    # Fold the open window (and up to IDLE_WINDOWS empty ones after it) into
+    # the baselines and start `window`.
+    def roll(self, window):
+        gap = window - self.window
+        for _ in range(min(gap, IDLE_WINDOWS)):
+            self.rate_mean, self.rate_var = _ewma(self.rate_mean, self.rate_var, self.count)
+            self.fan_mean, self.fan_var = _ewma(self.fan_mean, self.fan_var, _distinct(self.port_ones, PORT_BITS))
+            self.new_mean, self.new_var = _ewma(self.new_mean, self.new_var, self.new_dsts)
+            self.windows += 1
+            self.count = self.syns = self.acks = self.new_dsts = self.port_ones = 0
+        self.rate_sd = _spread(self.rate_mean, self.rate_var)
+        self.fan_sd = _spread(self.fan_mean, self.fan_var)
+        self.new_sd = _spread(self.new_mean, self.new_var)
+        self.ports = 0
+        self.known_age += gap
+        if self.known_age >= KNOWN_ROTATE:
+            self.known_old, self.known, self.known_age = self.known, 0, 0
+        self.window = window
+
+    def add_port(self, dport):
+        bit = 1 << (dport & (PORT_BITS - 1))
+        if not self.ports & bit:
+            self.ports |= bit
+            self.port_ones += 1
+
+    def add_destination(self, dst_bit):
+        bit = 1 << dst_bit
+        if not self.known & bit:
+            self.known |= bit
+            if not self.known_old & bit:
+                self.new_dsts += 1
+
+
+class AnomalyDetector:
+    # Online per-source scoring. Each packet is compared with what its source
+    # normally does before it is folded in:
+    #   size       Welford mean/variance of the host's packet sizes
+    #   rate       packets this window vs. an EWMA of past windows
+    #   fan-out    distinct destination ports this window (linear counting)
+    #   new dsts   destinations not seen from this host recently
+    #   SYN/ACK    bare SYNs vs. ACK-bearing segments this window
+    # The score is the strongest signal mapped onto [0, 1). Everything is a
+    # handful of arithmetic and bit operations per packet, and host state is
+    # a fixed-size record in a bounded LRU table.
+    def __init__(self, capacity=HOST_SLOTS):
+        self.capacity = capacity
+        self.hosts = OrderedDict()
+        self.evicted = 0
+
+    def _host(self, src, window):
+        hosts = self.hosts
+        h = hosts.get(src)
+        if h is None:
+            if len(hosts) >= self.capacity:
+                hosts.popitem(last=False)
+                self.evicted += 1
+            h = hosts[src] = HostState(window)
+        else:
+            hosts.move_to_end(src)
+        return h
+
+    def observe(self, timestamp, src, dst, proto, size, dport, flags):
+        window = int(timestamp // WINDOW)
+        h = self._host(src, window)
+        if window > h.window:
+            h.roll(window)
+
+        z = h.size_z(size)
+        h.n += 1
+        d = size - h.mean
+        h.mean += d / h.n
+        h.m2 += d * (size - h.mean)
+
+        h.count += 1
+        if proto == 6:
+            if flags & TCP_SYN and not flags & TCP_ACK:
+                h.syns += 1
+            elif flags & TCP_ACK:
+                h.acks += 1
+        if dport:
+            h.add_port(dport)
+        h.add_destination(_hash64(dst) & (DST_BITS - 1))
+        return to_score(max(z, h.window_z()))
+
+    # Vectorised scoring of a decoded pcap chunk (the column arrays that
+    # pcap_ingest.decode_chunk returns), for backlogs where per-packet Python
+    # is the bottleneck. Per-packet work (size deviation, grouping, distinct
+    # counting) runs in NumPy; Python only loops over (host, window) groups
+    # and the distinct ports / destinations inside them. Window signals use
+    # each window's final counts, so the first packets of a burst score as
+    # high as the last; otherwise the state ends up as observe() would leave
+    # it and later packets are scored the same way.
+    def score_columns(self, timestamps, srcs, dsts, protos, sizes, dports, flags):
+        n = len(timestamps)
+        if np is None:
+            raise RuntimeError("batch scoring needs numpy")
+        if n == 0:
+            return np.zeros(0, dtype=np.float32)
+        proto = np.asarray(protos, dtype=np.int64)
+        if (proto < 0).any():
+            # Non-IP frames have no source to judge and, as in update_stats,
+            # do not touch any host's state: score the IP packets on their own.
+            out = np.zeros(n, dtype=np.float32)
+            sel = np.flatnonzero(proto >= 0)
+            if len(sel):
+                pick = sel.tolist()
+                out[sel] = self.score_columns(np.asarray(timestamps)[sel], [srcs[i] for i in pick],
+                                              [dsts[i] for i in pick], proto[sel], np.asarray(sizes)[sel],
+                                              np.asarray(dports)[sel], np.asarray(flags)[sel])
+            return out
+        ts = np.asarray(timestamps, dtype=np.float64)
+        size = np.asarray(sizes, dtype=np.float64)
+        dport = np.asarray(dports, dtype=np.int64)
+        flag = np.asarray(flags, dtype=np.int64)
+        win = np.floor(ts / WINDOW).astype(np.int64)
+
+        index = {}
+        hid = np.fromiter((index.setdefault(s, len(index)) for s in srcs), np.int64, n)
+        first_window = np.full(len(index), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(first_window, hid, win)
+        states = [self._host(src, int(first_window[i])) for src, i in index.items()]
+
+        # Size deviation against each host's baseline as of the chunk start,
+        # then merge the chunk's sizes in (Chan et al.).
+        n0 = np.array([h.n for h in states], dtype=np.float64)
+        mean0 = np.array([h.mean for h in states])
+        sd0 = np.sqrt(np.array([h.m2 for h in states]) / np.maximum(n0 - 1, 1))
+        z = np.where(n0[hid] >= WARMUP_PACKETS, np.abs(size - mean0[hid]) / (sd0[hid] + 1), 0.0)
+        cnt = np.bincount(hid, minlength=len(states)).astype(np.float64)
+        mean1 = np.bincount(hid, size, len(states)) / cnt
+        m2_1 = np.bincount(hid, (size - mean1[hid]) ** 2, len(states))
+        for i, h in enumerate(states):
+            total = h.n + cnt[i]
+            d = mean1[i] - h.mean
+            h.m2 += m2_1[i] + d * d * h.n * cnt[i] / total
+            h.mean += d * cnt[i] / total
+            h.n = int(total)
+
+        # (host, window) groups in time order per host
+        base = win.min()
+        key = hid * (win.max() - base + 1) + (win - base)
+        groups, g_first, inv = np.unique(key, return_index=True, return_inverse=True)
+        inv = inv.ravel()
+        g_count = np.bincount(inv, minlength=len(groups))
+        tcp = proto == 6
+        g_syns = np.bincount(inv, tcp & (flag & TCP_SYN != 0) & (flag & TCP_ACK == 0), len(groups))
+        g_acks = np.bincount(inv, tcp & (flag & TCP_ACK != 0), len(groups))
+        g_host, g_win = hid[g_first], win[g_first]
+
+        port_groups, port_values = self._pairs(inv, dport, dport != 0, PORT_BITS)
+        bits = {}
+        dst_bits = np.fromiter((bits[d] if d in bits else bits.setdefault(d, _hash64(d) & (DST_BITS - 1))
+                                for d in dsts), np.int64, n)
+        dst_groups, dst_values = self._pairs(inv, dst_bits, None, DST_BITS)
+        port_start = np.searchsorted(port_groups, np.arange(len(groups) + 1))
+        dst_start = np.searchsorted(dst_groups, np.arange(len(groups) + 1))
+
+        g_z = np.zeros(len(groups))
+        for g in range(len(groups)):
+            h = states[g_host[g]]
+            w = int(g_win[g])
+            if w > h.window:
+                h.roll(w)
+            h.count += int(g_count[g])
+            h.syns += int(g_syns[g])
+            h.acks += int(g_acks[g])
+            for p in port_values[port_start[g]:port_start[g + 1]].tolist():
+                h.add_port(p)
+            for b in dst_values[dst_start[g]:dst_start[g + 1]].tolist():
+                h.add_destination(b)
+            g_z[g] = h.window_z()
+
+        z = np.maximum(z, g_z[inv])
+        return np.where(z > 0, 1 - np.exp(-z / Z_SCALE), 0.0).astype(np.float32)
+
+    # Distinct (group, value) pairs sorted by group, optionally masked.
+    @staticmethod
+    def _pairs(inv, values, mask, width):
+        pairs = inv * width + (values & (width - 1))
+        if mask is not None:
+            pairs = pairs[mask]
+        pairs = np.unique(pairs)
+        return pairs // width, pairs % width
+
+    def memory_bytes(self):
+        # slots record plus the bitmaps, which are at most a few hundred bytes
+        return len(self.hosts) * (200 + (PORT_BITS + 2 * DST_BITS) // 8)
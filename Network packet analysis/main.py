@@ -1,21 +1,76 @@
+import os, json
+from flask import Flask, Response, render_template, jsonify, request
+from analyser import CaptureService
 
-from flask import Flask, render_template, jsonify
-from analyzer import run_sniffer_in_background, packets_buffer
+DEFAULT_PACKETS = 20        # /get_packets without ?limit=
+POLL_TIMEOUT = 25.0         # default seconds /poll_packets holds a request open
+MAX_POLL_TIMEOUT = 60.0
+KEEPALIVE = 15.0            # seconds between SSE comments on an idle stream
 
-app = Flask(__name__)
+app = Flask(__name__, template_folder="template")
 
-# Start sniffer
-run_sniffer_in_background()
+capture = CaptureService(iface=os.environ.get("CAPTURE_IFACE") or None)
+capture.start()
 
 @app.route("/")
 def index():
     return render_template("index.html")
 
+def _cursor(default_limit=None):
+    since_id = max(0, request.args.get("since_id", 0, type=int))
+    limit = request.args.get("limit", default_limit or capture.recent.capacity, type=int)
+    return since_id, max(1, min(limit, capture.recent.capacity))
+
+# ?limit=N returns the newest N packets; ?since_id=K only those after id K
+# (all of them unless limit is given too). Poll with since_id set to the
+# previous response's lastId; `missed` counts packets after since_id that
+# the response leaves out, because they left the ring or exceeded limit.
 @app.route("/get_packets")
 def get_packets():
-    return jsonify(packets_buffer[-20:])  
+    since_id, limit = _cursor(None if "since_id" in request.args else DEFAULT_PACKETS)
+    packets, last_id, missed = capture.packets(since_id, limit)
+    return jsonify({"packets": packets, "lastId": last_id, "missed": missed})
 
-if __name__ == "__main__":
-    app.run(debug=True)
+# Long poll: like /get_packets?since_id=, but held open until a packet after
+# since_id arrives or ?timeout= seconds pass (then `packets` is empty and
+# lastId unchanged).
+@app.route("/poll_packets")
+def poll_packets():
+    since_id, limit = _cursor()
+    timeout = max(0.0, min(request.args.get("timeout", POLL_TIMEOUT, type=float), MAX_POLL_TIMEOUT))
+    packets, last_id, missed = capture.wait_packets(since_id, limit, timeout)
+    return jsonify({"packets": packets, "lastId": last_id, "missed": missed})
+
+# Server-Sent Events: one "packets" event per published batch, carrying the
+# same {packets, lastId, missed} body, with lastId as the event id so an
+# EventSource reconnect (Last-Event-ID) resumes where it stopped. Each open
+# stream holds one server thread, blocked on the ring's condition while idle.
+# Without a cursor the stream starts with the newest DEFAULT_PACKETS.
+@app.route("/stream")
+def stream():
+    since_id, limit = _cursor()
+    since_id = request.headers.get("Last-Event-ID", since_id, type=int)
+    if not since_id:
+        since_id = max(0, capture.recent.last_id - DEFAULT_PACKETS)
 
+    def events(cursor):
+        yield "retry: 2000\n\n"
+        while True:
+            packets, last_id, missed = capture.wait_packets(cursor, limit, KEEPALIVE)
+            if last_id == cursor and not packets:
+                yield ": keepalive\n\n"
+                continue
+            cursor = last_id
+            body = json.dumps({"packets": packets, "lastId": last_id, "missed": missed})
+            yield f"event: packets\nid: {last_id}\ndata: {body}\n\n"
 
+    return Response(events(since_id), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/status")
+def status():
+    return jsonify(capture.status())
+
+if __name__ == "__main__":
+    # the reloader would import this module twice and start a second sniffer
+    app.run(debug=True, use_reloader=False)
@@ -10,11 +10,12 @@ class NetworkAnalysisApp {
         this.sessionStartTime = null;
         this.durationInterval = null;
         this.trafficData = Array(20).fill(0);
+        this.stats = {};
         
         this.initializeElements();
         this.bindEvents();
-        this.connectWebSocket();
-        this.createSession();
+        // The socket is scoped to a session, so it waits for one to exist
+        this.createSession().then(() => this.connectWebSocket());
         this.initTrafficChart();
     }
 
@@ -73,7 +74,8 @@ class NetworkAnalysisApp {
 
     connectWebSocket() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-        const wsUrl = `${protocol}//${window.location.host}/ws`;
+        const query = this.currentSession ? `?session=${this.currentSession.id}` : '';
+        const wsUrl = `${protocol}//${window.location.host}/ws${query}`;
         
         this.websocket = new WebSocket(wsUrl);
         
@@ -110,12 +112,20 @@ class NetworkAnalysisApp {
             case 'packet':
                 this.addPacket(message.data);
                 break;
+            case 'batch':
+                this.addPackets(this.decodeBatch(message.data));
+                break;
             case 'stats':
-                this.updateStats(message.data);
+                // Delta frames only carry the fields that changed
+                this.stats = message.delta ? { ...this.stats, ...message.data } : message.data;
+                this.updateStats(this.stats);
                 break;
             case 'session':
                 this.updateSession(message.data);
                 break;
+            case 'alert':
+                message.data.forEach(alert => this.showAlert(alert));
+                break;
         }
     }
 
@@ -143,8 +153,14 @@ class NetworkAnalysisApp {
         if (!this.currentSession) return;
         
         try {
+            // Let the server push the current view filters down into the kernel
+            const body = {};
+            if (this.protocolFilter !== 'all') body.protocol = [this.protocolFilter];
+            if (this.ipFilter) body.ip = [this.ipFilter];
             const response = await fetch(`/api/sessions/${this.currentSession.id}/start`, {
-                method: 'POST'
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(body)
             });
             
             if (!response.ok) throw new Error('Failed to start capture');
@@ -203,13 +219,33 @@ class NetworkAnalysisApp {
     }
 
     addPacket(packetData) {
-        const packet = {
-            ...packetData,
-            timestamp: new Date(packetData.timestamp),
-            anomalyScore: packetData.anomalyScore || 0
-        };
-        
-        this.packets.unshift(packet);
+        this.addPackets([packetData]);
+    }
+
+    decodeBatch(columns) {
+        const fields = Object.keys(columns);
+        const count = fields.length ? columns[fields[0]].length : 0;
+        const rows = new Array(count);
+        for (let i = 0; i < count; i++) {
+            const row = {};
+            for (const field of fields) {
+                row[field] = columns[field][i];
+            }
+            rows[i] = row;
+        }
+        return rows;
+    }
+
+    addPackets(batch) {
+        if (batch.length === 0) return;
+        
+        for (const packetData of batch) {
+            this.packets.unshift({
+                ...packetData,
+                timestamp: new Date(packetData.timestamp),
+                anomalyScore: packetData.anomalyScore || 0
+            });
+        }
         
         // Keep only last 1000 packets
         if (this.packets.length > 1000) {
@@ -217,7 +253,7 @@ class NetworkAnalysisApp {
         }
         
         this.filterPackets();
-        this.updateTrafficChart(packet);
+        this.updateTrafficChart(this.packets[0]);
     }
 
     updateStats(stats) {
@@ -323,6 +359,26 @@ class NetworkAnalysisApp {
         this.selectedPacket = packet;
         this.filterPackets(); // Re-render to update selection
         this.renderPacketDetails();
+        if (!packet.headers) {
+            this.loadPacketDetails(packet);
+        }
+    }
+
+    async loadPacketDetails(packet) {
+        // Full dissection only happens server-side when a packet is opened
+        try {
+            const response = await fetch(`/api/sessions/${this.currentSession.id}/packets/${packet.id}`);
+            if (!response.ok) return;
+            const details = await response.json();
+            packet.info = details.info;
+            packet.headers = details.headers;
+            packet.payload = details.payload;
+            if (this.selectedPacket === packet) {
+                this.renderPacketDetails();
+            }
+        } catch (error) {
+            console.error('Failed to load packet details:', error);
+        }
     }
 
     renderPacketDetails() {
@@ -601,6 +657,17 @@ class NetworkAnalysisApp {
         return 'score-low';
     }
 
+    showAlert(alert) {
+        if (alert.kind === 'synFlood') {
+            const from = alert.source || `${alert.sources} sources`;
+            this.showToast('SYN Flood', `${alert.target} receiving ${alert.synRate} SYN/s from ${from}`, 'error');
+        } else {
+            const what = alert.scanType === 'vertical' ? `${alert.ports} ports on ${alert.target}` :
+                alert.scanType === 'horizontal' ? `${alert.hosts} hosts` : `${alert.ports} ports across ${alert.hosts} hosts`;
+            this.showToast('Port Scan', `${alert.source} probed ${what}`, 'error');
+        }
+    }
+
     showToast(title, description, type = 'success') {
         const toast = document.createElement('div');
         toast.className = `toast ${type}`;